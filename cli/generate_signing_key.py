@@ -0,0 +1,34 @@
+from config.settings import resolve_path
+import os
+
+description = "Generate a private key for RS256 / EdDSA token signing, to add on the jwt keys setting"
+
+def command():
+    ## Algorithm and key ID
+    algorithm: str = input("Algorithm, RS256 or EdDSA [EdDSA]: ").strip() or "EdDSA"
+    if algorithm not in ("RS256", "EdDSA"):
+        print(f"Error: Unknown algorithm {algorithm}")
+        exit(1)
+    kid: str = input("Key ID (kid), e.g. the date of the rotation: ").strip()
+    if not kid:
+        print("Error: Key ID is required")
+        exit(1)
+
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+
+    ## Write the key, readable by the owner only
+    key_path = os.path.join("config", "keys", f"{kid}.pem")
+    os.makedirs(os.path.dirname(resolve_path(key_path)), exist_ok = True)
+    file_descriptor = os.open(resolve_path(key_path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(file_descriptor, "wb") as key_file:
+        key_file.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    print(f"Private key written to {key_path}. Add it on config/settings.json, then set it as active_kid once other services have fetched the JWKS:")
+    print(f'    "algorithm": "{algorithm}",')
+    print(f'    "keys": [{{"kid": "{kid}", "private_key_file": "{key_path}"}}]')
+    exit(0)
@@ -0,0 +1,38 @@
+from util import user_import as ImportUtil
+from sqlmodel import Session
+import os
+import db
+
+description = "Import users in bulk from a CSV or JSON file"
+
+def get_file_path(prompt: str = "Please enter the path of the CSV / JSON file (columns: user_name, email, password, optional is_admin, is_active): ") -> str:
+    try:
+        while True:
+            entered_text: str = input(prompt)
+            if entered_text and os.path.isfile(entered_text):
+                return entered_text
+            print("File not found.\n")
+    except KeyboardInterrupt:
+        exit(0)
+
+def command():
+    file_path: str = get_file_path()
+
+    ## Reading the file
+    try:
+        rows: list[dict] = ImportUtil.read_user_table(file_path)
+    except Exception as e:
+        print("Error encountered while reading the file")
+        print(e)
+        exit(1)
+    print(f"Read {len(rows)} row(s). Importing...")
+
+    ## Importing
+    with Session(db.engine) as session:
+        report: ImportUtil.ImportReport = ImportUtil.bulk_create_users(rows, session = session)
+
+    ## Report
+    print(f"Created {report.created} user(s), {len(report.conflicts)} row(s) rejected.")
+    for conflict in report.conflicts:
+        print(f"Row {conflict.row}\t{conflict.user_name}\t{conflict.reason}")
+    exit(0)
@@ -0,0 +1,15 @@
+import migrations
+import db
+
+description = "Create missing tables and apply pending schema migrations"
+
+def command():
+    current_version: int = migrations.get_schema_version(db.engine)
+    print(f"Schema version of {db.sql_file_name}: {current_version} (latest: {migrations.latest_version()})")
+
+    ## Tables first, then migrations on top
+    db.SQLModel.metadata.create_all(db.engine)
+    applied: list[int] = migrations.run_migrations(db.engine, verbose = True)
+    if not applied:
+        print("Already up to date.")
+    exit(0)
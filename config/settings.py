@@ -0,0 +1,69 @@
+'''
+Application settings, read once from config/settings.json and cached for the whole process.
+
+Any key can be overridden with an environment variable named APP__<SECTION>__<KEY> (case insensitive), e.g.
+    APP__DB__SQLITE_FILE=/data/db.sqlite
+    APP__JWT__ACCESS_LIFETIME_S=900
+    APP__DB__SQLITE_PRAGMAS='{"busy_timeout": 10000}'
+Values are parsed as JSON when possible (numbers, true / false, objects), otherwise taken as strings.
+APP_SETTINGS_FILE points to another settings file. Relative paths in settings are relative to the project root, not the working directory.
+
+Process-local state: some settings turn on in-memory state which each worker process keeps for itself, and which only sees writes made
+by that process at once. Writes made elsewhere (CLI commands, other workers) reach it as follows:
+    jwt.stateless_access    The token epoch table is reloaded on every maintenance round (maintenance.interval_s). Until then, access
+                            tokens of a user whose password, active or admin state was changed elsewhere stay accepted. Tables not
+                            reloaded for jwt.epoch_max_age_s are not used, and every token is checked against DB.
+    blacklist_index         Refresh tokens consumed by another process are not on this process's index, so token checks of this process
+                            may accept them (rotation itself stays safe, it is a conditional UPDATE on DB). Keep it enabled with a single
+                            worker per DB file only, and set blacklist_index.enabled to false when running several workers.
+    user_cache              User read ETags and cached user listings follow the writes of this process at once, and those made
+                            elsewhere after at most user_cache.listing_max_age_s.
+'''
+from functools import lru_cache
+import json
+import os
+
+PROJECT_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SETTINGS_FILE: str = os.path.join(PROJECT_ROOT, "config", "settings.json")
+ENV_PREFIX: str = "APP__"
+
+def _parse_env_value(raw_value: str):
+    try:
+        return json.loads(raw_value)
+    except ValueError:
+        return raw_value
+
+def _apply_env_overrides(settings: dict, environ: dict) -> dict:
+    for env_name, raw_value in environ.items():
+        if not env_name.upper().startswith(ENV_PREFIX):
+            continue
+        keys = [key.lower() for key in env_name[len(ENV_PREFIX):].split("__") if key]
+        if not keys:
+            continue
+        target = settings
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = _parse_env_value(raw_value)
+    return settings
+
+@lru_cache(maxsize = 1)
+def get_settings() -> dict:
+    settings_path = os.environ.get("APP_SETTINGS_FILE", DEFAULT_SETTINGS_FILE)
+    with open(settings_path, "r") as setting_file:
+        settings: dict = json.load(setting_file)
+    return _apply_env_overrides(settings, os.environ)
+
+def section(name: str) -> dict:
+    '''
+    One section of the settings, e.g. "db" or "jwt". Empty dict if the section is not set.
+    '''
+    return get_settings().get(name, {})
+
+def resolve_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+
+def reload_settings():
+    '''
+    Drop the cached settings. Modules which read settings at import keep their values.
+    '''
+    get_settings.cache_clear()
@@ -1,22 +1,163 @@
 from sqlmodel import create_engine, SQLModel, Session
-import json
-import os
+from sqlalchemy import event
+from contextlib import asynccontextmanager
+from config.settings import section, resolve_path
+import migrations
+import threading
+import inspect
 
 ## Models :: Models must be registered here for init_db to "pick up" the tables
 from models.users import *
 from models.tokens import *
 
 ## Basic ##
-with open(os.path.join("config", "settings.json"), "r") as setting_file:
-    setting_dict = json.load(setting_file)
-    sql_dict = setting_dict["db"]
-sql_file_name = sql_dict["sqlite_file"]
+sql_dict: dict = section("db")
+sql_file_name = resolve_path(sql_dict["sqlite_file"])
 DATABASE_URL = f"sqlite:///{sql_file_name}"
-engine = create_engine(DATABASE_URL, echo=sql_dict["echo"])
+
+## SQLite performance profiles ##
+## "default": SQLite's own defaults (rollback journal, synchronous FULL, no mmap, ~2 MB page cache), readers block while a token is being written.
+## "production": WAL journal so readers never wait for the writer, synchronous NORMAL (durable on app crash, may lose the last commits on power loss in WAL mode),
+##               256 MB mmap and 64 MB page cache for reads, temp tables in memory, and 5 s busy timeout so writers queue instead of failing with "database is locked".
+## "sqlite_profile" picks one of them, keys on "sqlite_pragmas" override single pragmas on top of it.
+SQLITE_PROFILES: dict[str, dict] = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+SQLITE_PRAGMAS: dict = SQLITE_PROFILES[sql_dict.get("sqlite_profile", "default")] | sql_dict.get("sqlite_pragmas", {})
+POOL_OPTIONS: dict = sql_dict.get("pool", {}) ## pool_size, max_overflow, pool_timeout, pool_recycle for create_engine
+
+def apply_sqlite_pragmas(target_engine, pragmas: dict):
+    '''
+    Run the given PRAGMAs on every new DBAPI connection of the engine. Pass `engine.sync_engine` for an async engine.
+    '''
+    if not pragmas:
+        return
+
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+def build_engine(url: str, pragmas: dict = None, pool: dict = None, echo: bool = False):
+    new_engine = create_engine(url, echo = echo, **(pool or {}))
+    apply_sqlite_pragmas(new_engine, pragmas or {})
+    return new_engine
+
+## Async mode :: API routes use the async engine when "async_mode" is on, CLI and tests keep the sync engine
+ASYNC_MODE: bool = sql_dict.get("async_mode", False)
+ASYNC_DATABASE_URL = f"sqlite+{sql_dict.get('async_driver', 'aiosqlite')}:///{sql_file_name}"
+
+## Engines :: Created on first use, so importing this module (e.g. for a CLI help message) does not open any pool.
+## `db.engine` and `db.async_engine` still work as module attributes.
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+_engine_hooks: list[callable] = []
+
+def on_engine_created(callback: callable):
+    '''
+    Call `callback(sync_engine)` on every engine of this module, now for those already created and later for the others. For the async engine, its `sync_engine` is passed.
+    '''
+    _engine_hooks.append(callback)
+    for created in (_engine, _async_engine.sync_engine if _async_engine is not None else None):
+        if created is not None:
+            callback(created)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                new_engine = build_engine(DATABASE_URL, pragmas = SQLITE_PRAGMAS, pool = POOL_OPTIONS, echo = sql_dict["echo"])
+                for callback in _engine_hooks:
+                    callback(new_engine)
+                _engine = new_engine
+    return _engine
+
+def get_async_engine():
+    '''
+    The async engine, or None when async mode is off. The async driver is only imported here.
+    '''
+    global _async_engine
+    if _async_engine is None and ASYNC_MODE:
+        with _engine_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import create_async_engine
+                new_engine = create_async_engine(ASYNC_DATABASE_URL, echo = sql_dict["echo"], **POOL_OPTIONS)
+                apply_sqlite_pragmas(new_engine.sync_engine, SQLITE_PRAGMAS)
+                for callback in _engine_hooks:
+                    callback(new_engine.sync_engine)
+                _async_engine = new_engine
+    return _async_engine
+
+def __getattr__(name: str):
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
+    migrations.run_migrations(get_engine())
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
+
+async def get_api_session():
+    '''
+    Session dependency for the API routes. Yield an AsyncSession in async mode, otherwise a plain Session.
+    Use the `session_*` helpers below so that the same code path works with both.
+    '''
+    if ASYNC_MODE:
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        async with AsyncSession(get_async_engine(), expire_on_commit = False) as session:
+            yield session
+    else:
+        with Session(get_engine()) as session:
+            yield session
+
+## Context manager form, for work that outlives the request dependencies (e.g. streamed responses)
+open_api_session = asynccontextmanager(get_api_session)
+
+async def dispose_engines():
+    ## Only the engines in use, disposing must not create one
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+## Session helpers :: Await the call only if the session is async (an AsyncSession returns awaitables), without importing the async extension ##
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+async def session_exec(session, statement):
+    return await _maybe_await(session.exec(statement))
+
+async def session_commit(session):
+    await _maybe_await(session.commit())
+
+async def session_flush(session):
+    await _maybe_await(session.flush())
+
+async def session_refresh(session, instance):
+    await _maybe_await(session.refresh(instance))
+
+async def session_delete(session, instance):
+    await _maybe_await(session.delete(instance))
+
+async def session_rollback(session):
+    await _maybe_await(session.rollback())
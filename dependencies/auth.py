@@ -1,11 +1,24 @@
 from typing import Annotated
-from fastapi import Header, HTTPException
-from models.users import User as UserModel
+from dataclasses import dataclass
+from fastapi import Depends, Header, HTTPException
 from util import token
-from util import user as UserUtil
-from dependencies.dbsession import SessionDep
+from dependencies.dbsession import ApiSessionDep
 
-async def require_auth(session: SessionDep, authorization: Annotated[str | None, Header()] = None):
+@dataclass(frozen = True)
+class Principal:
+    '''
+    The authenticated user of a request, resolved once from the access token.
+    '''
+    uid: int
+    scope: str
+    version: int
+    is_admin: bool
+    is_active: bool
+
+async def get_principal(session: ApiSessionDep, authorization: Annotated[str | None, Header()] = None) -> Principal:
+    '''
+    Verify the bearer access token and load its user once per request. FastAPI caches the result, so every dependency and route asking for PrincipalDep shares it.
+    '''
     if authorization is None:
         raise HTTPException(401, detail = "Authentication required")
 
@@ -15,35 +28,28 @@ async def require_auth(session: SessionDep, authorization: Annotated[str | None,
         ac_token = authorization[7:]
         if len(ac_token) < 10:
             raise HTTPException(400, detail = "Bad token")
-        else:
-            valid = token.check_token(ac_token, session = session, check_access = True) ## Check access with leeway
-            if not valid:
-                raise HTTPException(400, detail = "Bad token")
-    else:
-        raise HTTPException(401, detail = "Authentication required")
 
-async def user_must_be_admin(session: SessionDep, authorization: Annotated[str | None, Header()] = None):
-    if authorization is None:
-        raise HTTPException(401, detail = "Authentication required")
-    
-    if authorization.startswith("Bearer "):
-        ## Try to get the access token
-        authorization = str(authorization)
-        ac_token = authorization[7:]
-        if len(ac_token) < 10:
+        verified = await token.verify_access_token_async(ac_token, session = session) ## Check access with leeway
+        if verified is None:
             raise HTTPException(400, detail = "Bad token")
-        else:
-            valid = token.check_token(ac_token, session = session, check_access = True) ## Check access with leeway
-            if not valid:
-                raise HTTPException(400, detail = "Bad token")
-            
-            ## Admin check
-            token_body = token.decode_jwt_no_verification(ac_token)
-            uid = token_body["uid"]
-            user: UserModel = UserUtil.select_user_by_id(uid, session)
-            if user is None:
-                raise HTTPException(404, detail = "User not found")
-            if user.is_admin == False:
-                raise HTTPException(403, detail = "Admin right required")
+        token_payload, user_state = verified
+        return Principal(
+            uid = user_state.id,
+            scope = token_payload["scope"],
+            version = token_payload["version"],
+            is_admin = user_state.is_admin,
+            is_active = user_state.is_active,
+        )
     else:
-        raise HTTPException(401, detail = "Authentication required")
\ No newline at end of file
+        raise HTTPException(401, detail = "Authentication required")
+
+PrincipalDep = Annotated[Principal, Depends(get_principal)]
+
+async def require_auth(principal: PrincipalDep) -> Principal:
+    return principal
+
+async def user_must_be_admin(principal: PrincipalDep) -> Principal:
+    ## Admin check
+    if principal.is_admin == False:
+        raise HTTPException(403, detail = "Admin right required")
+    return principal
@@ -1,8 +1,14 @@
-from typing import Annotated
+from typing import Annotated, TYPE_CHECKING
 from sqlmodel import Session
 from fastapi import Depends
-from db import get_session
+from db import get_session, get_api_session
 
 SessionDep = Annotated[Session, Depends(get_session)]
 
-
+## Session for API routes :: AsyncSession when "async_mode" is on in settings, Session otherwise
+if TYPE_CHECKING:
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    ApiSessionDep = Annotated[Session | AsyncSession, Depends(get_api_session)]
+else:
+    ## The async extension (and greenlet) is only imported in async mode, by db.get_api_session. FastAPI does not check the type of a dependency.
+    ApiSessionDep = Annotated[Session, Depends(get_api_session)]
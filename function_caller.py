@@ -1,32 +1,99 @@
 import os
 import sys
+import ast
+import json
 import importlib.util
 
 ## Function registry
 class FunctionModel:
+    '''
+    A CLI command. The label and description are read from the script statically, the script is only imported when the command is called.
+    '''
     label: str
-    func: callable
+    script_path: str
     description: str
 
-    def __init__(self, script_path: str):
-        ## Import from the script
-        script_file = os.path.basename(script_path)
-        script_name = script_file[:-3]
-        spec = importlib.util.spec_from_file_location(script_name, script_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-
-        ## Assigning parameters
-        self.label = script_name
-        self.func = module.command
-        self.description = module.description
+    def __init__(self, label: str, script_path: str, description: str):
+        self.label = label
+        self.script_path = script_path
+        self.description = description
 
     def __repr__(self):
         return f"<Function - {self.label}: {self.description}>"
-    
+
     def to_list_row(self) -> str:
         return f"{self.label}\t\t{self.description}"
 
+    def load(self) -> callable:
+        ## Import the script, for the selected command only
+        spec = importlib.util.spec_from_file_location(self.label, self.script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.command
+
+def read_script_metadata(script_path: str) -> dict | None:
+    '''
+    Parse a CLI script without executing it. Return its description if it defines `description` as a string and a `command` function, otherwise None.
+    '''
+    with open(script_path, "r") as script_file:
+        tree = ast.parse(script_file.read(), filename = script_path)
+
+    description: str = None
+    has_command: bool = False
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            if any(isinstance(target, ast.Name) and target.id == "description" for target in node.targets):
+                description = node.value.value
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "command":
+            has_command = True
+
+    if description is None or not has_command:
+        return None
+    return {"description": description}
+
+def load_registry(cli_root: str) -> dict[str, FunctionModel]:
+    '''
+    Map of label -> FunctionModel for every script under `cli_root`.
+    Metadata is cached on a manifest next to the scripts, keyed by file modification time and size, so unchanged scripts are not parsed again.
+    '''
+    manifest_path = os.path.join(cli_root, "__pycache__", "registry.json")
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            manifest: dict = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    registry: dict[str, FunctionModel] = {}
+    new_manifest: dict = {}
+    for file_name in sorted(os.listdir(cli_root)):
+        if not file_name.endswith(".py"):
+            continue
+        script_path = os.path.join(cli_root, file_name)
+        file_stat = os.stat(script_path)
+        file_key = [file_stat.st_mtime_ns, file_stat.st_size]
+
+        cached = manifest.get(file_name)
+        if cached is not None and cached["key"] == file_key:
+            metadata = cached["metadata"]
+        else:
+            metadata = read_script_metadata(script_path)
+        new_manifest[file_name] = {"key": file_key, "metadata": metadata}
+
+        if metadata is not None:
+            label = file_name[:-3]
+            registry[label] = FunctionModel(label = label, script_path = script_path, description = metadata["description"])
+
+    ## Save the manifest if anything changed, a read-only checkout just parses every time
+    if new_manifest != manifest:
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok = True)
+            with open(manifest_path, "w") as manifest_file:
+                json.dump(new_manifest, manifest_file)
+        except OSError:
+            pass
+
+    return registry
+
 def main():
     ## Run settings ##
     if len(sys.argv) < 2:
@@ -38,8 +105,7 @@ def main():
     ##################
 
     ## Functions registration
-    py_paths = [os.path.join(cli_root, fn) for fn in os.listdir(cli_root) if fn.endswith(".py")]
-    function_list: list = [FunctionModel(script_path = py_path) for py_path in py_paths]
+    function_registry: dict[str, FunctionModel] = load_registry(cli_root)
 
     ## Help function
     if function_name == "help":
@@ -47,29 +113,24 @@ def main():
         print(f"For example, 'python {this_script} help' to print out this help message.\n")
 
         print("Label\t\t\t\tDescription\n")
-        for function in function_list:
+        for function in function_registry.values():
             print(function.to_list_row())
 
         print("\nOr, enter 'help' to print this table")
         exit(0)
 
     ## Handling function request, without unknown function
-    selected_function: FunctionModel = None
-    for fn in function_list:
-        if fn.label == function_name:
-            selected_function = fn
-            break
-
+    selected_function: FunctionModel = function_registry.get(function_name)
     if selected_function is None:
         print(f"Entered function name {function_name} is not on registered on the list of function.")
         exit(1)
 
     ## Handling function request
-    selected_function.func()
+    selected_function.load()()
 
     ## Han""dle function not ending properly
     print("Alert: The function might have ended improperly")
     exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
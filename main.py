@@ -1,38 +1,117 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
 from contextlib import asynccontextmanager
-from db import init_db
+from db import init_db, dispose_engines
+from sqlmodel import Session
+from util import hash as HashUtil
+from util import user as UserUtil
+from util import token as TokenUtil
+from util import blacklist as BlacklistUtil
+from util import maintenance as MaintenanceUtil
+from util import metrics as MetricsUtil
+from util import profiler as ProfilerUtil
+from util import user_import as ImportUtil
+import time
+import db
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     ## On startup
     print("From lifespan function: On startup")
     init_db() ## including create all tables
+    if HashUtil.__calibrate__:
+        ## Before the hashing pool starts, so that process workers inherit the rounds
+        print(f"bcrypt rounds calibrated to {HashUtil.calibrate_bcrypt()}")
+    with Session(db.engine) as session:
+        if TokenUtil.__stateless_access__:
+            UserUtil.token_epochs.load(session)
+        if BlacklistUtil.__index_enabled__:
+            BlacklistUtil.blacklist_index.load(session)
+    maintenance_task = MaintenanceUtil.start_scheduler()
 
     ## On start up: Pass and await for shutdown
     yield
 
     ## On shutdown
     print("From lifespan function: On shutdown")
+    await MaintenanceUtil.stop_scheduler(maintenance_task)
+    await dispose_engines()
+    HashUtil.shutdown_executor()
+    ImportUtil.shutdown_http_executor()
 
     ## Never give "yield"
 
 ## Creating the APP
 app = FastAPI(lifespan=lifespan)
 
+#### Metrics ####
+## Route templates by route, including the router prefix :: Recent FastAPI mounts included routers, so `route.path` is relative to the prefix
+_route_labels: dict[int, str] = {}
+
+def route_label(request: Request) -> str:
+    '''
+    Template of the matched route (e.g. "/users/uid/{uid}") rather than the raw path, to keep label values bounded.
+    '''
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    return _route_labels.get(id(route), route.path)
+
+db.on_engine_created(MetricsUtil.instrument_engine) ## Engines are created on first use, not at import
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    sql_stats: list = [0, 0.0]
+    context_token = MetricsUtil.request_sql.set(sql_stats)
+    start = time.perf_counter()
+    status: int = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        MetricsUtil.record_request(request.method, route_label(request), status, time.perf_counter() - start, sql_stats)
+        MetricsUtil.request_sql.reset(context_token)
+
+@app.middleware("http")
+async def sample_profiles(request: Request, call_next):
+    profile = ProfilerUtil.request_profiler.start(request.headers)
+    if profile is None:
+        return await call_next(request)
+
+    started_at = time.time()
+    start = time.perf_counter()
+    status: int = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        await ProfilerUtil.request_profiler.finish(profile, request.method, route_label(request), status, started_at, time.perf_counter() - start)
+
 #### Routers ####
 
 ## Import the routers here
 from routers.users.apis import user_router
 from routers.auth.apis import auth_router
+from routers.monitor.apis import monitor_router
 
 ## Register the routers here
-app.include_router(
+def register_router(router, prefix: str = "", **options):
+    app.include_router(router, prefix = prefix, **options)
+    for route in router.routes:
+        _route_labels[id(route)] = prefix + route.path
+
+register_router(
     auth_router,
     prefix="/auth",
     tags=["Authentication"],
 )
-app.include_router(
+register_router(
     user_router,
     prefix="/users",
     tags=["Users"],
-)
\ No newline at end of file
+)
+register_router(
+    monitor_router,
+    tags=["Monitoring"],
+)
@@ -0,0 +1,64 @@
+'''
+Versioned schema migrations for existing DB files.
+
+`init_db` only creates missing tables, so changes to existing tables (new indexes, columns) are listed here.
+The schema version is kept on SQLite's `PRAGMA user_version`. Each migration runs in its own transaction and bumps the version,
+so a DB file is migrated from whatever version it is at. Statements must be idempotent (IF NOT EXISTS), as new DB files already get the
+current schema from `create_all` and then run every migration once. A step which SQL alone cannot make idempotent is a function of the connection.
+'''
+from typing import Callable
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+def _table_columns(connection: Connection, table_name: str) -> set[str]:
+    return {row[1] for row in connection.execute(text(f"PRAGMA table_info({table_name})"))}
+
+def _add_consumed_at(connection: Connection):
+    if "consumed_at" not in _table_columns(connection, "refreshtokenregister"):
+        connection.execute(text("ALTER TABLE refreshtokenregister ADD COLUMN consumed_at INTEGER"))
+
+## (version, description, steps) :: Append only, never edit an applied migration
+MIGRATIONS: list[tuple[int, str, list[str | Callable[[Connection], None]]]] = [
+    (1, "Indexes for token purging, token lookup by user and user listing", [
+        "CREATE INDEX IF NOT EXISTS ix_refreshtokenregister_uid ON refreshtokenregister (uid)",
+        "CREATE INDEX IF NOT EXISTS ix_refreshtokenregister_exp ON refreshtokenregister (exp)",
+        "CREATE INDEX IF NOT EXISTS ix_refreshtokenblacklist_exp ON refreshtokenblacklist (exp)",
+        "CREATE INDEX IF NOT EXISTS ix_user_email ON user (email)",
+        "CREATE INDEX IF NOT EXISTS ix_user_active_id ON user (id) WHERE is_active = 1",
+    ]),
+    (2, "Mark used refresh tokens on the register (consumed_at) instead of the blacklist table", [
+        _add_consumed_at,
+        ## Blacklisted tokens whose register row is already purged need no copy, unregistered tokens are rejected anyway
+        "UPDATE refreshtokenregister SET consumed_at = (SELECT reg_time FROM refreshtokenblacklist WHERE refreshtokenblacklist.token_id = refreshtokenregister.token_id) "
+        "WHERE consumed_at IS NULL AND token_id IN (SELECT token_id FROM refreshtokenblacklist)",
+        "DELETE FROM refreshtokenblacklist",
+    ]),
+]
+
+def get_schema_version(target_engine: Engine) -> int:
+    with target_engine.connect() as connection:
+        return connection.execute(text("PRAGMA user_version")).scalar()
+
+def latest_version() -> int:
+    return max((version for version, _, _ in MIGRATIONS), default = 0)
+
+def run_migrations(target_engine: Engine, verbose: bool = False) -> list[int]:
+    '''
+    Apply the migrations newer than the schema version of the DB, in order. Return the versions applied.
+    '''
+    applied: list[int] = []
+    current_version = get_schema_version(target_engine)
+    for version, description, statements in sorted(MIGRATIONS):
+        if version <= current_version:
+            continue
+        with target_engine.begin() as connection:
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+            connection.execute(text(f"PRAGMA user_version = {int(version)}"))
+        applied.append(version)
+        if verbose:
+            print(f"Applied migration {version}: {description}")
+    return applied
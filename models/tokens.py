@@ -2,11 +2,15 @@ from sqlmodel import Field, SQLModel
 
 class RefreshTokenRegister(SQLModel, table=True):
     token_id: int | None = Field(default = None, primary_key = True, index = True)
-    uid: int ## Not using foreign key since expecting user deletion from DB
+    uid: int = Field(index = True) ## Not using foreign key since expecting user deletion from DB
     iat: int
-    exp: int
+    exp: int = Field(index = True) ## Purging by expiry
+    consumed_at: int | None = Field(default = None) ## Unix time stamp when the token is used for refreshing, None while usable
 
 class RefreshTokenBlackList(SQLModel, table=True):
+    '''
+    Legacy: Used refresh tokens are marked by RefreshTokenRegister.consumed_at instead. Kept for the schema migrations only, and empty after migration 2.
+    '''
     token_id: int = Field(default=None, primary_key = True, index = True)
     reg_time: int ## Unix time stamp when the token is registered
-    exp: int
\ No newline at end of file
+    exp: int = Field(index = True) ## Purging by expiry
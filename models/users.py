@@ -1,11 +1,17 @@
 from sqlmodel import Field, SQLModel, Column, VARCHAR
+from sqlalchemy import Index, text
 from pydantic import EmailStr
 
 class User(SQLModel, table=True):
+    __table_args__ = (
+        ## Partial index for listing active users by ID, inactive users are left out of it
+        Index("ix_user_active_id", "id", sqlite_where = text("is_active = 1")),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     user_name: str = Field(unique = True, nullable = False)
-    email: EmailStr = Field(sa_column=Column("email", VARCHAR))
+    email: EmailStr = Field(sa_column=Column("email", VARCHAR, index = True))
     password_hash: str
     min_token_verison: int = 0
     is_admin: bool = False
-    is_active: bool = False
\ No newline at end of file
+    is_active: bool = False
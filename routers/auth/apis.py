@@ -1,26 +1,40 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
 from models.users import User as UserModel
-from sqlmodel import select
-from dependencies.dbsession import SessionDep
+from dependencies.dbsession import ApiSessionDep
 from .requests import *
 from .responses import *
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 from util import hash, token
+from util import user as UserUtil
+from util import signing_keys as SigningKeys
+from util.admission import login_admission, AdmissionRejected
+import math
 
 auth_router = APIRouter()
 
 @auth_router.post("/login")
-async def login(login_req: LoginRequest, session: SessionDep) -> FullTokenResponse:
+async def login(login_req: LoginRequest, request: Request, session: ApiSessionDep) -> FullTokenResponse:
     user_name = login_req.user_name
     password = login_req.password
     
     ## Find the requested user
     try:
-        target_user = session.exec(select(UserModel).where(UserModel.user_name == user_name)).one()
+        ## Admission control before any DB or hashing work
+        login_admission.admit(user_name, request.client.host if request.client else "unknown")
+        target_user: UserModel = await UserUtil.select_user_by_name_async(user_name, session)
         password_hash = target_user.password_hash
-        pass_okay: bool = hash.verify(password, password_hash)
+        new_hash: str = None
+        async with login_admission.verifying():
+            pass_okay: bool = await hash.verify_async(password, password_hash)
+            if pass_okay and hash.needs_rehash(password_hash):
+                ## Out of date algorithm or cost: hash again while the clear password is at hand, under the same verification slot
+                new_hash = await hash.hashing_async(password)
         if pass_okay:
-            access_token, refresh_token = token.issue_access_refresh_tokens(target_user, session = session)
+            access_token, refresh_token = await token.issue_access_refresh_tokens_async(target_user, session = session)
+            if new_hash is not None:
+                ## Best effort, tokens stay valid
+                await UserUtil.replace_password_hash_async(target_user.id, new_hash, session = session)
             return FullTokenResponse(
                 access = access_token,
                 refresh = refresh_token
@@ -29,18 +43,22 @@ async def login(login_req: LoginRequest, session: SessionDep) -> FullTokenRespon
         pass
     except MultipleResultsFound:
         raise HTTPException(500, detail = "User duplication found")
+    except AdmissionRejected as e:
+        raise HTTPException(e.status_code, detail = str(e), headers = {"Retry-After": str(max(1, math.ceil(e.retry_after_s)))})
+    except hash.HashQueueFull:
+        raise HTTPException(503, detail = "Server busy, please retry later", headers = {"Retry-After": "1"})
 
     ## Catch-all failure
     raise HTTPException(404, detail = "incorrect user name or password")
 
 @auth_router.post("/token/refresh")
-async def check_refresh_token(refresh_req: TokenRefreshRequest, session: SessionDep) -> FullTokenResponse:
+async def check_refresh_token(refresh_req: TokenRefreshRequest, session: ApiSessionDep) -> FullTokenResponse:
     '''
     Check the validity of the token without leeway
     '''
     token_str = refresh_req.refresh
     try:
-        new_ac_token, new_rf_token = token.process_refresh(token_str, session = session)
+        new_ac_token, new_rf_token = await token.process_refresh_async(token_str, session = session)
         return FullTokenResponse(
             access = new_ac_token,
             refresh = new_rf_token
@@ -51,13 +69,35 @@ async def check_refresh_token(refresh_req: TokenRefreshRequest, session: Session
         raise HTTPException(500, detail = "Unknown server error")
     
 @auth_router.post("/token/check")
-async def check_token(token_check_req: TokenCheckRequest, session: SessionDep) -> dict:
+async def check_token(token_check_req: TokenCheckRequest, session: ApiSessionDep) -> dict:
     '''
     Check the validity of the token without leeway
     '''
     token_str = token_check_req.token
-    validity = token.check_token(token_str, session, auto_scope = True, with_leeway = False)
+    validity = await token.check_token_async(token_str, session, auto_scope = True, with_leeway = False)
     if validity:
         return {}
     else:
-        raise HTTPException(406, detail = "bad token")
\ No newline at end of file
+        raise HTTPException(406, detail = "bad token")
+
+@auth_router.post("/token/check-batch")
+async def check_token_batch(batch_check_req: TokenBatchCheckRequest, session: ApiSessionDep) -> TokenBatchCheckResponse:
+    '''
+    Check the validity of several tokens without leeway, with the claims of the valid ones. Results are in the order of the request.
+    '''
+    payloads = await token.check_tokens_batch_async(batch_check_req.tokens, session, with_leeway = False)
+    return TokenBatchCheckResponse(
+        results = [TokenCheckResult(valid = payload is not None, claims = payload) for payload in payloads]
+    )
+
+@auth_router.get("/.well-known/jwks.json")
+async def jwks() -> JSONResponse:
+    '''
+    Public keys for other services to verify tokens locally, as a JSON Web Key Set. Only with RS256 / EdDSA signing.
+    '''
+    if token.__algorithm__ not in SigningKeys.asymmetric_algorithms:
+        raise HTTPException(404, detail = "Tokens are signed with a shared secret, no public key")
+    return JSONResponse(
+        SigningKeys.get_key_ring().jwks(),
+        headers = {"Cache-Control": f"public, max-age={SigningKeys.__jwks_max_age_s__}"},
+    )
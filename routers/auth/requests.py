@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from util.token import __check_batch_max__
 
 class LoginRequest(BaseModel):
     user_name:str = Field(max_length=50)
@@ -8,4 +9,7 @@ class TokenRefreshRequest(BaseModel):
     refresh:str
 
 class TokenCheckRequest(BaseModel):
-    token:str
\ No newline at end of file
+    token:str
+
+class TokenBatchCheckRequest(BaseModel):
+    tokens:list[str] = Field(min_length=1, max_length=__check_batch_max__)
\ No newline at end of file
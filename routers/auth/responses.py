@@ -2,4 +2,11 @@ from pydantic import BaseModel, Field
 
 class FullTokenResponse(BaseModel):
     access:str
-    refresh:str
\ No newline at end of file
+    refresh:str
+
+class TokenCheckResult(BaseModel):
+    valid:bool
+    claims:dict | None = None
+
+class TokenBatchCheckResponse(BaseModel):
+    results:list[TokenCheckResult]
\ No newline at end of file
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import PlainTextResponse
+from models.tokens import RefreshTokenRegister
+from sqlmodel import Session, select, func
+from util import metrics as MetricsUtil
+from util import profiler as ProfilerUtil
+from util.claims_cache import claims_cache
+from util.admission import login_admission
+from util.maintenance import maintenance_stats
+from util import user as UserUtil
+from dependencies.auth import user_must_be_admin
+import asyncio
+import time
+import db
+
+monitor_router = APIRouter()
+
+## Token table sizes, counted at most once per max age so that frequent scrapes do not scan the table ##
+row_count_max_age_s: float = 60
+_row_counts: dict[str, tuple[float, int]] = {}
+
+def _count_rows(key: str, model, *conditions) -> int:
+    cached = _row_counts.get(key)
+    if cached is not None and time.monotonic() - cached[0] < row_count_max_age_s:
+        return cached[1]
+    with Session(db.engine) as session:
+        count: int = session.exec(select(func.count()).select_from(model).where(*conditions)).one()
+    _row_counts[key] = (time.monotonic(), count)
+    return count
+
+MetricsUtil.registry.register(MetricsUtil.Gauge("refresh_token_register_rows", "Rows on RefreshTokenRegister", lambda: _count_rows("register", RefreshTokenRegister)))
+MetricsUtil.registry.register(MetricsUtil.Gauge("refresh_token_consumed_rows", "Consumed (blacklisted) refresh tokens on RefreshTokenRegister", lambda: _count_rows("consumed", RefreshTokenRegister, RefreshTokenRegister.consumed_at != None)))
+
+## Maintenance rounds ##
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("maintenance_runs_total", "Maintenance rounds run", lambda: maintenance_stats.runs))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("maintenance_register_rows_removed_total", "Expired RefreshTokenRegister rows purged", lambda: maintenance_stats.register_removed))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("maintenance_duration_seconds_total", "Time spent in maintenance rounds", lambda: maintenance_stats.total_duration_s))
+MetricsUtil.registry.register(MetricsUtil.Gauge("maintenance_last_run_timestamp_seconds", "Unix time of the last maintenance round", lambda: maintenance_stats.last_run_at or 0))
+MetricsUtil.registry.register(MetricsUtil.Gauge("maintenance_last_duration_seconds", "Duration of the last maintenance round", lambda: maintenance_stats.last_duration_s))
+MetricsUtil.registry.register(MetricsUtil.Gauge("maintenance_last_run_failed", "1 if the last maintenance round raised, 0 otherwise", lambda: int(maintenance_stats.last_error is not None)))
+
+## Verified claims cache, for tuning its size ##
+MetricsUtil.registry.register(MetricsUtil.Gauge("token_claims_cache_size", "Entries on the verified token claims cache", lambda: claims_cache.stats()["size"]))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("token_claims_cache_hits_total", "Claims cache hits, valid tokens", lambda: claims_cache.hits))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("token_claims_cache_negative_hits_total", "Claims cache hits, invalid tokens", lambda: claims_cache.negative_hits))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("token_claims_cache_misses_total", "Claims cache misses", lambda: claims_cache.misses))
+MetricsUtil.registry.register(MetricsUtil.Gauge("token_claims_cache_hit_ratio", "Claims cache hit ratio since start", claims_cache.hit_ratio))
+
+## Login admission control ##
+MetricsUtil.registry.register(MetricsUtil.Gauge("login_verifying_now", "Password verifications of logins in progress", lambda: login_admission.verifying_now))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("login_rejected_rate_limit_total", "Logins rejected by the user name and client rate limits", lambda: login_admission.rejected["user"] + login_admission.rejected["client"]))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("login_rejected_concurrency_total", "Logins rejected by the verification concurrency cap", lambda: login_admission.rejected["concurrency"]))
+
+## Serialized user listing cache ##
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("user_listing_cache_hits_total", "User listing pages served from the serialized cache", lambda: UserUtil.listing_cache.hits))
+MetricsUtil.registry.register(MetricsUtil.CallbackCounter("user_listing_cache_misses_total", "User listing pages read from DB", lambda: UserUtil.listing_cache.misses))
+
+@monitor_router.get("/metrics", response_class = PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    '''
+    All metrics in Prometheus text exposition format.
+    '''
+    body: str = await asyncio.to_thread(MetricsUtil.registry.render) ## Gauges query DB
+    return PlainTextResponse(body, media_type = "text/plain; version=0.0.4; charset=utf-8")
+
+@monitor_router.get("/admin/profiles", dependencies=[Depends(user_must_be_admin)])
+async def slowest_profiles(limit: int = Query(default = 20, ge = 1, le = 200)) -> dict:
+    '''
+    Slowest recently profiled requests, with the profile file name under the profiler directory (load with pstats or snakeviz).
+    '''
+    return {
+        "enabled": ProfilerUtil.request_profiler.enabled,
+        "directory": ProfilerUtil.request_profiler.directory,
+        "profiles": ProfilerUtil.request_profiler.slowest(limit),
+    }
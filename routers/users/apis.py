@@ -1,27 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from models.users import User as UserModel
-from sqlmodel import select
-from dependencies.dbsession import SessionDep
+from sqlmodel import Session, select
+from dependencies.dbsession import ApiSessionDep
 from dependencies.auth import require_auth, user_must_be_admin
 from util import user as UserUtil
+from util import hash as HashUtil
+from util import user_import as ImportUtil
 from .requests import *
 from .responses import *
 from sqlalchemy.exc import IntegrityError, MultipleResultsFound, NoResultFound
+from pydantic import TypeAdapter
+import asyncio
+import db
 
 user_router = APIRouter(
     dependencies=[Depends(require_auth)]
 )
 
+## Conditional GET :: ETags follow the user table version ##
+_user_list_adapter = TypeAdapter(list[SingleUserResponse])
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match: str = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    ## Weak comparison, as If-None-Match requires
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code = 304, headers = {"ETag": etag})
+
 ## Auth-ed APIs ##
 @user_router.get("/all")
-async def read_users(session: SessionDep) -> list[SingleUserResponse]:
-    users = session.exec(select(UserModel).where(UserModel.is_active == True)).all()
-    return SingleUserResponse.from_db_model(users)
+async def read_users(session: ApiSessionDep, request: Request, after_id: int = 0, limit: int = Query(default = 100, ge = 1, le = 1000), stream: bool = False) -> list[SingleUserResponse]:
+    '''
+    Active users ordered by ID, paged by keyset: pass the ID of the last user received as `after_id` for the next page.
+    The next cursor is returned in the X-Next-Cursor header while more users may follow.
+    With `stream` on, all users after `after_id` are streamed as NDJSON instead, ignoring `limit`.
+    Pages carry an ETag, and are answered with 304 on a matching If-None-Match until a user is written, or for at most user_cache.listing_max_age_s.
+    '''
+    if stream:
+        async def ndjson_rows():
+            async for user in UserUtil.iter_active_users_async(after_id = after_id):
+                yield SingleUserResponse.from_db_model(user).model_dump_json() + "\n"
+        return StreamingResponse(ndjson_rows(), media_type = "application/x-ndjson")
+
+    ## Version read before the users, so that a page is never tagged newer than its content
+    version: tuple[int, int] = UserUtil.user_table_version.current()
+    etag: str = UserUtil.user_table_version.etag(version, "all", after_id, limit)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
+    cached = UserUtil.listing_cache.get((after_id, limit), version)
+    if cached is None:
+        users = await UserUtil.select_active_users_page_async(session, after_id = after_id, limit = limit)
+        next_cursor: str = str(users[-1].id) if len(users) == limit else None
+        cached = (_user_list_adapter.dump_json(SingleUserResponse.from_db_model(users)), next_cursor)
+        UserUtil.listing_cache.put((after_id, limit), version, cached)
+
+    body, next_cursor = cached
+    headers: dict = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content = body, media_type = "application/json", headers = headers)
 
 @user_router.get("/uid/{uid}")
-async def read_users(uid: int, session: SessionDep) -> SingleUserResponse:
+async def read_users(uid: int, session: ApiSessionDep, request: Request, response: Response) -> SingleUserResponse:
+    version: tuple[int, int] = UserUtil.user_table_version.current()
+    etag: str = UserUtil.user_table_version.etag(version, "uid", uid)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
     try:
-        user = session.exec(select(UserModel).where(UserModel.id == uid).where(UserModel.is_active == True)).one()
+        results = await db.session_exec(session, select(UserModel).where(UserModel.id == uid).where(UserModel.is_active == True))
+        user = results.one()
+        response.headers["ETag"] = etag
         return SingleUserResponse.from_db_model(user)
     except NoResultFound:
         raise HTTPException(404, detail = "User not found")
@@ -30,11 +85,11 @@ async def read_users(uid: int, session: SessionDep) -> SingleUserResponse:
 
 ## Admin only APIs ##
 @user_router.post("/", dependencies=[Depends(user_must_be_admin)])
-async def create_user(new_user_req: CreateUserRequest, session: SessionDep) -> SingleUserResponse:
+async def create_user(new_user_req: CreateUserRequest, session: ApiSessionDep) -> SingleUserResponse:
     input_user = new_user_req
 
     ## Adding the user
-    new_user, err = UserUtil.create_new_user(input_user.user_name, email = input_user.email, clear_text_pw = input_user.password, session = session)
+    new_user, err = await UserUtil.create_new_user_async(input_user.user_name, email = input_user.email, clear_text_pw = input_user.password, session = session)
 
     ## Handling the result
     if err is None:
@@ -47,17 +102,46 @@ async def create_user(new_user_req: CreateUserRequest, session: SessionDep) -> S
         ## Error cases
         if isinstance(err, IntegrityError):
             raise HTTPException(409, detail = "User exists")
+        elif isinstance(err, HashUtil.HashQueueFull):
+            raise HTTPException(503, detail = "Server busy, please retry later")
         else:
             ## Unknown error
             raise HTTPException(500, detail = "Unknown error while creating user")
 
 @user_router.delete("/", dependencies=[Depends(user_must_be_admin)])
-async def delete_user(delete_user_req: DeleteUserRequest, session: SessionDep) -> dict:
+async def delete_user(delete_user_req: DeleteUserRequest, session: ApiSessionDep) -> dict:
     uid = delete_user_req.uid
 
     ## Find and delete the user
-    result: int = UserUtil.delete_user_by_id(uid, session = session)
+    result: int = await UserUtil.delete_user_by_id_async(uid, session = session)
     if result == 404:
         raise HTTPException(404, detail = "User not found")
     else:
-        return {}
\ No newline at end of file
+        return {}
+
+@user_router.post("/bulk", dependencies=[Depends(user_must_be_admin)])
+async def import_users(file: UploadFile) -> BulkImportResponse:
+    '''
+    Create users from an uploaded CSV or JSON file (columns: user_name, email, password, optional is_admin, is_active).
+    Rows which cannot be created are listed on the response, the rest are still created.
+    '''
+    file_name: str = file.filename or ""
+    file_format = "json" if (file_name.lower().endswith(".json") or file.content_type == "application/json") else "csv"
+    content: bytes = await file.read()
+
+    def run_import() -> ImportUtil.ImportReport:
+        rows = ImportUtil.read_user_table(content, file_format = file_format)
+        with Session(db.engine) as session:
+            ## Capped pool, not every core, so that logins keep CPU during an upload
+            return ImportUtil.bulk_create_users(rows, session = session, max_workers = ImportUtil.__http_max_workers__, executor = ImportUtil.get_http_executor())
+
+    ## Parsing, hashing and inserting are all blocking, keep them off the event loop
+    try:
+        report = await asyncio.to_thread(run_import)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(422, detail = f"Bad import file: {e}")
+
+    return BulkImportResponse(
+        created = report.created,
+        conflicts = [BulkImportConflictResponse(row = conflict.row, user_name = conflict.user_name, reason = conflict.reason) for conflict in report.conflicts],
+    )
@@ -28,3 +28,12 @@ class SingleUserResponse(BaseModel):
             return _from_single_instance(db_models)
         else:
             raise TypeError(f"from_db_model only accepts User or list of User, {type(db_models)} is provided.")
+
+class BulkImportConflictResponse(BaseModel):
+    row: int
+    user_name: str | None
+    reason: str
+
+class BulkImportResponse(BaseModel):
+    created: int
+    conflicts: list[BulkImportConflictResponse]
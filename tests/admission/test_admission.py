@@ -0,0 +1,62 @@
+import pytest
+from util.admission import TokenBuckets, LoginAdmission, AdmissionRejected
+import asyncio
+
+class Test_Token_Buckets:
+    def test_burst_and_refill(self):
+        buckets = TokenBuckets(rate_per_s = 1, burst = 3, max_keys = 100)
+        for _ in range(3):
+            assert buckets.retry_after("a", time_now = 0) == 0
+            buckets.take("a", time_now = 0)
+
+        ## Empty bucket: wait for one token, other keys unaffected
+        assert buckets.retry_after("a", time_now = 0) == pytest.approx(1)
+        assert buckets.retry_after("a", time_now = 0.5) == pytest.approx(0.5)
+        assert buckets.retry_after("a", time_now = 1) == 0
+        assert buckets.retry_after("b", time_now = 0) == 0
+
+    def test_bounded_memory(self):
+        buckets = TokenBuckets(rate_per_s = 1, burst = 2, max_keys = 10)
+        for key_number in range(100):
+            buckets.take(f"key-{key_number}", time_now = 0)
+        assert len(buckets) == 10
+
+        ## Keys idle until full are dropped
+        buckets.take("late", time_now = 100)
+        assert len(buckets) == 1
+
+class Test_Login_Admission:
+    def test_rate_limits(self):
+        admission = LoginAdmission(user_per_min = 60, user_burst = 2, client_per_min = 60, client_burst = 3, max_concurrent_verify = 1, max_keys = 100)
+        admission.admit("Alice", "10.0.0.1", time_now = 0)
+        admission.admit("alice", "10.0.0.2", time_now = 0)
+
+        ## Per user name, case insensitive
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.admit("ALICE", "10.0.0.3", time_now = 0)
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after_s == pytest.approx(1)
+
+        ## Per client, and a rejected attempt takes no token
+        admission.admit("bob", "10.0.0.1", time_now = 0)
+        admission.admit("carol", "10.0.0.1", time_now = 0)
+        with pytest.raises(AdmissionRejected):
+            admission.admit("dave", "10.0.0.1", time_now = 0)
+        admission.admit("dave", "10.0.0.4", time_now = 0)
+        assert admission.stats()["rejected"] == {"user": 1, "client": 1, "concurrency": 0}
+
+    def test_concurrency_cap(self):
+        admission = LoginAdmission(max_concurrent_verify = 1)
+
+        async def run():
+            async with admission.verifying():
+                with pytest.raises(AdmissionRejected) as rejected:
+                    async with admission.verifying():
+                        pass
+                assert rejected.value.status_code == 503
+            ## Slot released
+            async with admission.verifying():
+                assert admission.verifying_now == 1
+
+        asyncio.run(run())
+        assert admission.verifying_now == 0
@@ -1,9 +1,13 @@
 from fastapi.testclient import TestClient
 from main import app
 from util import token
+from util import hash
 from models.users import User as UserModel
 from jwt.exceptions import ExpiredSignatureError
 from sqlmodel import Session, select
+from sqlalchemy import event
+from util import user as UserUtil
+from util.claims_cache import claims_cache
 import db
 import time
 import random
@@ -35,6 +39,8 @@ token_url: str = f"{auth_url}/token"
 login_url: str = f"{auth_url}/login"
 token_check_url: str = f"{token_url}/check"
 token_refresh_url: str = f"{token_url}/refresh"
+token_check_batch_url: str = f"{token_url}/check-batch"
+admin_only_url: str = "/admin/profiles"
 ############
 
 class Test_login_Api:
@@ -68,6 +74,38 @@ class Test_login_Api:
             response_code: int = response.status_code
             assert response_code == 404
 
+    def test_login_rehash(self, monkeypatch):
+        ## A hash weaker than the configured cost is replaced at login, without a change to the user listings
+        monkeypatch.setattr(hash, "__algorithm__", "bcrypt")
+        monkeypatch.setattr(hash.hashers["bcrypt"], "rounds", 5)
+        user_name: str = "rehash_" + ''.join(random.choices(string.ascii_lowercase, k = 10))
+        with Session(db.engine) as session:
+            user = UserModel(user_name = user_name, email = f"{user_name}@example.com", password_hash = hash.BcryptHasher(rounds = 4).hash("123456"), is_active = True)
+            session.add(user)
+            session.commit()
+            uid: int = user.id
+        UserUtil.user_table_changed()
+        try:
+            table_version: int = UserUtil.user_table_version.counter
+            response = client.post(login_url, json = {"user_name": user_name, "password": "123456"})
+            assert response.status_code == 200
+            assert UserUtil.user_table_version.counter == table_version
+            with Session(db.engine) as session:
+                assert session.get(UserModel, uid).password_hash.startswith("$2b$05$")
+
+            ## Stronger hashes are kept as is
+            with Session(db.engine) as session:
+                user = session.get(UserModel, uid)
+                user.password_hash = hash.BcryptHasher(rounds = 6).hash("123456")
+                session.add(user)
+                session.commit()
+            assert client.post(login_url, json = {"user_name": user_name, "password": "123456"}).status_code == 200
+            with Session(db.engine) as session:
+                assert session.get(UserModel, uid).password_hash.startswith("$2b$06$")
+        finally:
+            with Session(db.engine) as session:
+                UserUtil.delete_user_by_id(uid, session = session)
+
 class Test_Check_Token_Api:
     def test_check_access_token(self):
         with Session(db.engine) as session:
@@ -152,4 +190,61 @@ class Test_Refresh_Api:
             response = client.post(token_refresh_url, json = {"refresh": rf_token})
             response_code: int = response.status_code
             assert response_code == 406
-            
\ No newline at end of file
+            
+
+class Test_Check_Token_Batch_Api:
+    def test_check_batch(self):
+        with Session(db.engine) as session:
+            ac_token = token.create_token(test_user, session = session, lifetime_s = token_life_time_s, is_access = True)
+            rf_token = token.create_token(test_user, session = session, lifetime_s = token_life_time_s * 10, is_access = False)
+            used_rf_token = token.create_token(test_user, session = session, lifetime_s = token_life_time_s * 10, is_access = False)
+            token.process_refresh(used_rf_token, session = session)
+
+        ## Results in request order, claims for the valid tokens only
+        response = client.post(token_check_batch_url, json = {"tokens": [ac_token, ac_token[:-5], rf_token, used_rf_token]})
+        assert response.status_code == 200
+        results: list[dict] = response.json()["results"]
+        assert [result["valid"] for result in results] == [True, False, True, False]
+        assert results[0]["claims"]["scope"] == "access"
+        assert results[2]["claims"]["scope"] == "refresh"
+        assert results[1]["claims"] is None
+
+        ## Bad case: Empty and oversized batches
+        assert client.post(token_check_batch_url, json = {"tokens": []}).status_code == 422
+        assert client.post(token_check_batch_url, json = {"tokens": [ac_token] * (token.__check_batch_max__ + 1)}).status_code == 422
+
+class Test_Principal_Dependency:
+    def test_one_decode_and_one_select_per_admin_request(self, monkeypatch):
+        '''
+        An admin route resolves the principal once: one token decode and one user SELECT, shared by the auth and admin checks
+        '''
+        test_admin = UserModel(id = 5, user_name = random_string(10), password_hash = random_string(10), min_token_verison = 10, is_admin = True)
+        with Session(db.engine) as session:
+            admin_token: str = token.issue_access_tokens(test_admin, session = session, lifetime_s = token_life_time_s)
+            user_token: str = token.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+
+        decode_calls: list = []
+        original_decode = token.decode_jwt
+        def counting_decode(*args, **kwargs):
+            decode_calls.append(args[0])
+            return original_decode(*args, **kwargs)
+        monkeypatch.setattr(token, "decode_jwt", counting_decode)
+
+        statements: list = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        api_engine = db.async_engine.sync_engine if db.ASYNC_MODE else db.engine
+        event.listen(api_engine, "before_cursor_execute", record_statement)
+        try:
+            for ac_token, expected_status in ((admin_token, 200), (user_token, 403)):
+                ## Nothing cached, so the decode and the SELECT both happen
+                claims_cache.clear()
+                UserUtil.user_state_cache.clear()
+                decode_calls.clear()
+                statements.clear()
+                response = client.get(admin_only_url, headers = {"Authorization": f"Bearer {ac_token}"})
+                assert response.status_code == expected_status
+                assert len(decode_calls) == 1
+                assert len([statement for statement in statements if statement.lstrip().upper().startswith("SELECT")]) == 1
+        finally:
+            event.remove(api_engine, "before_cursor_execute", record_statement)
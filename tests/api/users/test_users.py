@@ -7,6 +7,7 @@ from util import user as UserUtil
 from util import hash as HashUtil
 from sqlmodel import Session, select
 import db
+import json
 import time
 import random
 import string
@@ -83,6 +84,120 @@ class Test_User_Get_All:
                 fields_in_dict = list(user_dict.keys())
                 assert two_list_total_match(fields_in_dict, self.expected_fields) == True
                     
+class Test_User_Get_All_Paged:
+    url = "/users/all"
+    expected_fields = ["id", "user_name", "email", "is_admin", "is_active"]
+
+    def test_keyset_pages(self):
+        with Session(db.engine) as session:
+            ac_token: str = TokenUtil.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+            headers = {"Authorization": f"Bearer {ac_token}"}
+
+            ## Full listing as reference
+            response = client.get(self.url, headers = headers, params = {"limit": 1000})
+            assert response.status_code == 200
+            all_ids: list = [user_dict["id"] for user_dict in response.json()]
+
+            ## Walk the pages by cursor
+            paged_ids: list = []
+            after_id: int = 0
+            while True:
+                response = client.get(self.url, headers = headers, params = {"after_id": after_id, "limit": 2})
+                assert response.status_code == 200
+                page: list = response.json()
+                assert len(page) <= 2
+                paged_ids += [user_dict["id"] for user_dict in page]
+                if not "X-Next-Cursor" in response.headers:
+                    break
+                after_id = int(response.headers["X-Next-Cursor"])
+            assert paged_ids == all_ids
+            assert paged_ids == sorted(paged_ids)
+
+            ## Bad limit
+            response = client.get(self.url, headers = headers, params = {"limit": 0})
+            assert response.status_code == 422
+
+    def test_ndjson_stream(self):
+        with Session(db.engine) as session:
+            ac_token: str = TokenUtil.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+            headers = {"Authorization": f"Bearer {ac_token}"}
+
+            response = client.get(self.url, headers = headers, params = {"limit": 1000})
+            all_ids: list = [user_dict["id"] for user_dict in response.json()]
+
+            response = client.get(self.url, headers = headers, params = {"stream": True})
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            rows: list = [json.loads(line) for line in response.text.splitlines() if line]
+            assert [row["id"] for row in rows] == all_ids
+            for row in rows:
+                assert two_list_total_match(list(row.keys()), self.expected_fields) == True
+
+class Test_User_Get_Conditional:
+    url = "/users/all"
+
+    def test_etag_and_not_modified(self, monkeypatch):
+        monkeypatch.setattr(UserUtil.user_table_version, "max_age_s", 3600) ## No expiry during the test
+        with Session(db.engine) as session:
+            ac_token: str = TokenUtil.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+            headers = {"Authorization": f"Bearer {ac_token}"}
+
+            response = client.get(self.url, headers = headers, params = {"limit": 1000})
+            assert response.status_code == 200
+            etag: str = response.headers["ETag"]
+            body: list = response.json()
+
+            ## Same page again: served from the cache, then not modified on a matching If-None-Match
+            response = client.get(self.url, headers = headers, params = {"limit": 1000})
+            assert response.headers["ETag"] == etag
+            assert response.json() == body
+            response = client.get(self.url, headers = {**headers, "If-None-Match": etag}, params = {"limit": 1000})
+            assert response.status_code == 304
+            assert response.content == b""
+            response = client.get(self.url, headers = {**headers, "If-None-Match": f'"other", W/{etag}'}, params = {"limit": 1000})
+            assert response.status_code == 304
+
+            ## Another page has its own tag
+            response = client.get(self.url, headers = {**headers, "If-None-Match": etag}, params = {"limit": 1})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+
+            ## Any write to the user table changes the tag
+            UserUtil.user_table_changed()
+            response = client.get(self.url, headers = {**headers, "If-None-Match": etag}, params = {"limit": 1000})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+            assert response.json() == body
+
+    def test_single_user_etag(self, monkeypatch):
+        monkeypatch.setattr(UserUtil.user_table_version, "max_age_s", 3600)
+        with Session(db.engine) as session:
+            ac_token: str = TokenUtil.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+            headers = {"Authorization": f"Bearer {ac_token}"}
+            url = f"/users/uid/{test_user.id}"
+
+            response = client.get(url, headers = headers)
+            assert response.status_code == 200
+            etag: str = response.headers["ETag"]
+            response = client.get(url, headers = {**headers, "If-None-Match": etag})
+            assert response.status_code == 304
+
+    def test_etag_expiry(self, monkeypatch):
+        ## Writes made by other processes are not seen, so tags and cached pages expire after max_age_s
+        monkeypatch.setattr(UserUtil.user_table_version, "max_age_s", 0.5)
+        with Session(db.engine) as session:
+            ac_token: str = TokenUtil.issue_access_tokens(test_user, session = session, lifetime_s = token_life_time_s)
+            headers = {"Authorization": f"Bearer {ac_token}"}
+
+            response = client.get(self.url, headers = headers, params = {"limit": 1000})
+            etag: str = response.headers["ETag"]
+            misses: int = UserUtil.listing_cache.misses
+            time.sleep(0.6)
+            response = client.get(self.url, headers = {**headers, "If-None-Match": etag}, params = {"limit": 1000})
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+            assert UserUtil.listing_cache.misses == misses + 1
+
 class Test_Read_Single_User:
     target_uid = 1
     url = f"/users/uid/{target_uid}"
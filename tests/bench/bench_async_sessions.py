@@ -0,0 +1,79 @@
+'''
+Throughput benchmark of the API routes with the sync and the async session dependency.
+
+Run from the project root:
+    python -m tests.bench.bench_async_sessions --clients 64 --requests 4000
+
+Requires "async_mode" to be on in config/settings.json and user of UID 1 on the DB (same as the tests).
+The sync run overrides the session dependency with a plain Session, the async run uses the configured aiosqlite engine.
+The sync Session is used on the event loop thread, where a pool checkout that has to wait blocks the loop and no connection is ever returned,
+so the sync run gets its own engine with a pool of at least `--clients` connections.
+'''
+from httpx import AsyncClient, ASGITransport
+from sqlmodel import Session
+from main import app
+from models.users import User as UserModel
+from util import token as TokenUtil
+import argparse
+import asyncio
+import time
+import db
+
+def sync_session_dependency(clients: int) -> callable:
+    pool: dict = db.POOL_OPTIONS | {"pool_size": max(db.POOL_OPTIONS.get("pool_size", 5), clients)}
+    sync_engine = db.build_engine(db.DATABASE_URL, pragmas = db.SQLITE_PRAGMAS, pool = pool)
+
+    def sync_api_session():
+        with Session(sync_engine) as session:
+            yield session
+    return sync_api_session
+
+async def run_load(url: str, ac_token: str, clients: int, total_requests: int) -> float:
+    '''
+    Fire `total_requests` GET requests with `clients` concurrent workers. Return requests per second.
+    '''
+    headers = {"Authorization": f"Bearer {ac_token}"}
+    remaining = [total_requests]
+
+    async with AsyncClient(transport = ASGITransport(app = app), base_url = "http://bench") as client:
+        async def worker():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                response = await client.get(url, headers = headers)
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+    return total_requests / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = "Sync vs async session throughput")
+    parser.add_argument("--clients", type = int, default = 64)
+    parser.add_argument("--requests", type = int, default = 4000)
+    parser.add_argument("--url", type = str, default = "/users/uid/1")
+    args = parser.parse_args()
+
+    if not db.ASYNC_MODE:
+        print("Error: Please turn on db.async_mode in config/settings.json to run this benchmark")
+        exit(1)
+
+    with Session(db.engine) as session:
+        user: UserModel = session.get(UserModel, 1)
+        ac_token = TokenUtil.issue_access_tokens(user, session = session)
+
+    ## Sync session
+    app.dependency_overrides[db.get_api_session] = sync_session_dependency(args.clients)
+    sync_rps = asyncio.run(run_load(args.url, ac_token, args.clients, args.requests))
+    app.dependency_overrides.clear()
+
+    ## Async session
+    async_rps = asyncio.run(run_load(args.url, ac_token, args.clients, args.requests))
+
+    print(f"Clients: {args.clients}, requests: {args.requests}, url: {args.url}")
+    print(f"Sync session:\t{sync_rps:.1f} req/s")
+    print(f"Async session:\t{async_rps:.1f} req/s")
+    print(f"Gain:\t\t{async_rps / sync_rps:.2f}x")
+
+if __name__ == "__main__":
+    main()
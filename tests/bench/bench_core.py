@@ -0,0 +1,122 @@
+'''
+Micro-benchmarks of the hot paths: hashing, JWT signing and decoding (with the HS256 codec against PyJWT), token checking, refresh token creation and refresh processing.
+
+Run from the project root:
+    python -m tests.bench.bench_core --save              ## Record tests/bench/baseline.json
+    python -m tests.bench.bench_core --compare           ## Fail (exit 1) on regression past the threshold
+    python -m tests.bench.bench_core --compare --threshold 0.3 --only jwt
+
+DB work runs on a temporary SQLite file seeded with users, using the same engine options as the app.
+'''
+from models.users import User as UserModel
+from sqlmodel import SQLModel, Session
+from util import hash as HashUtil
+from util import token as TokenUtil
+from tests.bench import harness
+import argparse
+import tempfile
+import jwt
+import os
+import db
+
+baseline_path: str = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+def seed(target_engine, user_count: int = 1000) -> UserModel:
+    SQLModel.metadata.create_all(target_engine)
+    with Session(target_engine) as session:
+        session.add_all([UserModel(user_name = f"bench_{i}", email = f"bench_{i}@example.com", password_hash = "x", is_active = True) for i in range(user_count)])
+        session.commit()
+        user = session.get(UserModel, 1)
+        session.expunge(user)
+        return user
+
+def run_benchmarks(scale: float = 1.0, only: str = None) -> dict:
+    results: dict = {}
+    def selected(name: str) -> bool:
+        return only is None or only in name
+    def iterations(count: int) -> int:
+        return max(5, int(count * scale))
+
+    ## Hashing
+    clear_password = "bench-password-123"
+    password_hash = HashUtil.hashing(clear_password)
+    if selected("hash.hashing"):
+        results["hash.hashing"] = harness.measure(lambda: HashUtil.hashing(clear_password), iterations(20))
+    if selected("hash.verify"):
+        results["hash.verify"] = harness.measure(lambda: HashUtil.verify(clear_password, password_hash), iterations(20))
+
+    ## JWT
+    payload = {"uid": 1, "version": 0, "iat": 1700000000, "exp": 4000000000, "scope": "access"}
+    signed = TokenUtil.sign_jwt(payload)
+    if selected("jwt.sign_jwt"):
+        results["jwt.sign_jwt"] = harness.measure(lambda: TokenUtil.sign_jwt(payload), iterations(20000))
+    if selected("jwt.decode_jwt"):
+        results["jwt.decode_jwt"] = harness.measure(lambda: TokenUtil.decode_jwt(signed), iterations(20000))
+
+    ## HS256 codec against PyJWT, with the same key and payload
+    codec = TokenUtil.HS256Codec(TokenUtil.__secret__)
+    codec_signed = codec.encode(payload)
+    if selected("jwt.hs256_codec.encode"):
+        results["jwt.hs256_codec.encode"] = harness.measure(lambda: codec.encode(payload), iterations(20000))
+    if selected("jwt.pyjwt.encode"):
+        results["jwt.pyjwt.encode"] = harness.measure(lambda: jwt.encode(payload, TokenUtil.__secret__, algorithm = "HS256"), iterations(20000))
+    if selected("jwt.hs256_codec.decode"):
+        results["jwt.hs256_codec.decode"] = harness.measure(lambda: codec.decode(codec_signed), iterations(20000))
+    if selected("jwt.pyjwt.decode"):
+        results["jwt.pyjwt.decode"] = harness.measure(lambda: jwt.decode(codec_signed, TokenUtil.__secret__, algorithms = ["HS256"]), iterations(20000))
+
+    ## DB backed paths
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target_engine = db.build_engine(f"sqlite:///{os.path.join(temp_dir, 'bench.sqlite')}", pragmas = db.SQLITE_PRAGMAS, pool = db.POOL_OPTIONS)
+        user = seed(target_engine)
+        with Session(target_engine) as session:
+            access_token = TokenUtil.create_token(user, session = session, is_access = True)
+            refresh_token = TokenUtil.create_token(user, session = session, is_access = False)
+
+            if selected("token.check_token.access"):
+                results["token.check_token.access"] = harness.measure(lambda: TokenUtil.check_token(access_token, session = session, check_access = True), iterations(5000))
+            if selected("token.check_token.refresh"):
+                results["token.check_token.refresh"] = harness.measure(lambda: TokenUtil.check_token(refresh_token, session = session, check_refresh = True), iterations(5000))
+            if selected("token.create_token.refresh"):
+                results["token.create_token.refresh"] = harness.measure(lambda: TokenUtil.create_token(user, session = session, is_access = False), iterations(1000))
+            if selected("token.process_refresh"):
+                ## A fresh refresh token per call, since each one can only be used once
+                results["token.process_refresh"] = harness.measure(
+                    lambda old_token: TokenUtil.process_refresh(old_token, session = session),
+                    iterations(1000),
+                    setup = lambda: TokenUtil.create_token(user, session = session, is_access = False),
+                )
+        target_engine.dispose()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Hot path micro-benchmarks")
+    parser.add_argument("--save", action = "store_true", help = "Write the results as the new baseline")
+    parser.add_argument("--compare", action = "store_true", help = "Compare against the baseline, exit 1 on regression")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "Allowed regression ratio, 0.2 = 20%%")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "Multiply iteration counts")
+    parser.add_argument("--only", type = str, default = None, help = "Run benchmarks whose name contains this text")
+    parser.add_argument("--baseline", type = str, default = baseline_path)
+    args = parser.parse_args()
+
+    results = run_benchmarks(scale = args.scale, only = args.only)
+    baseline = harness.load_baseline(args.baseline) if args.compare else None
+    harness.print_table(results, baseline)
+
+    if args.save:
+        harness.save_baseline(results, args.baseline)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.compare:
+        regressions = harness.compare(results, baseline, threshold = args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for message in regressions:
+                print(f"  {message}")
+            exit(1)
+        print("\nNo regression past the threshold")
+    exit(0)
+
+if __name__ == "__main__":
+    main()
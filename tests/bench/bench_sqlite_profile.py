@@ -0,0 +1,94 @@
+'''
+Compare the SQLite performance profiles of db.py under concurrent reads and token writes.
+
+Run from the project root:
+    python -m tests.bench.bench_sqlite_profile --readers 8 --seconds 5
+
+Each profile gets a fresh temporary DB file seeded with users. Reader threads select users by ID while one writer thread registers refresh tokens, one commit each, as login does.
+'''
+from models.users import User as UserModel
+from models.tokens import RefreshTokenRegister
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Session, select
+import argparse
+import tempfile
+import threading
+import time
+import os
+import db
+
+def seed(target_engine, user_count: int):
+    SQLModel.metadata.create_all(target_engine)
+    with Session(target_engine) as session:
+        session.add_all([UserModel(user_name = f"user_{i}", email = f"user_{i}@example.com", password_hash = "x", is_active = True) for i in range(user_count)])
+        session.commit()
+
+def run_profile(profile: str, readers: int, seconds: float, user_count: int) -> dict:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        url = f"sqlite:///{os.path.join(temp_dir, 'bench.sqlite')}"
+        target_engine = db.build_engine(url, pragmas = db.SQLITE_PROFILES[profile], pool = {"pool_size": readers + 1, "max_overflow": 0})
+        seed(target_engine, user_count)
+
+        counts = {"reads": 0, "writes": 0, "locked": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def reader(offset: int):
+            with Session(target_engine) as session:
+                uid = offset
+                while not stop.is_set():
+                    try:
+                        session.exec(select(UserModel).where(UserModel.id == uid % user_count + 1)).first()
+                        session.rollback() ## End the read transaction
+                        with lock:
+                            counts["reads"] += 1
+                    except OperationalError:
+                        session.rollback()
+                        with lock:
+                            counts["locked"] += 1
+                    uid += 7
+
+        def writer():
+            with Session(target_engine) as session:
+                while not stop.is_set():
+                    time_now = int(time.time())
+                    try:
+                        session.add(RefreshTokenRegister(uid = 1, iat = time_now, exp = time_now + 3600))
+                        session.commit()
+                        with lock:
+                            counts["writes"] += 1
+                    except OperationalError:
+                        session.rollback()
+                        with lock:
+                            counts["locked"] += 1
+
+        threads = [threading.Thread(target = reader, args = (i,)) for i in range(readers)] + [threading.Thread(target = writer)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        target_engine.dispose()
+
+    return {
+        "reads_per_s": counts["reads"] / seconds,
+        "writes_per_s": counts["writes"] / seconds,
+        "locked_errors": counts["locked"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "SQLite profile comparison")
+    parser.add_argument("--readers", type = int, default = 8)
+    parser.add_argument("--seconds", type = float, default = 5)
+    parser.add_argument("--users", type = int, default = 1000)
+    args = parser.parse_args()
+
+    print(f"Readers: {args.readers}, writer: 1, duration: {args.seconds} s\n")
+    print("Profile\t\tReads/s\t\tWrites/s\tLocked errors")
+    for profile in db.SQLITE_PROFILES:
+        result = run_profile(profile, args.readers, args.seconds, args.users)
+        print(f"{profile:<10}\t{result['reads_per_s']:.1f}\t\t{result['writes_per_s']:.1f}\t\t{result['locked_errors']}")
+
+if __name__ == "__main__":
+    main()
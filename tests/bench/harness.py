@@ -0,0 +1,64 @@
+'''
+Timing and baseline helpers of the benchmark suite.
+'''
+import statistics
+import json
+import time
+import os
+
+def measure(func: callable, iterations: int, setup: callable = None, warmup: int = 3) -> dict:
+    '''
+    Call `func` `iterations` times and return ops/sec and latency percentiles in microseconds.
+    If `setup` is given, it is called (untimed) before each call and its return value is passed to `func`.
+    '''
+    for _ in range(warmup):
+        func(setup()) if setup else func()
+
+    samples: list[float] = []
+    for _ in range(iterations):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        samples.append(time.perf_counter() - start)
+
+    samples.sort()
+    total = sum(samples)
+    return {
+        "ops_per_s": iterations / total if total > 0 else float("inf"),
+        "p50_us": statistics.median(samples) * 1e6,
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+        "iterations": iterations,
+    }
+
+def save_baseline(results: dict, path: str):
+    with open(path, "w") as baseline_file:
+        json.dump(results, baseline_file, indent = 4, sort_keys = True)
+
+def load_baseline(path: str) -> dict:
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No baseline at {path}, run with --save first.")
+    with open(path, "r") as baseline_file:
+        return json.load(baseline_file)
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    '''
+    Return a message per benchmark which regressed past `threshold` (e.g. 0.2 for 20%) on ops/sec or p99, compared to the baseline.
+    '''
+    regressions: list[str] = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["ops_per_s"] < base["ops_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: ops/sec {result['ops_per_s']:.1f} < baseline {base['ops_per_s']:.1f}")
+        if result["p99_us"] > base["p99_us"] * (1 + threshold):
+            regressions.append(f"{name}: p99 {result['p99_us']:.1f} us > baseline {base['p99_us']:.1f} us")
+    return regressions
+
+def print_table(results: dict, baseline: dict = None):
+    print(f"{'Benchmark':<28}{'ops/sec':>14}{'p50 (us)':>14}{'p99 (us)':>14}{'vs baseline':>14}")
+    for name, result in results.items():
+        change = ""
+        if baseline and name in baseline:
+            change = f"{result['ops_per_s'] / baseline[name]['ops_per_s'] - 1:+.1%}"
+        print(f"{name:<28}{result['ops_per_s']:>14.1f}{result['p50_us']:>14.1f}{result['p99_us']:>14.1f}{change:>14}")
@@ -0,0 +1,57 @@
+from util.blacklist import BloomFilter, RefreshBlacklistIndex
+import random
+import time
+
+class Test_Bloom_Filter:
+    def test_no_false_negative(self):
+        bloom = BloomFilter(capacity = 10000, error_rate = 0.01)
+        keys = random.sample(range(10**9), 5000)
+        for key in keys:
+            bloom.add(key)
+        for key in keys:
+            assert (key in bloom) == True
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity = 10000, error_rate = 0.01)
+        for key in range(10000):
+            bloom.add(key)
+
+        ## Keys never added should rarely be positive
+        false_positive = sum(1 for key in range(10**6, 10**6 + 10000) if key in bloom)
+        assert false_positive < 10000 * 0.03
+
+class Test_Blacklist_Index:
+    def test_lookup(self):
+        time_now = int(time.time())
+        index = RefreshBlacklistIndex(capacity = 1000, error_rate = 0.01, max_exact = 100, bucket_s = 60, grace_s = 0)
+        index.add(1, exp = time_now + 1000)
+        index.add(2, exp = time_now + 2000)
+
+        assert index.lookup(1) == True
+        assert index.lookup(2) == True
+        assert index.lookup(3) == False
+
+    def test_time_wheel_eviction(self):
+        bucket_end = (int(time.time()) // 60 + 10) * 60
+        index = RefreshBlacklistIndex(capacity = 1000, error_rate = 0.01, max_exact = 100, bucket_s = 60, grace_s = 10)
+        index.add(1, exp = bucket_end - 20)
+        index.add(2, exp = bucket_end - 10)
+        index.add(3, exp = bucket_end + 500)
+
+        ## Token 1 and 2 are on the same bucket, dropped once the bucket end plus grace has passed
+        assert index.evict_expired(time_now = bucket_end + 5) == 0
+        assert index.evict_expired(time_now = bucket_end + 10) == 2
+        assert index.lookup(1) == False
+        assert index.lookup(3) == True
+        assert index.stats()["exact_size"] == 1
+
+    def test_bounded_exact_set(self):
+        index = RefreshBlacklistIndex(capacity = 1000, error_rate = 0.01, max_exact = 2, bucket_s = 60, grace_s = 0)
+        for token_id in range(1, 4):
+            index.add(token_id, exp = 10**12)
+
+        ## Token over the exact limit is only on the Bloom filter, so DB must be asked
+        assert index.stats()["exact_size"] == 2
+        assert index.exact_complete == False
+        assert index.lookup(1) == True
+        assert index.lookup(3) is None
@@ -0,0 +1,65 @@
+from util.claims_cache import ClaimsCache
+import time
+
+class Counting_Decoder:
+    def __init__(self, claims: dict):
+        self.claims = claims
+        self.calls: int = 0
+
+    def __call__(self, token: str) -> dict:
+        self.calls += 1
+        if token.startswith("bad"):
+            raise ValueError("bad token")
+        return self.claims
+
+class Test_Claims_Cache:
+    def test_decode_once(self):
+        cache = ClaimsCache(max_size = 10, negative_ttl_s = 60, leeway_s = 0)
+        decode = Counting_Decoder({"uid": 1, "exp": int(time.time()) + 1000})
+
+        ## Good token: decoded on the first lookup only
+        assert cache.get_or_decode("good", decode) == decode.claims
+        assert cache.get_or_decode("good", decode) == decode.claims
+        assert decode.calls == 1
+
+        ## Bad token: negative cached
+        assert cache.get_or_decode("bad", decode) is None
+        assert cache.get_or_decode("bad", decode) is None
+        assert decode.calls == 2
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["negative_hits"], stats["misses"], stats["size"]) == (1, 1, 2, 2)
+        assert stats["hit_ratio"] == 0.5
+
+    def test_expiry(self):
+        cache = ClaimsCache(max_size = 10, negative_ttl_s = 0, leeway_s = 0)
+
+        ## Expired claims and negative entries past their TTL are decoded again
+        decode = Counting_Decoder({"uid": 1, "exp": int(time.time()) - 10})
+        cache.get_or_decode("old", decode)
+        cache.get_or_decode("old", decode)
+        assert decode.calls == 2
+
+        cache.get_or_decode("bad", decode)
+        time.sleep(0.01)
+        cache.get_or_decode("bad", decode)
+        assert decode.calls == 4
+
+    def test_bounded_size(self):
+        cache = ClaimsCache(max_size = 3, negative_ttl_s = 60, leeway_s = 0)
+        decode = Counting_Decoder({"uid": 1, "exp": int(time.time()) + 1000})
+        for token_number in range(10):
+            cache.get_or_decode(f"token-{token_number}", decode)
+        assert cache.stats()["size"] == 3
+
+        ## Least recently used dropped first
+        cache.get_or_decode("token-0", decode)
+        assert decode.calls == 11
+
+    def test_disabled(self):
+        cache = ClaimsCache(max_size = 10, negative_ttl_s = 60, leeway_s = 0, enabled = False)
+        decode = Counting_Decoder({"uid": 1, "exp": int(time.time()) + 1000})
+        cache.get_or_decode("good", decode)
+        cache.get_or_decode("good", decode)
+        assert decode.calls == 2
+        assert cache.stats()["size"] == 0
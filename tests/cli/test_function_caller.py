@@ -0,0 +1,39 @@
+import function_caller
+import tempfile
+import os
+
+good_script = '''
+import module_that_does_not_exist
+
+description = "A good command"
+
+def command():
+    pass
+'''
+
+no_command_script = '''
+description = "Helper module without command"
+'''
+
+class Test_Function_Registry:
+    def test_registry_without_import(self):
+        with tempfile.TemporaryDirectory() as cli_root:
+            with open(os.path.join(cli_root, "good.py"), "w") as script_file:
+                script_file.write(good_script)
+            with open(os.path.join(cli_root, "helper.py"), "w") as script_file:
+                script_file.write(no_command_script)
+
+            ## Metadata is read without running the import on the script
+            registry = function_caller.load_registry(cli_root)
+            assert list(registry.keys()) == ["good"]
+            assert registry["good"].description == "A good command"
+
+            ## Second load comes from the manifest
+            assert os.path.isfile(os.path.join(cli_root, "__pycache__", "registry.json"))
+            registry = function_caller.load_registry(cli_root)
+            assert registry["good"].description == "A good command"
+
+    def test_registry_of_repo(self):
+        registry = function_caller.load_registry("cli")
+        assert "create_superuser" in registry
+        assert "change_password" in registry
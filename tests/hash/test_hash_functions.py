@@ -1,8 +1,11 @@
 import pytest
+import asyncio
 import bcrypt
 import random
 import string
 from util import hash
+from util import metrics as MetricsUtil
+from concurrent.futures import ProcessPoolExecutor
 
 class Test_Hashing:
     def test_verifier(self):
@@ -67,3 +70,96 @@ class Test_Hashing:
             hashed_string = hash.hashing(None)
         
             
+
+class Test_Async_Hashing:
+    def test_async_hasher_and_verifier(self):
+        """
+        Hashing and verifying through the worker pool should behave the same as the inline functions
+        """
+        test_string = ''.join(random.choices(string.ascii_letters + string.digits + string.punctuation, k=20))
+
+        async def run():
+            hashed_string = await hash.hashing_async(test_string)
+            return (
+                await hash.verify_async(test_string, hashed_string),
+                await hash.verify_async(test_string[2:], hashed_string),
+                await hash.verify_async(None, hashed_string),
+            )
+
+        good, bad_clear, bad_type = asyncio.run(run())
+        assert good == True
+        assert bad_clear == False
+        assert bad_type == False
+
+    def test_async_queue_full(self):
+        """
+        Jobs beyond the worker count and queue depth should be rejected instead of queued
+        """
+        test_string = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+        capacity = hash.__pool_workers__ + hash.__pool_queue__
+
+        async def run():
+            jobs = [hash.hashing_async(test_string) for _ in range(capacity + 1)]
+            return await asyncio.gather(*jobs, return_exceptions = True)
+
+        results = asyncio.run(run())
+        rejected = [result for result in results if isinstance(result, hash.HashQueueFull)]
+        assert len(rejected) == 1
+
+    def test_metrics_recorded_with_process_pool(self, monkeypatch):
+        """
+        Pool jobs are timed on the worker but recorded by the calling process, so metrics see them with a process pool as well
+        """
+        calls_before = MetricsUtil.bcrypt_calls_total.value(("hash",)), MetricsUtil.bcrypt_calls_total.value(("verify",))
+        process_pool = ProcessPoolExecutor(max_workers = 1)
+        monkeypatch.setattr(hash, "_executor", process_pool)
+        try:
+            async def run():
+                hashed_string = await hash.hashing_async("process pool")
+                return await hash.verify_async("process pool", hashed_string)
+            assert asyncio.run(run()) == True
+        finally:
+            process_pool.shutdown(wait = True)
+        assert MetricsUtil.bcrypt_calls_total.value(("hash",)) == calls_before[0] + 1
+        assert MetricsUtil.bcrypt_calls_total.value(("verify",)) == calls_before[1] + 1
+
+class Test_Hasher_Registry:
+    def test_hash_prefixes(self):
+        bcrypt_hash = hash.BcryptHasher(rounds = 4).hash("password")
+        scrypt_hash = hash.ScryptHasher(ln = 4).hash("password")
+        assert hash.hasher_for(bcrypt_hash).name == "bcrypt"
+        assert hash.hasher_for(scrypt_hash).name == "scrypt"
+        assert hash.hasher_for("$unknown$abc") is None
+
+        ## Any registered algorithm verifies, whatever the default
+        assert hash.verify("password", scrypt_hash) == True
+        assert hash.verify("passw0rd", scrypt_hash) == False
+        assert hash.verify("password", bcrypt_hash) == True
+
+        ## Hashes stored as bytes (older rows) still verify
+        assert hash.verify("password", bcrypt_hash.encode("ascii")) == True
+
+    def test_needs_rehash(self, monkeypatch):
+        monkeypatch.setattr(hash, "__algorithm__", "bcrypt")
+        monkeypatch.setattr(hash.hashers["bcrypt"], "rounds", 5)
+        assert hash.needs_rehash(hash.BcryptHasher(rounds = 5).hash("password")) == False
+        assert hash.needs_rehash(hash.BcryptHasher(rounds = 4).hash("password")) == True
+        ## Stronger hashes, e.g. from a node calibrated higher, are kept
+        assert hash.needs_rehash(hash.BcryptHasher(rounds = 6).hash("password")) == False
+        assert hash.needs_rehash(hash.ScryptHasher(ln = 4).hash("password")) == True
+        assert hash.needs_rehash(None) == True
+
+        ## Switching algorithm: bcrypt hashes become out of date
+        monkeypatch.setattr(hash, "__algorithm__", "scrypt")
+        monkeypatch.setattr(hash.hashers["scrypt"], "ln", 4)
+        new_hash = hash.hashing("password")
+        assert new_hash.startswith("$scrypt$ln=4,")
+        assert hash.needs_rehash(new_hash) == False
+        assert hash.needs_rehash(hash.BcryptHasher(rounds = 5).hash("password")) == True
+
+    def test_calibrate(self, monkeypatch):
+        monkeypatch.setattr(hash.hashers["bcrypt"], "rounds", hash.hashers["bcrypt"].rounds)
+        rounds = hash.calibrate_bcrypt(target_ms = 1, min_rounds = 4, max_rounds = 12)
+        assert 4 <= rounds <= 12
+        assert hash.hashers["bcrypt"].rounds == rounds
+        assert hash.calibrate_bcrypt(target_ms = 10**9, min_rounds = 4, max_rounds = 6) == 6
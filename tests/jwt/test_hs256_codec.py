@@ -0,0 +1,47 @@
+import pytest
+from util import token
+import jwt
+import time
+
+secret: str = "codec-test-secret"
+codec = token.HS256Codec(secret)
+
+def sample_payload(lifetime_s: int = 1000) -> dict:
+    time_now = int(time.time())
+    return {"uid": 12, "version": 3, "iat": time_now, "exp": time_now + lifetime_s, "scope": "access"}
+
+class Test_HS256_Codec:
+    def test_wire_compatible(self):
+        payload = sample_payload()
+
+        ## Same token as PyJWT, and each decodes the other's tokens
+        assert codec.encode(payload) == jwt.encode(payload, secret, algorithm = "HS256")
+        assert jwt.decode(codec.encode(payload), secret, algorithms = ["HS256"]) == payload
+        assert codec.decode(jwt.encode(payload, secret, algorithm = "HS256")) == payload
+
+        ## Other header layout, still HS256
+        reordered = jwt.encode(payload, secret, algorithm = "HS256", headers = {"kid": "a"})
+        assert codec.decode(reordered) == payload
+
+    def test_rejections(self):
+        payload = sample_payload()
+        signed = codec.encode(payload)
+
+        with pytest.raises(jwt.InvalidSignatureError):
+            token.HS256Codec("other-secret").decode(signed)
+        with pytest.raises(jwt.DecodeError):
+            codec.decode("not.a-token")
+        with pytest.raises(jwt.InvalidAlgorithmError):
+            codec.decode(jwt.encode(payload, None, algorithm = "none"))
+        with pytest.raises(jwt.InvalidAudienceError):
+            codec.decode(codec.encode(payload | {"aud": "elsewhere"}))
+        with pytest.raises(TypeError):
+            codec.encode("not a dict")
+
+        ## Expiry with and without leeway, as PyJWT
+        expired = codec.encode(sample_payload(lifetime_s = -5))
+        with pytest.raises(jwt.ExpiredSignatureError):
+            codec.decode(expired)
+        assert codec.decode(expired, leeway = 60)["uid"] == 12
+        with pytest.raises(jwt.ImmatureSignatureError):
+            codec.decode(codec.encode(payload | {"nbf": int(time.time()) + 100}))
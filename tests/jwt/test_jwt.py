@@ -1,10 +1,12 @@
 import pytest
 from util import token
+from util import user as UserUtil
 from models.users import User as UserModel
-from models.tokens import RefreshTokenBlackList
+from models.tokens import RefreshTokenBlackList, RefreshTokenRegister
 from jwt.exceptions import ExpiredSignatureError
 from dependencies.dbsession import SessionDep
 from sqlmodel import Session, select
+from sqlalchemy import event
 import db
 import time
 import random
@@ -250,10 +252,10 @@ class Test_Auth_Operations:
             mod_acc_token = token.sign_jwt(token_body)
             assert token.check_token(mod_acc_token, session = session, check_access = True) == False
 
-    def delete_expired_blacklisted_tokens(self):
+    def test_delete_expired_consumed_tokens(self):
         with Session(db.engine) as session:
-            ## Create initial tokens
-            ac_token, rf_token = token.issue_access_refresh_tokens(test_user, session = session, access_lifetime_s = token_life_time_s, refresh_lifetime_s = None)
+            ## Create initial tokens, the refresh token expiring within the test
+            ac_token, rf_token = token.issue_access_refresh_tokens(test_user, session = session, access_lifetime_s = token_life_time_s, refresh_lifetime_s = token_life_time_s)
 
             ## Verify the tokens are good
             assert token.check_token(ac_token, session = session, check_access = True, with_leeway = False) == True
@@ -278,5 +280,85 @@ class Test_Auth_Operations:
             ## Call expired token removal function
             token.removed_expired_blacklist(session)
 
-            ## Confirm the old refresh token is removed from the blacklist
-            assert token.blacklisted_token_lookup(old_token_id, session) == False
\ No newline at end of file
+            ## The register row is gone, and the token still counts as blacklisted since it is no longer registered
+            assert session.exec(select(RefreshTokenRegister).where(RefreshTokenRegister.token_id == old_token_id)).first() is None
+            assert token.blacklisted_token_lookup(old_token_id, session) == True
+
+class Test_Stateless_Access:
+    def test_check_without_db(self, monkeypatch):
+        '''
+        With stateless access on, a known UID is checked from the token claims and the epoch table only, so no session is needed
+        '''
+        monkeypatch.setattr(token, "__stateless_access__", True)
+        active_user = UserModel(
+            id = 987654,
+            user_name = random_string(10),
+            password_hash = random_string(10),
+            min_token_verison = 3,
+            is_active = True,
+            is_admin = False,
+        )
+        ac_token = token.create_token(active_user, session = None, lifetime_s = token_life_time_s, is_access = True)
+        ac_token_decoded = token.decode_jwt(ac_token)
+        assert ac_token_decoded["active"] == True
+        assert ac_token_decoded["admin"] == False
+
+        try:
+            ## Good case: current version
+            UserUtil.token_epochs.set_version(active_user.id, 3)
+            assert token.check_token(ac_token, session = None, check_access = True) == True
+            assert token.check_token(ac_token, session = None, check_access = True, check_admin = True) == False
+
+            ## Bad case: version advanced by password change
+            UserUtil.token_epochs.set_version(active_user.id, 4)
+            assert token.check_token(ac_token, session = None, check_access = True) == False
+        finally:
+            UserUtil.token_epochs.remove(active_user.id)
+
+
+class Test_Refresh_Rotation:
+    def test_rotation_in_one_transaction(self):
+        statements: list[str] = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with Session(db.engine) as session:
+            ac_token, rf_token = token.issue_access_refresh_tokens(test_user, session = session)
+
+            ## Cold user state cache: user select, consume update, registry insert
+            UserUtil.user_state_cache.clear()
+            event.listen(db.engine, "before_cursor_execute", record_statement)
+            try:
+                new_ac_token, new_rf_token = token.process_refresh(rf_token, session = session)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record_statement)
+            assert len(statements) <= 3, statements
+
+            assert token.check_token(new_ac_token, session = session, check_access = True) == True
+            assert token.check_token(new_rf_token, session = session, check_refresh = True) == True
+
+            ## Bad case: The consumed token cannot be rotated again
+            with pytest.raises(token.TokenInvalid):
+                token.process_refresh(rf_token, session = session)
+            assert token.check_token(new_rf_token, session = session, check_refresh = True) == True
+
+    def test_batch_check_statement_count(self):
+        statements: list[str] = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with Session(db.engine) as session:
+            tokens: list[str] = []
+            for _ in range(20):
+                tokens += token.issue_access_refresh_tokens(test_user, session = session)
+
+            ## Cold user state cache: one user select and one blacklist select for all tokens
+            UserUtil.user_state_cache.clear()
+            event.listen(db.engine, "before_cursor_execute", record_statement)
+            try:
+                results = token.check_tokens_batch(tokens + ["not-a-token"], session = session)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record_statement)
+            assert len(statements) <= 2, statements
+            assert all(result is not None for result in results[:-1])
+            assert results[-1] is None
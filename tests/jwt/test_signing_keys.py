@@ -0,0 +1,55 @@
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from util import signing_keys as SigningKeys
+from util import token
+import jwt
+
+def make_key(kid: str, with_private: bool = True) -> SigningKeys.SigningKey:
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    return SigningKeys.SigningKey(kid = kid, public_key = private_key.public_key(), private_key = private_key if with_private else None)
+
+@pytest.fixture
+def eddsa_ring(monkeypatch):
+    ## Active key plus a retired key which still verifies the tokens it signed
+    retired = make_key("old")
+    key_ring = SigningKeys.KeyRing("EdDSA", [retired, make_key("new")], active_kid = "new")
+    monkeypatch.setattr(SigningKeys, "_key_ring", key_ring)
+    monkeypatch.setattr(token, "__algorithm__", "EdDSA")
+    return key_ring, retired
+
+class Test_Signing_Keys:
+    def test_sign_with_active_kid(self, eddsa_ring):
+        key_ring, retired = eddsa_ring
+        payload = {"uid": 1, "version": 0}
+        signed = token.sign_jwt(payload)
+        assert jwt.get_unverified_header(signed)["kid"] == "new"
+        assert token.decode_jwt(signed) == payload
+
+        ## Token of the retired key is still accepted
+        old_signed = jwt.encode(payload, retired.private_key, algorithm = "EdDSA", headers = {"kid": "old"})
+        assert token.decode_jwt(old_signed) == payload
+
+        ## Bad case: Unknown kid, and HS256 with the shared key
+        unknown_signed = jwt.encode(payload, make_key("other").private_key, algorithm = "EdDSA", headers = {"kid": "other"})
+        with pytest.raises(jwt.InvalidTokenError):
+            token.decode_jwt(unknown_signed)
+        with pytest.raises(jwt.InvalidTokenError):
+            token.decode_jwt(jwt.encode(payload, token.__secret__, algorithm = "HS256", headers = {"kid": "new"}))
+
+    def test_jwks(self, eddsa_ring):
+        key_ring, _ = eddsa_ring
+        jwks = key_ring.jwks()
+        assert sorted(key["kid"] for key in jwks["keys"]) == ["new", "old"]
+        assert all(key["alg"] == "EdDSA" and key["use"] == "sig" and "d" not in key for key in jwks["keys"])
+
+        ## Another service verifies with the published key only
+        signed = token.sign_jwt({"uid": 1, "version": 0})
+        public_keys = {key["kid"]: jwt.PyJWK(key) for key in jwks["keys"]}
+        kid = jwt.get_unverified_header(signed)["kid"]
+        assert jwt.decode(signed, public_keys[kid].key, algorithms = ["EdDSA"]) == {"uid": 1, "version": 0}
+
+    def test_active_key_needs_private_key(self):
+        with pytest.raises(SigningKeys.SigningKeyError):
+            SigningKeys.KeyRing("EdDSA", [make_key("public-only", with_private = False)], active_kid = "public-only")
+        with pytest.raises(SigningKeys.SigningKeyError):
+            SigningKeys.KeyRing("HS256", [make_key("new")], active_kid = "new")
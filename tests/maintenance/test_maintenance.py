@@ -0,0 +1,54 @@
+from util import maintenance as MaintenanceUtil
+from util.blacklist import RefreshBlacklistIndex
+from models.tokens import RefreshTokenRegister
+from sqlmodel import Session, select
+import db
+import time
+
+class Test_Token_Purging:
+    def test_purge_in_batches(self):
+        time_now = int(time.time())
+        expired_exp = time_now - MaintenanceUtil.__leeway_s__ - 1000
+        with Session(db.engine) as session:
+            ## Expired registry rows, consumed or not, and a live one
+            expired_rows = [RefreshTokenRegister(uid = 1, iat = expired_exp - 10, exp = expired_exp, consumed_at = expired_exp - 5 if i % 2 else None) for i in range(5)]
+            live_row = RefreshTokenRegister(uid = 1, iat = time_now, exp = time_now + 1000)
+            session.add_all(expired_rows + [live_row])
+            session.commit()
+            expired_ids = [row.token_id for row in expired_rows]
+            live_id = live_row.token_id
+
+            ## Purge with a batch smaller than the rows to remove
+            register_removed = MaintenanceUtil.purge_expired_tokens(session, batch_size = 2, batch_pause_s = 0)
+            assert register_removed >= 5
+
+            ## Only the expired rows are gone
+            assert session.exec(select(RefreshTokenRegister).where(RefreshTokenRegister.token_id.in_(expired_ids))).all() == []
+            assert session.get(RefreshTokenRegister, live_id) is not None
+
+            ## Clean up
+            session.delete(session.get(RefreshTokenRegister, live_id))
+            session.commit()
+
+    def test_run_records_stats(self):
+        runs_before: int = MaintenanceUtil.maintenance_stats.runs
+        stats = MaintenanceUtil.run_maintenance()
+        assert stats.runs == runs_before + 1
+        assert stats.last_error is None
+        assert stats.last_duration_s >= 0
+
+    def test_overflowed_index_reloaded(self, monkeypatch):
+        ## Index whose exact set overflowed, as after a burst of refreshes
+        index = RefreshBlacklistIndex(capacity = 1000, error_rate = 0.01, max_exact = 1, bucket_s = 60, grace_s = 0)
+        index.loaded = True
+        for token_id in (-1, -2):
+            index.add(token_id, exp = 10**12)
+        assert index.needs_reload() == True
+        monkeypatch.setattr(MaintenanceUtil, "blacklist_index", index)
+
+        ## Room for every consumed token on DB: the round rebuilds a complete index
+        index.max_exact = 10**9
+        stats = MaintenanceUtil.run_maintenance()
+        assert stats.last_error is None
+        assert index.needs_reload() == False
+        assert index.lookup(-2) == False
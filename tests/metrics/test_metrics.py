@@ -0,0 +1,67 @@
+from fastapi.testclient import TestClient
+from main import app
+from util import metrics as MetricsUtil
+from models.tokens import RefreshTokenRegister
+from sqlalchemy import event
+import db
+
+client = TestClient(app)
+
+class Test_Metric_Types:
+    def test_counter_render(self):
+        counter = MetricsUtil.Counter("test_counter_total", "A counter", ("route",))
+        counter.inc(labels = ("/a",))
+        counter.inc(2, labels = ("/a",))
+        counter.inc(labels = ('/b"',))
+        lines = counter.render()
+        assert "# TYPE test_counter_total counter" in lines
+        assert 'test_counter_total{route="/a"} 3' in lines
+        assert 'test_counter_total{route="/b\\""} 1' in lines
+
+    def test_histogram_render(self):
+        histogram = MetricsUtil.Histogram("test_latency_seconds", "A histogram", buckets = (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+        lines = histogram.render()
+        assert 'test_latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 'test_latency_seconds_bucket{le="1.0"} 3' in lines
+        assert 'test_latency_seconds_bucket{le="+Inf"} 4' in lines
+        assert "test_latency_seconds_count 4" in lines
+
+class Test_Metrics_Api:
+    def test_metrics_endpoint(self):
+        ## Any request is recorded under its route template
+        client.post("/auth/token/check", json = {"token": "not-a-token"})
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body: str = response.text
+        assert 'http_requests_total{method="POST",route="/auth/token/check",status="406"}' in body
+        assert "sql_queries_per_request_count" in body
+        assert "refresh_token_register_rows " in body
+        assert "refresh_token_consumed_rows " in body
+        assert "token_claims_cache_hit_ratio " in body
+        assert "# TYPE token_claims_cache_hits_total counter" in body
+        assert "token_claims_cache_misses_total " in body
+        assert "# TYPE login_rejected_rate_limit_total counter" in body
+        assert "login_rejected_concurrency_total " in body
+        assert "# TYPE user_listing_cache_hits_total counter" in body
+        assert "user_listing_cache_misses_total " in body
+        assert "# TYPE maintenance_runs_total counter" in body
+        assert "maintenance_register_rows_removed_total " in body
+        assert "maintenance_last_run_timestamp_seconds " in body
+
+    def test_row_counts_cached(self):
+        from routers.monitor import apis as MonitorApis
+        MonitorApis._row_counts.clear()
+        queries: list[str] = []
+        listener = lambda conn, cursor, statement, *args: queries.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            first = MonitorApis._count_rows("register", RefreshTokenRegister)
+            second = MonitorApis._count_rows("register", RefreshTokenRegister)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+        assert first == second
+        assert len(queries) == 1
@@ -0,0 +1,58 @@
+from sqlalchemy import create_engine, text
+import migrations
+import tempfile
+import os
+
+## Schema of the token and user tables before any migration
+old_schema: list[str] = [
+    "CREATE TABLE user (id INTEGER PRIMARY KEY, user_name VARCHAR NOT NULL UNIQUE, email VARCHAR, password_hash VARCHAR NOT NULL, min_token_verison INTEGER NOT NULL, is_admin BOOLEAN NOT NULL, is_active BOOLEAN NOT NULL)",
+    "CREATE TABLE refreshtokenregister (token_id INTEGER PRIMARY KEY, uid INTEGER NOT NULL, iat INTEGER NOT NULL, exp INTEGER NOT NULL)",
+    "CREATE TABLE refreshtokenblacklist (token_id INTEGER PRIMARY KEY, reg_time INTEGER NOT NULL, exp INTEGER NOT NULL)",
+]
+
+class Test_Migration_Runner:
+    def test_migrate_existing_db(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = create_engine(f"sqlite:///{os.path.join(temp_dir, 'old.sqlite')}")
+            with engine.begin() as connection:
+                for statement in old_schema:
+                    connection.execute(text(statement))
+            assert migrations.get_schema_version(engine) == 0
+
+            ## First run applies everything
+            applied = migrations.run_migrations(engine)
+            assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+            assert migrations.get_schema_version(engine) == migrations.latest_version()
+
+            ## Indexes are in place
+            with engine.connect() as connection:
+                index_names = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars().all())
+                assert "ix_refreshtokenregister_uid" in index_names
+                assert "ix_refreshtokenregister_exp" in index_names
+                assert "ix_user_active_id" in index_names
+
+                ## Purge by exp uses the index
+                plan = " ".join(str(row) for row in connection.execute(text("EXPLAIN QUERY PLAN DELETE FROM refreshtokenregister WHERE exp < 100")).all())
+                assert "ix_refreshtokenregister_exp" in plan
+
+            ## Second run is a no-op
+            assert migrations.run_migrations(engine) == []
+            engine.dispose()
+
+    def test_blacklist_moved_to_register(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = create_engine(f"sqlite:///{os.path.join(temp_dir, 'old.sqlite')}")
+            with engine.begin() as connection:
+                for statement in old_schema:
+                    connection.execute(text(statement))
+                connection.execute(text("INSERT INTO refreshtokenregister (token_id, uid, iat, exp) VALUES (1, 1, 100, 200), (2, 1, 100, 200)"))
+                connection.execute(text("INSERT INTO refreshtokenblacklist (token_id, reg_time, exp) VALUES (1, 150, 200), (3, 150, 200)"))
+
+            migrations.run_migrations(engine)
+
+            ## Blacklisted tokens are consumed on the register, the blacklist is emptied
+            with engine.connect() as connection:
+                consumed = dict(connection.execute(text("SELECT token_id, consumed_at FROM refreshtokenregister ORDER BY token_id")).all())
+                assert consumed == {1: 150, 2: None}
+                assert connection.execute(text("SELECT count(*) FROM refreshtokenblacklist")).scalar() == 0
+            engine.dispose()
@@ -0,0 +1,46 @@
+from util.profiler import RequestProfiler
+import tempfile
+import asyncio
+import time
+import os
+
+def run_profiled(profiler: RequestProfiler, headers: dict, duration_s: float, route: str = "/auth/token/refresh") -> bool:
+    profile = profiler.start(headers)
+    if profile is None:
+        return False
+    started_at = time.time()
+    sum(range(1000))
+    asyncio.run(profiler.finish(profile, "POST", route, 200, started_at, duration_s))
+    return True
+
+class Test_Request_Profiler:
+    def test_sampling(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profiler = RequestProfiler(enabled = True, sample_every = 3, header = "X-Profile", directory = temp_dir, max_files = 10)
+
+            ## 1 in 3 requests is profiled, the header does nothing without a secret
+            sampled = [run_profiled(profiler, {}, 0.01) for _ in range(6)]
+            assert sampled == [False, False, True, False, False, True]
+            assert run_profiled(profiler, {"X-Profile": "1"}, 0.01) == False
+
+            ## With a secret, requests carrying it are profiled as well
+            profiler.header_secret = "s3cret"
+            assert run_profiled(profiler, {"X-Profile": "1"}, 0.01) == False
+            assert run_profiled(profiler, {"X-Profile": "s3cret"}, 0.01) == True
+
+            ## Disabled profiler never samples
+            profiler.enabled = False
+            assert run_profiled(profiler, {"X-Profile": "1"}, 0.01) == False
+
+    def test_rotation_and_slowest(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profiler = RequestProfiler(enabled = True, sample_every = 1, header = "X-Profile", directory = temp_dir, max_files = 2)
+            for duration_s in (0.3, 0.1, 0.2):
+                assert run_profiled(profiler, {}, duration_s) == True
+                time.sleep(0.002) ## Distinct file name time stamps
+
+            ## Only the newest two profiles are kept, listed slowest first
+            assert len([name for name in os.listdir(temp_dir) if name.endswith(".prof")]) == 2
+            slowest = profiler.slowest()
+            assert [round(record["duration_ms"]) for record in slowest] == [200, 100]
+            assert slowest[0]["route"] == "/auth/token/refresh"
@@ -0,0 +1,54 @@
+from config import settings as SettingsUtil
+import subprocess
+import sys
+import os
+
+## Budget of the cumulative import time of main, in microseconds
+import_budget_us: int = 1500000
+
+def run_python(code: str, *options: str, env: dict = None) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, "-c", code], cwd = SettingsUtil.PROJECT_ROOT, capture_output = True, text = True, check = True, env = os.environ | (env or {}))
+
+def cumulative_import_us(importtime_output: str, module_name: str) -> int:
+    ## Lines look like "import time:       self [us] |  cumulative | imported package"
+    for line in importtime_output.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module_name:
+            return int(fields[1].strip())
+    raise LookupError(f"{module_name} not found on the import time report")
+
+class Test_Startup:
+    def test_import_main_time(self):
+        result = run_python("import main", "-X", "importtime")
+        main_us = cumulative_import_us(result.stderr, "main")
+        assert main_us < import_budget_us, f"import main took {main_us} us"
+
+    def test_no_engine_on_import(self):
+        result = run_python("import main, db; print(db._engine is None, db._async_engine is None)")
+        assert result.stdout.split() == ["True", "True"]
+
+    def test_no_heavy_imports(self):
+        result = run_python("import main, sys; print(any(name in sys.modules for name in ('pandas', 'numpy')))")
+        assert result.stdout.strip() == "False"
+
+    def test_no_async_extension_in_sync_mode(self):
+        ## Sync deployments do not need greenlet
+        result = run_python("import main, sys; print('sqlalchemy.ext.asyncio' in sys.modules)", env = {"APP__DB__ASYNC_MODE": "false"})
+        assert result.stdout.strip() == "False"
+
+class Test_Settings:
+    def test_env_overrides(self):
+        settings = {"db": {"sqlite_file": "db.sqlite", "echo": False}}
+        environ = {
+            "APP__DB__ECHO": "true",
+            "APP__DB__SQLITE_FILE": "/data/db.sqlite",
+            "APP__JWT__LEEWAY_S": "5",
+            "OTHER": "1",
+        }
+        SettingsUtil._apply_env_overrides(settings, environ)
+        assert settings["db"] == {"sqlite_file": "/data/db.sqlite", "echo": True}
+        assert settings["jwt"] == {"leeway_s": 5}
+
+    def test_paths_from_project_root(self):
+        assert SettingsUtil.resolve_path("/data/db.sqlite") == "/data/db.sqlite"
+        assert SettingsUtil.resolve_path("db.sqlite").startswith(SettingsUtil.PROJECT_ROOT)
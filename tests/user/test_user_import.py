@@ -0,0 +1,81 @@
+from util import user_import as ImportUtil
+from util import user as UserUtil
+from util import hash as HashUtil
+from models.users import User as UserModel
+from sqlmodel import Session, select
+import db
+import random
+import string
+
+def random_name(length: int = 12) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k = length))
+
+class Test_User_Import:
+    def test_read_csv_and_json(self):
+        csv_bytes = b"user_name,email,password,is_admin\nalice,alice@example.com,pw1,true\nbob,bob@example.com,pw2,\n"
+        rows = ImportUtil.read_user_table(csv_bytes, file_format = "csv")
+        assert [row["user_name"] for row in rows] == ["alice", "bob"]
+        assert [row["is_admin"] for row in rows] == [True, False]
+        assert [row["is_active"] for row in rows] == [True, True]
+
+        json_bytes = b'[{"user_name": "carol", "email": "carol@example.com", "password": "pw3", "is_active": false}]'
+        rows = ImportUtil.read_user_table(json_bytes, file_format = "json")
+        assert rows[0]["user_name"] == "carol"
+        assert rows[0]["is_active"] == False
+
+    def test_bulk_create_with_conflicts(self):
+        name_1, name_2, name_3 = random_name(), random_name(), random_name()
+        with Session(db.engine) as session:
+            ## Existing user
+            existing_user, err = UserUtil.create_new_user(name_3, f"{name_3}@example.com", "pw", session = session)
+            assert (err is None) == True
+
+            rows = [
+                {"user_name": name_1, "email": f"{name_1}@example.com", "password": "pw_1", "is_admin": False, "is_active": True},
+                {"user_name": name_1, "email": f"{name_1}@example.com", "password": "pw_1b", "is_admin": False, "is_active": True}, ## Repeated on file
+                {"user_name": name_2, "email": f"{name_2}@example.com", "password": "pw_2", "is_admin": True, "is_active": True},
+                {"user_name": name_3, "email": f"{name_3}@example.com", "password": "pw_3", "is_admin": False, "is_active": True}, ## On DB
+                {"user_name": "", "email": "", "password": "pw_4", "is_admin": False, "is_active": True}, ## Bad row
+            ]
+            report = ImportUtil.bulk_create_users(rows, session = session, chunk_size = 2, max_workers = 2)
+            assert report.created == 2
+            assert [conflict.row for conflict in report.conflicts] == [1, 3, 4]
+
+            ## Created users can log in with their passwords
+            created = session.exec(select(UserModel).where(UserModel.user_name.in_([name_1, name_2]))).all()
+            assert len(created) == 2
+            for user_model in created:
+                password = "pw_1" if user_model.user_name == name_1 else "pw_2"
+                assert HashUtil.verify(password, user_model.password_hash) == True
+
+            ## Clean up
+            for user_model in created:
+                assert UserUtil.delete_user_by_id(user_model.id, session = session) == 200
+            assert UserUtil.delete_user_by_id(existing_user.id, session = session) == 200
+
+    def test_rows_validated_before_hashing(self):
+        name_1, name_2 = random_name(), random_name()
+        with Session(db.engine) as session:
+            rows = [
+                {"user_name": name_1, "email": f"{name_1}@example.com", "password": "pw_1", "is_admin": False, "is_active": True},
+                {"user_name": random_name(), "email": "not-an-email", "password": "pw", "is_admin": False, "is_active": True},
+                {"user_name": random_name(), "email": "", "password": "pw", "is_admin": False, "is_active": True},
+                {"user_name": random_name(), "email": float("nan"), "password": "pw", "is_admin": False, "is_active": True},
+                {"user_name": random_name(), "email": None, "password": "pw", "is_admin": False, "is_active": True},
+                {"user_name": "u" * 51, "email": "long@example.com", "password": "pw", "is_admin": False, "is_active": True},
+                {"user_name": random_name(), "email": "multibyte@example.com", "password": "é" * 40, "is_admin": False, "is_active": True}, ## 40 characters, 80 bytes
+                {"user_name": name_2, "email": f"{name_2}@example.com", "password": "pw_2", "is_admin": False, "is_active": True},
+            ]
+            report = ImportUtil.bulk_create_users(rows, session = session, chunk_size = 2, executor = ImportUtil.get_http_executor())
+
+            ## Bad rows are reported, the import goes on with the others
+            assert report.created == 2
+            assert [conflict.row for conflict in report.conflicts] == [1, 2, 3, 4, 5, 6]
+            assert "email" in report.conflicts[0].reason
+            assert "password" in report.conflicts[-1].reason
+
+            ## Clean up
+            created = session.exec(select(UserModel).where(UserModel.user_name.in_([name_1, name_2]))).all()
+            assert len(created) == 2
+            for user_model in created:
+                assert UserUtil.delete_user_by_id(user_model.id, session = session) == 200
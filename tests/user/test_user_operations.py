@@ -245,4 +245,80 @@ class Test_User_Password_Change:
             
             ## Make sure the user is actually deleted
             found_user: UserModel = UserUtil.select_user_by_id(uid = user_uid, session = session)
-            assert (found_user is None) == True
\ No newline at end of file
+            assert (found_user is None) == True
+
+class Test_User_State_Cache:
+    def test_lru_and_ttl(self):
+        cache = UserUtil.UserStateCache(max_size = 2, ttl_s = 0.5)
+        state_1 = UserUtil.UserState(id = 1, min_token_verison = 0, is_active = True, is_admin = False)
+        state_2 = UserUtil.UserState(id = 2, min_token_verison = 0, is_active = True, is_admin = True)
+        state_3 = UserUtil.UserState(id = 3, min_token_verison = 1, is_active = False, is_admin = False)
+
+        ## Miss then hit
+        assert cache.get(1) is None
+        cache.put(state_1)
+        assert cache.get(1) == state_1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+        ## Least recently used entry is evicted when full
+        cache.put(state_2)
+        cache.get(1)
+        cache.put(state_3)
+        assert cache.get(2) is None
+        assert cache.get(1) == state_1
+        assert cache.stats()["size"] == 2
+
+        ## Entries expire after TTL
+        time.sleep(0.6)
+        assert cache.get(1) is None
+        assert cache.get(3) is None
+
+    def test_invalidation_on_password_change(self):
+        with Session(db.engine) as session:
+            ## Create test user and cache its state
+            new_user, err = UserUtil.create_new_user(user_name = random_string(10), email = random_email(), clear_text_pw = random_string(10), session = session)
+            assert (err is None) == True
+            user_uid: int = new_user.id
+            initial_state = UserUtil.get_user_state(user_uid, session = session)
+            assert initial_state.min_token_verison == new_user.min_token_verison
+            assert UserUtil.user_state_cache.get(user_uid) == initial_state
+
+            ## Password change drops the cached state
+            err = UserUtil.change_user_password(user_uid, random_string(10), session = session)
+            assert (err is None) == True
+            assert UserUtil.user_state_cache.get(user_uid) is None
+            assert UserUtil.get_user_state(user_uid, session = session).min_token_verison == initial_state.min_token_verison + 1
+
+            ## Deletion drops the cached state
+            status_code: int = UserUtil.delete_user_by_id(uid = user_uid, session = session)
+            assert status_code == 200
+            assert UserUtil.get_user_state(user_uid, session = session) is None
+
+class Test_Token_Epoch_Table:
+    def test_reload_picks_up_outside_writes(self):
+        with Session(db.engine) as session:
+            new_user, err = UserUtil.create_new_user(user_name = random_string(10), email = random_email(), clear_text_pw = random_string(10), session = session)
+            assert (err is None) == True
+            user_uid: int = new_user.id
+            table = UserUtil.TokenEpochTable(max_age_s = 60)
+            table.load(session)
+            assert table.lookup(user_uid) == (new_user.min_token_verison, 0)
+
+            ## Written around this module, as another process would: version and deactivation are seen on reload
+            new_user.min_token_verison += 1
+            new_user.is_active = False
+            session.add(new_user)
+            session.commit()
+            time_before_reload = int(time.time())
+            table.load(session)
+            version, not_before = table.lookup(user_uid)
+            assert version == new_user.min_token_verison
+            assert not_before >= time_before_reload
+
+            ## A table not reloaded for max_age_s answers nothing
+            table.max_age_s = 0
+            time.sleep(0.01)
+            assert table.lookup(user_uid) is None
+
+            assert UserUtil.delete_user_by_id(uid = user_uid, session = session) == 200
@@ -0,0 +1,121 @@
+'''
+In-process admission control for the login route, so that a burst of logins cannot take every core on password verification.
+Per user name and per client token buckets limit the rate of attempts, and a global cap limits the verifications running at once.
+'''
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from config.settings import section
+import threading
+import time
+
+## Admission parameters ##
+admission_dict: dict = section("login_admission")
+__enabled__: bool = admission_dict.get("enabled", True)
+__user_per_min__: float = admission_dict.get("user_per_min", 10)
+__user_burst__: int = admission_dict.get("user_burst", 5)
+__client_per_min__: float = admission_dict.get("client_per_min", 60)
+__client_burst__: int = admission_dict.get("client_burst", 20)
+__max_concurrent_verify__: int = admission_dict.get("max_concurrent_verify", 8)
+__max_keys__: int = admission_dict.get("max_keys", 100000) ## Per bucket table
+
+## Exceptions ##
+class AdmissionRejected(RuntimeError):
+    "Login attempt rejected by admission control"
+    def __init__(self, status_code: int, retry_after_s: float, msg="Too many login attempts"):
+        super().__init__(msg)
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+
+class TokenBuckets:
+    '''
+    Token bucket per key: up to `burst` attempts at once, refilled at `rate_per_s`.
+    At most `max_keys` keys are kept, least recently used first out. A key idle long enough to refill completely is dropped, as a new bucket is full anyway.
+    '''
+    def __init__(self, rate_per_s: float, burst: int, max_keys: int):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.max_keys = max_keys
+        self.full_after_s: float = burst / rate_per_s
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict() ## key -> (tokens, updated at)
+
+    def retry_after(self, key: str, time_now: float) -> float:
+        '''
+        Seconds until the key has a token, 0 if it has one now.
+        '''
+        tokens = self._tokens(key, time_now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate_per_s
+
+    def take(self, key: str, time_now: float):
+        self._buckets[key] = (self._tokens(key, time_now) - 1, time_now)
+        self._buckets.move_to_end(key)
+        self._expire(time_now)
+
+    def _tokens(self, key: str, time_now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return float(self.burst)
+        tokens, updated_at = entry
+        return min(float(self.burst), tokens + (time_now - updated_at) * self.rate_per_s)
+
+    def _expire(self, time_now: float):
+        while self._buckets:
+            oldest_key, (_, updated_at) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and time_now - updated_at < self.full_after_s:
+                break
+            del self._buckets[oldest_key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class LoginAdmission:
+    def __init__(self, enabled: bool = __enabled__, user_per_min: float = __user_per_min__, user_burst: int = __user_burst__, client_per_min: float = __client_per_min__, client_burst: int = __client_burst__, max_concurrent_verify: int = __max_concurrent_verify__, max_keys: int = __max_keys__):
+        self.enabled = enabled
+        self.users = TokenBuckets(user_per_min / 60, user_burst, max_keys)
+        self.clients = TokenBuckets(client_per_min / 60, client_burst, max_keys)
+        self.max_concurrent_verify = max_concurrent_verify
+        self.verifying_now: int = 0
+        self.rejected: dict[str, int] = {"user": 0, "client": 0, "concurrency": 0}
+        self._lock = threading.Lock()
+
+    def admit(self, user_name: str, client: str, time_now: float = None):
+        '''
+        Take a token from the buckets of the user name and of the client, or raise AdmissionRejected (429) without taking any.
+        '''
+        if not self.enabled:
+            return
+        time_now = time.monotonic() if time_now is None else time_now
+        user_key = user_name.lower()
+        with self._lock:
+            client_wait = self.clients.retry_after(client, time_now)
+            user_wait = self.users.retry_after(user_key, time_now)
+            if client_wait > 0 or user_wait > 0:
+                self.rejected["client" if client_wait >= user_wait else "user"] += 1
+                raise AdmissionRejected(429, max(client_wait, user_wait))
+            self.clients.take(client, time_now)
+            self.users.take(user_key, time_now)
+
+    @asynccontextmanager
+    async def verifying(self):
+        '''
+        Hold one of the `max_concurrent_verify` verification slots, or raise AdmissionRejected (503) right away if none is free.
+        '''
+        with self._lock:
+            if self.enabled and self.verifying_now >= self.max_concurrent_verify:
+                self.rejected["concurrency"] += 1
+                raise AdmissionRejected(503, 1, msg = "Too many logins in progress")
+            self.verifying_now += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.verifying_now -= 1
+
+    def stats(self) -> dict:
+        return {
+            "verifying_now": self.verifying_now,
+            "tracked_users": len(self.users),
+            "tracked_clients": len(self.clients),
+            "rejected": dict(self.rejected),
+        }
+
+login_admission = LoginAdmission()
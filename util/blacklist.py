@@ -0,0 +1,173 @@
+from models.tokens import RefreshTokenRegister
+from dependencies.dbsession import SessionDep
+from sqlmodel import select
+from config.settings import section
+import threading
+import hashlib
+import heapq
+import math
+import time
+
+## Blacklist index parameters ##
+index_dict: dict = section("blacklist_index")
+__index_enabled__: bool = index_dict.get("enabled", True)
+__bloom_capacity__: int = index_dict.get("bloom_capacity", 1000000)
+__bloom_error_rate__: float = index_dict.get("bloom_error_rate", 0.001)
+__max_exact__: int = index_dict.get("max_exact", 200000)
+__bucket_s__: int = index_dict.get("bucket_s", 3600)
+__load_batch__: int = index_dict.get("load_batch", 10000)
+__leeway_s__: int = section("jwt")["leeway_s"] ## Tokens are accepted up to the leeway past exp, keep their entries as long
+
+class BloomFilter:
+    '''
+    Fixed size Bloom filter of integer keys. Memory is set by `capacity` and `error_rate` only, regardless of how many keys are added.
+    '''
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count: int = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count: int = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.added: int = 0
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, "little", signed = True), digest_size = 16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, key: int):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.added += 1
+
+    def __contains__(self, key: int) -> bool:
+        for position in self._positions(key):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+class RefreshBlacklistIndex:
+    '''
+    In-memory index of the refresh token blacklist (consumed refresh tokens): a Bloom filter for fast negatives, plus an exact set of token IDs bucketed by `exp` for a time-wheel eviction.
+
+    The DB stays the source of truth. `lookup` returns True / False when the index can answer alone, or None when the DB must be queried:
+        - Bloom negative -> False.
+        - Bloom positive and in the exact set -> True.
+        - Bloom positive, not in the exact set -> False if the exact set holds every blacklisted token, otherwise None.
+    The exact set stops growing at `max_exact` entries, after which Bloom positives fall back to DB, so memory stays bounded,
+    until the maintenance scheduler reloads the index from DB once expired entries are purged (see `needs_reload`).
+    The index only sees blacklisting done by this process, so run one worker per DB file, or turn it off in settings.
+    '''
+    def __init__(self, capacity: int = __bloom_capacity__, error_rate: float = __bloom_error_rate__, max_exact: int = __max_exact__, bucket_s: int = __bucket_s__, grace_s: int = __leeway_s__):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_exact = max_exact
+        self.bucket_s = bucket_s
+        self.grace_s = grace_s
+        self.loaded: bool = False
+        self.exact_complete: bool = True
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._exact: set[int] = set()
+        self._buckets: dict[int, set[int]] = {}
+        self._bucket_heap: list[int] = []
+        self._lock = threading.Lock()
+
+    def load(self, session: SessionDep, batch_size: int = __load_batch__):
+        '''
+        Load the unexpired consumed tokens from DB, in keyset batches to keep memory flat while reading.
+        '''
+        time_now = int(time.time()) - self.grace_s
+        last_token_id = -1
+        with self._lock:
+            self._reset()
+            while True:
+                rows = session.exec(
+                    select(RefreshTokenRegister.token_id, RefreshTokenRegister.exp)
+                    .where(RefreshTokenRegister.consumed_at != None)
+                    .where(RefreshTokenRegister.exp >= time_now)
+                    .where(RefreshTokenRegister.token_id > last_token_id)
+                    .order_by(RefreshTokenRegister.token_id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                for token_id, exp in rows:
+                    self._add(token_id, exp)
+                last_token_id = rows[-1][0]
+            self.loaded = True
+
+    def add(self, token_id: int, exp: int):
+        with self._lock:
+            self._add(token_id, exp)
+        self.evict_expired() ## Turn the wheel, only a heap peek when nothing is due
+
+    def lookup(self, token_id: int) -> bool | None:
+        with self._lock:
+            if token_id not in self._bloom:
+                return False
+            if token_id in self._exact:
+                return True
+            if self.exact_complete:
+                return False
+            return None
+
+    def evict_expired(self, time_now: int = None) -> int:
+        '''
+        Drop exact entries of the buckets whose `exp` range, plus the token leeway, has fully passed. Rebuild the Bloom filter from the remaining entries if it is over capacity.
+        Return the number of entries dropped.
+        '''
+        time_now = int(time.time()) if time_now is None else time_now
+        removed: int = 0
+        with self._lock:
+            while self._bucket_heap and (self._bucket_heap[0] + 1) * self.bucket_s + self.grace_s <= time_now:
+                bucket = heapq.heappop(self._bucket_heap)
+                token_ids = self._buckets.pop(bucket, set())
+                self._exact.difference_update(token_ids)
+                removed += len(token_ids)
+
+            if self._bloom.added > self.capacity and self.exact_complete:
+                self._bloom = BloomFilter(self.capacity, self.error_rate)
+                for token_id in self._exact:
+                    self._bloom.add(token_id)
+        return removed
+
+    def needs_reload(self) -> bool:
+        '''
+        True once the exact set has overflowed: evicting entries cannot make it complete again, only a reload from DB can.
+        '''
+        return self.loaded and not self.exact_complete
+
+    def stats(self) -> dict:
+        return {
+            "exact_size": len(self._exact),
+            "exact_complete": self.exact_complete,
+            "bloom_added": self._bloom.added,
+            "bloom_bytes": self._bloom.nbytes(),
+            "buckets": len(self._buckets),
+        }
+
+    def _add(self, token_id: int, exp: int):
+        self._bloom.add(token_id)
+        if len(self._exact) >= self.max_exact:
+            self.exact_complete = False
+            return
+        bucket = exp // self.bucket_s
+        if bucket not in self._buckets:
+            self._buckets[bucket] = set()
+            heapq.heappush(self._bucket_heap, bucket)
+        self._buckets[bucket].add(token_id)
+        self._exact.add(token_id)
+
+    def _reset(self):
+        self.exact_complete = True
+        self._bloom = BloomFilter(self.capacity, self.error_rate)
+        self._exact = set()
+        self._buckets = {}
+        self._bucket_heap = []
+
+blacklist_index = RefreshBlacklistIndex()
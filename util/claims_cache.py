@@ -0,0 +1,94 @@
+'''
+Cache of verified token claims, so that a bearer token reused on every request is only verified and parsed once.
+'''
+from config.settings import section
+from collections import OrderedDict
+import threading
+import hashlib
+import time
+
+## Claims cache parameters ##
+cache_dict: dict = section("claims_cache")
+__enabled__: bool = cache_dict.get("enabled", True)
+__max_size__: int = cache_dict.get("max_size", 10000)
+__negative_ttl_s__: float = cache_dict.get("negative_ttl_s", 60)
+__leeway_s__: int = section("jwt")["leeway_s"] ## Claims are valid up to the leeway past exp
+
+class ClaimsCache:
+    '''
+    Bounded LRU cache of decoded token claims, keyed by a digest of the token string so that tokens are not kept in memory.
+    Valid tokens are kept until their `exp` plus leeway, invalid ones (malformed, bad signature, expired) for `negative_ttl_s`.
+    Returned claims are shared between callers and must not be modified.
+    '''
+    def __init__(self, max_size: int = __max_size__, negative_ttl_s: float = __negative_ttl_s__, leeway_s: int = __leeway_s__, enabled: bool = __enabled__):
+        self.max_size = max_size
+        self.negative_ttl_s = negative_ttl_s
+        self.leeway_s = leeway_s
+        self.enabled = enabled
+        self.hits: int = 0
+        self.negative_hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[bytes, tuple[float, dict | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_decode(self, token: str, decode: callable) -> dict | None:
+        '''
+        Return the cached claims of the token, or call `decode(token)` and cache its result. Return None if the token is invalid, i.e. `decode` raised.
+        '''
+        if not self.enabled:
+            return _decode_or_none(token, decode)
+
+        key = hashlib.blake2b(token.encode("utf-8", "surrogatepass"), digest_size = 16).digest()
+        time_now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time_now:
+                self._entries.move_to_end(key)
+                if entry[1] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        ## Decode outside of the lock
+        claims = _decode_or_none(token, decode)
+        if claims is not None and isinstance(claims.get("exp"), (int, float)):
+            expire_at = claims["exp"] + self.leeway_s
+        elif claims is not None:
+            return claims ## Without exp the claims never expire, so they are not cached
+        else:
+            expire_at = time_now + self.negative_ttl_s
+
+        with self._lock:
+            self._entries[key] = (expire_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.negative_hits + self.misses
+        return 0.0 if lookups == 0 else (self.hits + self.negative_hits) / lookups
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio(),
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+def _decode_or_none(token: str, decode: callable) -> dict | None:
+    try:
+        return decode(token)
+    except Exception:
+        return None
+
+claims_cache = ClaimsCache()
@@ -1,26 +1,266 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from util import metrics as MetricsUtil
+from config.settings import section
+import asyncio
+import hashlib
+import base64
 import bcrypt
+import hmac
+import time
+import os
 
+## Hashing pool parameters ##
+hash_dict: dict = section("hash")
+__pool_kind__: str = hash_dict.get("pool", "thread")
+__pool_workers__: int = hash_dict.get("max_workers", 4)
+__pool_queue__: int = hash_dict.get("max_queue", 64)
+
+## Password hashing parameters ##
+__algorithm__: str = hash_dict.get("algorithm", "bcrypt") ## New hashes, and rehash on login of hashes by another algorithm
+__bcrypt_rounds__: int = hash_dict.get("bcrypt_rounds", 12)
+__calibrate__: bool = hash_dict.get("calibrate", False) ## Pick the bcrypt rounds at startup from target_ms instead of bcrypt_rounds
+__target_ms__: float = hash_dict.get("target_ms", 250)
+__scrypt_ln__: int = hash_dict.get("scrypt_ln", 15) ## log2 of the scrypt cost N
+__argon2_time_cost__: int = hash_dict.get("argon2_time_cost", 3)
+__argon2_memory_kib__: int = hash_dict.get("argon2_memory_kib", 65536)
+
+## Exceptions ##
+class HashQueueFull(RuntimeError):
+    "Too many hashing jobs are waiting for the worker pool"
+    def __init__(self, msg="Hashing queue is full"):
+        super().__init__(msg)
+
+## Hashers :: Each one is identified by the prefixes of the hashes it makes ##
+class BcryptHasher:
+    name: str = "bcrypt"
+    prefixes: tuple[str, ...] = ("$2a$", "$2b$", "$2y$")
+
+    def __init__(self, rounds: int):
+        self.rounds = rounds
+
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds = self.rounds)).decode("ascii")
+
+    def verify(self, password: str, stored_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode("ascii"))
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        ## $2b$<rounds>$<salt and hash>. Only weaker hashes, so that nodes calibrated to different rounds do not rehash each other's hashes back and forth
+        try:
+            return int(stored_hash.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
+
+class ScryptHasher:
+    '''
+    scrypt of hashlib, stored as $scrypt$ln=<log2 N>,r=<r>,p=<p>$<salt>$<hash> in base64.
+    '''
+    name: str = "scrypt"
+    prefixes: tuple[str, ...] = ("$scrypt$",)
+
+    def __init__(self, ln: int, r: int = 8, p: int = 1):
+        self.ln = ln
+        self.r = r
+        self.p = p
+
+    @staticmethod
+    def _derive(password: str, salt: bytes, ln: int, r: int, p: int) -> bytes:
+        return hashlib.scrypt(password.encode('utf-8'), salt = salt, n = 2 ** ln, r = r, p = p, maxmem = 2 ** ln * r * 256, dklen = 32)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        derived = self._derive(password, salt, self.ln, self.r, self.p)
+        return f"$scrypt$ln={self.ln},r={self.r},p={self.p}${base64.b64encode(salt).decode('ascii')}${base64.b64encode(derived).decode('ascii')}"
+
+    @staticmethod
+    def _parse(stored_hash: str) -> tuple[dict, bytes, bytes]:
+        _, _, parameter_part, salt_part, hash_part = stored_hash.split("$")
+        parameters = {key: int(value) for key, value in (item.split("=") for item in parameter_part.split(","))}
+        return parameters, base64.b64decode(salt_part), base64.b64decode(hash_part)
+
+    def verify(self, password: str, stored_hash: str) -> bool:
+        parameters, salt, expected = self._parse(stored_hash)
+        return hmac.compare_digest(self._derive(password, salt, parameters["ln"], parameters["r"], parameters["p"]), expected)
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        try:
+            parameters, _, _ = self._parse(stored_hash)
+        except ValueError:
+            return True
+        return (parameters.get("ln"), parameters.get("r"), parameters.get("p")) != (self.ln, self.r, self.p)
+
+class Argon2Hasher:
+    '''
+    Argon2id of the optional `argon2-cffi` package, imported on first use.
+    '''
+    name: str = "argon2"
+    prefixes: tuple[str, ...] = ("$argon2id$", "$argon2i$", "$argon2d$")
+
+    def __init__(self, time_cost: int, memory_kib: int):
+        self.time_cost = time_cost
+        self.memory_kib = memory_kib
+        self._hasher = None
+
+    def _get_hasher(self):
+        if self._hasher is None:
+            from argon2 import PasswordHasher
+            self._hasher = PasswordHasher(time_cost = self.time_cost, memory_cost = self.memory_kib)
+        return self._hasher
+
+    def hash(self, password: str) -> str:
+        return self._get_hasher().hash(password)
+
+    def verify(self, password: str, stored_hash: str) -> bool:
+        from argon2.exceptions import VerificationError, InvalidHashError
+        try:
+            return self._get_hasher().verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        return self._get_hasher().check_needs_rehash(stored_hash)
+
+hashers: dict[str, object] = {}
+
+def register_hasher(hasher):
+    '''
+    Add a hasher, an object with `name`, `prefixes`, `hash`, `verify` and `needs_rehash` as the hashers above.
+    '''
+    hashers[hasher.name] = hasher
+    return hasher
+
+register_hasher(BcryptHasher(rounds = __bcrypt_rounds__))
+register_hasher(ScryptHasher(ln = __scrypt_ln__))
+register_hasher(Argon2Hasher(time_cost = __argon2_time_cost__, memory_kib = __argon2_memory_kib__))
+
+def default_hasher():
+    return hashers[__algorithm__]
+
+def hasher_for(stored_hash: str):
+    '''
+    The hasher which made a stored hash, by prefix. None if no hasher is known for it.
+    '''
+    for hasher in hashers.values():
+        if stored_hash.startswith(hasher.prefixes):
+            return hasher
+    return None
+
+def _as_text(stored_hash: str | bytes) -> str | None:
+    ## Older rows hold bcrypt hashes as bytes
+    if isinstance(stored_hash, bytes):
+        try:
+            return stored_hash.decode("ascii")
+        except UnicodeDecodeError:
+            return None
+    if isinstance(stored_hash, str):
+        return stored_hash
+    return None
+
+def calibrate_bcrypt(target_ms: float = __target_ms__, min_rounds: int = 10, max_rounds: int = 16) -> int:
+    '''
+    Set the bcrypt rounds of new hashes to the highest cost whose hashing takes at most `target_ms` on this machine. Return the rounds chosen.
+    Each extra round doubles the time, so one measurement at `min_rounds` is enough.
+    '''
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds = min_rounds))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    hashers["bcrypt"].rounds = rounds
+    return rounds
+
+## Hashing and verification :: `hashing` and `verify` record their time, `_hash` and `_verify` run on the pool, timed by `_timed` ##
 def hashing(in_str: str) -> str:
-    code = in_str.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(code, salt)
+    hashed, elapsed = _timed(_hash, in_str)
+    MetricsUtil.record_bcrypt("hash", elapsed)
     return hashed
 
-def verify(test_str: str, target_hash: str) -> bool:
-    ## Encoding source
-    try:
-        in_code = test_str.encode('utf-8')
-    except AttributeError:
-        ## Bad input data type
+def verify(test_str: str, target_hash: str | bytes) -> bool:
+    result, elapsed = _timed(_verify, test_str, target_hash)
+    MetricsUtil.record_bcrypt("verify", elapsed)
+    return result
+
+def _timed(func: callable, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def _hash(in_str: str) -> str:
+    in_str.encode('utf-8') ## Raise AttributeError on non-string input, for any hasher
+    return default_hasher().hash(in_str)
+
+def _verify(test_str: str, target_hash: str | bytes) -> bool:
+    ## Bad input data type
+    if not isinstance(test_str, str):
         return False
-    
+    target_hash = _as_text(target_hash)
+    if target_hash is None:
+        return False
+    hasher = hasher_for(target_hash)
+    if hasher is None:
+        return False
+
     ## Checking
     try:
-        result: bool = bcrypt.checkpw(in_code, target_hash)
-        return result
-    except ValueError:
+        return hasher.verify(test_str, target_hash)
+    except (ValueError, TypeError):
         ## Incorrect hash
         return False
-    except TypeError:
-        ## Bad hash data type
-        return False
\ No newline at end of file
+
+def needs_rehash(stored_hash: str | bytes) -> bool:
+    '''
+    True if a stored hash is not by the current algorithm and cost, so it should be replaced on the next successful login.
+    '''
+    stored_hash = _as_text(stored_hash)
+    if stored_hash is None:
+        return True
+    hasher = hasher_for(stored_hash)
+    return hasher is not default_hasher() or hasher.needs_rehash(stored_hash)
+
+## Worker pool :: Keep bcrypt off the event loop ##
+_executor: Executor = None
+_pending_jobs: int = 0
+
+def get_executor() -> Executor:
+    '''
+    Create the hashing pool on first use. "pool" in the hash settings selects "thread" (default, bcrypt releases the GIL) or "process".
+    '''
+    global _executor
+    if _executor is None:
+        if __pool_kind__ == "process":
+            _executor = ProcessPoolExecutor(max_workers = __pool_workers__)
+        else:
+            _executor = ThreadPoolExecutor(max_workers = __pool_workers__, thread_name_prefix = "hash")
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait = True)
+        _executor = None
+
+async def _run_in_pool(operation: str, func: callable, *args):
+    '''
+    Run a hashing function on the pool. Raise HashQueueFull if all workers are busy and `max_queue` jobs are already waiting.
+    The time is measured on the worker and recorded here, so that it shows on metrics with a process pool as well.
+    '''
+    global _pending_jobs
+    if _pending_jobs >= __pool_workers__ + __pool_queue__:
+        raise HashQueueFull()
+
+    _pending_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result, elapsed = await loop.run_in_executor(get_executor(), _timed, func, *args)
+        MetricsUtil.record_bcrypt(operation, elapsed)
+        return result
+    finally:
+        _pending_jobs -= 1
+
+async def hashing_async(in_str: str) -> str:
+    return await _run_in_pool("hash", _hash, in_str)
+
+async def verify_async(test_str: str, target_hash: str) -> bool:
+    return await _run_in_pool("verify", _verify, test_str, target_hash)
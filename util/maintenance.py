@@ -0,0 +1,118 @@
+from models.tokens import RefreshTokenRegister
+from dependencies.dbsession import SessionDep
+from util.blacklist import blacklist_index
+from util import user as UserUtil
+from sqlalchemy import delete as sa_delete
+from sqlmodel import Session, select
+from config.settings import section
+import threading
+import asyncio
+import time
+import db
+
+## Maintenance parameters ##
+maintenance_dict: dict = section("maintenance")
+__enabled__: bool = maintenance_dict.get("enabled", True)
+__interval_s__: float = maintenance_dict.get("interval_s", 300)
+__batch_size__: int = maintenance_dict.get("batch_size", 500)
+__batch_pause_s__: float = maintenance_dict.get("batch_pause_s", 0.05)
+__leeway_s__: int = section("jwt")["leeway_s"] ## Rows are kept until the token leeway has passed as well
+
+class MaintenanceStats:
+    '''
+    Counters of the token table purging, for monitoring.
+    '''
+    def __init__(self):
+        self.runs: int = 0
+        self.register_removed: int = 0
+        self.last_duration_s: float = 0.0
+        self.total_duration_s: float = 0.0
+        self.last_run_at: float = None
+        self.last_error: str = None
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+maintenance_stats = MaintenanceStats()
+_stop_requested = threading.Event()
+
+def purge_expired_batch(model, session: SessionDep, batch_size: int, time_now: int) -> int:
+    '''
+    Delete up to `batch_size` rows of a token table whose exp has passed, in its own short transaction. Return the number of rows deleted.
+    '''
+    expired_ids = select(model.token_id).where(model.exp < time_now).limit(batch_size)
+    result = session.exec(sa_delete(model).where(model.token_id.in_(expired_ids)))
+    session.commit()
+    return result.rowcount
+
+def purge_expired_tokens(session: SessionDep, batch_size: int = __batch_size__, batch_pause_s: float = __batch_pause_s__) -> int:
+    '''
+    Purge expired rows of the refresh token registry, consumed or not, in batches, pausing between batches to let other writers take the SQLite lock.
+    Return the number of rows removed.
+    '''
+    time_now = int(time.time()) - __leeway_s__
+    removed: int = 0
+    while True:
+        deleted = purge_expired_batch(RefreshTokenRegister, session, batch_size = batch_size, time_now = time_now)
+        removed += deleted
+        if deleted < batch_size or _stop_requested.is_set():
+            break
+        time.sleep(batch_pause_s)
+    return removed
+
+def run_maintenance() -> MaintenanceStats:
+    '''
+    Run one round of maintenance and record it on `maintenance_stats`.
+    '''
+    start = time.perf_counter()
+    try:
+        with Session(db.engine) as session:
+            register_removed = purge_expired_tokens(session)
+            if blacklist_index.needs_reload():
+                ## Rebuild an overflowed index from the rows left after purging
+                blacklist_index.load(session)
+            if UserUtil.token_epochs.loaded:
+                ## Pick up user changes made by other processes
+                UserUtil.token_epochs.load(session)
+        blacklist_index.evict_expired()
+        maintenance_stats.register_removed += register_removed
+        maintenance_stats.last_error = None
+    except Exception as e:
+        maintenance_stats.last_error = repr(e)
+    finally:
+        duration = time.perf_counter() - start
+        maintenance_stats.runs += 1
+        maintenance_stats.last_duration_s = duration
+        maintenance_stats.total_duration_s += duration
+        maintenance_stats.last_run_at = time.time()
+    return maintenance_stats
+
+async def maintenance_loop(interval_s: float = __interval_s__):
+    while True:
+        await asyncio.sleep(interval_s)
+        round_task = asyncio.ensure_future(asyncio.to_thread(run_maintenance)) ## Sync DB work off the event loop
+        try:
+            await asyncio.shield(round_task)
+        except asyncio.CancelledError:
+            ## Shutting down: let the running round stop after its current batch
+            await round_task
+            raise
+
+def start_scheduler() -> asyncio.Task | None:
+    if not __enabled__:
+        return None
+    _stop_requested.clear()
+    return asyncio.create_task(maintenance_loop(), name = "maintenance")
+
+async def stop_scheduler(task: asyncio.Task | None):
+    '''
+    Stop the scheduler and wait for it. A round already running finishes its current batch first.
+    '''
+    if task is None:
+        return
+    _stop_requested.set()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,174 @@
+'''
+In-process metrics in Prometheus text format, without any client library or external service.
+'''
+from contextvars import ContextVar
+from sqlalchemy import event
+import threading
+import bisect
+import time
+
+_default_buckets: tuple = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: dict = None) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Counter:
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = _default_buckets):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {} ## labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = ()):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._series[labels] = series
+            bucket_index = bisect.bisect_left(self.buckets, value)
+            if bucket_index < len(self.buckets): ## Above the last bucket only counts towards +Inf
+                series[bucket_index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, labels: tuple = ()) -> int:
+        series = self._series.get(labels)
+        return 0 if series is None else series[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            all_series = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in all_series:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, {'le': bucket})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, {'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+class Gauge:
+    '''
+    Gauge read at scrape time from `callback`, which returns a number.
+    '''
+    def __init__(self, name: str, description: str, callback: callable):
+        self.name = name
+        self.description = description
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        try:
+            lines.append(f"{self.name} {self.callback()}")
+        except Exception:
+            pass ## Leave the sample out rather than failing the scrape
+        return lines
+
+class CallbackCounter:
+    '''
+    Counter read at scrape time from `callback`, for totals kept by another module. The name should end with _total.
+    '''
+    def __init__(self, name: str, description: str, callback: callable):
+        self.name = name
+        self.description = description
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        try:
+            lines.append(f"{self.name} {self.callback()}")
+        except Exception:
+            pass
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+## HTTP ##
+http_requests_total = registry.register(Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+http_request_duration_seconds = registry.register(Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+
+## SQL ##
+sql_queries_total = registry.register(Counter("sql_queries_total", "SQL statements executed"))
+sql_duration_seconds_total = registry.register(Counter("sql_duration_seconds_total", "Time spent executing SQL statements"))
+sql_queries_per_request = registry.register(Histogram("sql_queries_per_request", "SQL statements per HTTP request by route", ("route",), buckets = (0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 50)))
+sql_seconds_per_request = registry.register(Histogram("sql_seconds_per_request", "SQL time per HTTP request by route", ("route",)))
+
+## Hashing ##
+bcrypt_calls_total = registry.register(Counter("bcrypt_calls_total", "bcrypt hash and verify calls", ("operation",)))
+bcrypt_duration_seconds_total = registry.register(Counter("bcrypt_duration_seconds_total", "Time spent in bcrypt", ("operation",)))
+
+## Per request SQL accounting :: [query count, seconds], None outside of a request
+request_sql: ContextVar[list | None] = ContextVar("request_sql", default = None)
+
+def instrument_engine(target_engine):
+    '''
+    Count SQL statements and their time on a sync engine (pass `engine.sync_engine` for an async one), globally and for the current request.
+    '''
+    @event.listens_for(target_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(target_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        sql_queries_total.inc()
+        sql_duration_seconds_total.inc(elapsed)
+        current = request_sql.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+def record_bcrypt(operation: str, elapsed: float):
+    bcrypt_calls_total.inc(labels = (operation,))
+    bcrypt_duration_seconds_total.inc(elapsed, labels = (operation,))
+
+def record_request(method: str, route: str, status: int, elapsed: float, sql_stats: list):
+    http_requests_total.inc(labels = (method, route, str(status)))
+    http_request_duration_seconds.observe(elapsed, labels = (method, route))
+    sql_queries_per_request.observe(sql_stats[0], labels = (route,))
+    sql_seconds_per_request.observe(sql_stats[1], labels = (route,))
@@ -0,0 +1,98 @@
+'''
+Opt-in sampling profiler for live requests: 1 in N requests (or those carrying the profile header with the configured secret) run under cProfile, and their profiles are written to a rotating directory.
+'''
+from collections import deque
+from dataclasses import dataclass, asdict
+from config.settings import section, resolve_path
+import cProfile
+import asyncio
+import hmac
+import re
+import os
+
+## Profiler parameters ##
+profiler_dict: dict = section("profiler")
+__enabled__: bool = profiler_dict.get("enabled", False)
+__sample_every__: int = profiler_dict.get("sample_every", 100)
+__header__: str = profiler_dict.get("header", "X-Profile")
+__header_secret__: str = profiler_dict.get("header_secret", None) ## Value of the header which profiles a request. None: the header is ignored, only sampling applies
+__directory__: str = resolve_path(profiler_dict.get("directory", "profiles"))
+__max_files__: int = profiler_dict.get("max_files", 200)
+
+@dataclass
+class ProfiledRequest:
+    method: str
+    route: str
+    status: int
+    duration_ms: float
+    started_at: float
+    file_name: str
+
+class RequestProfiler:
+    '''
+    Decide which requests to profile and keep the record of recent profiles.
+    cProfile sees the whole event loop thread, so a profile includes other requests served meanwhile. Only one request is profiled at a time.
+    '''
+    def __init__(self, enabled: bool = __enabled__, sample_every: int = __sample_every__, header: str = __header__, directory: str = __directory__, max_files: int = __max_files__, header_secret: str = __header_secret__):
+        self.enabled = enabled
+        self.sample_every = max(1, sample_every)
+        self.header = header
+        self.header_secret = header_secret
+        self.directory = directory
+        self.max_files = max_files
+        self.recent: deque[ProfiledRequest] = deque(maxlen = max_files)
+        self._request_count: int = 0
+        self._active: bool = False
+
+    def start(self, headers) -> cProfile.Profile | None:
+        '''
+        Return a running profiler if this request is sampled, otherwise None.
+        '''
+        if not self.enabled or self._active:
+            return None
+        self._request_count += 1
+        if self._request_count % self.sample_every != 0 and not self._header_requested(headers):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None ## Another profiling tool is active on this thread
+        self._active = True
+        return profile
+
+    def _header_requested(self, headers) -> bool:
+        ## Only with a configured secret, so that clients cannot run the profiler at will
+        value = headers.get(self.header)
+        if self.header_secret is None or value is None:
+            return False
+        return hmac.compare_digest(value.encode("utf-8"), str(self.header_secret).encode("utf-8"))
+
+    async def finish(self, profile: cProfile.Profile, method: str, route: str, status: int, started_at: float, duration_s: float):
+        profile.disable()
+        self._active = False
+
+        duration_ms = duration_s * 1000
+        route_slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        file_name = f"{int(started_at * 1000)}_{method}_{route_slug}_{int(duration_ms)}ms.prof"
+        await asyncio.to_thread(self._write, profile, file_name)
+        self.recent.append(ProfiledRequest(method = method, route = route, status = status, duration_ms = duration_ms, started_at = started_at, file_name = file_name))
+
+    def slowest(self, limit: int = 20) -> list[dict]:
+        existing = [record for record in self.recent if os.path.isfile(os.path.join(self.directory, record.file_name))]
+        return [asdict(record) for record in sorted(existing, key = lambda record: record.duration_ms, reverse = True)[:limit]]
+
+    def _write(self, profile: cProfile.Profile, file_name: str):
+        os.makedirs(self.directory, exist_ok = True)
+        profile.dump_stats(os.path.join(self.directory, file_name))
+
+        ## Rotate: keep the newest `max_files` profiles
+        profile_files = sorted(name for name in os.listdir(self.directory) if name.endswith(".prof"))
+        for old_file in profile_files[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, old_file))
+            except FileNotFoundError:
+                pass
+
+request_profiler = RequestProfiler()
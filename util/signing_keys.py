@@ -0,0 +1,92 @@
+'''
+Asymmetric JWT signing keys (RS256 / EdDSA) with `kid` tagged rotation, and their public JWK set for verification by other services.
+
+Keys are PEM files listed on settings "jwt" -> "keys" as {"kid", "private_key_file", "public_key_file"}. The key of "active_kid" signs new tokens,
+it must have a private key. Retired keys only need their public key, and are kept on the list until the tokens they signed have expired.
+`cryptography` is imported on first use, so HS256 deployments do not load it.
+'''
+from config.settings import section, resolve_path
+from dataclasses import dataclass
+import threading
+
+## Signing key parameters ##
+jwt_dict: dict = section("jwt")
+__algorithm__: str = jwt_dict.get("algorithm", "HS256")
+__active_kid__: str = jwt_dict.get("active_kid")
+__key_entries__: list[dict] = jwt_dict.get("keys", [])
+__jwks_max_age_s__: int = jwt_dict.get("jwks_max_age_s", 3600) ## Cache lifetime of the JWKS for other services, shorter than the overlap of two keys
+asymmetric_algorithms: tuple[str, ...] = ("RS256", "EdDSA")
+
+## Exceptions ##
+class SigningKeyError(ValueError):
+    "Signing keys missing or not matching the algorithm"
+    def __init__(self, msg="Bad signing key setting"):
+        super().__init__(msg)
+
+@dataclass(frozen = True)
+class SigningKey:
+    kid: str
+    public_key: object
+    private_key: object = None
+
+class KeyRing:
+    '''
+    The signing keys by kid, with the active one used for signing.
+    '''
+    def __init__(self, algorithm: str, keys: list[SigningKey], active_kid: str):
+        if algorithm not in asymmetric_algorithms:
+            raise SigningKeyError(f"Algorithm {algorithm} is not asymmetric, expecting one of {', '.join(asymmetric_algorithms)}")
+        self.algorithm = algorithm
+        self.keys: dict[str, SigningKey] = {key.kid: key for key in keys}
+        active = self.keys.get(active_kid)
+        if active is None or active.private_key is None:
+            raise SigningKeyError(f"Active key {active_kid} not found, or without private key")
+        self.active: SigningKey = active
+        self._jwks: dict = None
+
+    def public_key(self, kid: str | None):
+        key = self.keys.get(kid)
+        return None if key is None else key.public_key
+
+    def jwks(self) -> dict:
+        '''
+        JSON Web Key Set of every public key on the ring, built once.
+        '''
+        if self._jwks is None:
+            from jwt.algorithms import RSAAlgorithm, OKPAlgorithm
+            to_jwk = RSAAlgorithm.to_jwk if self.algorithm == "RS256" else OKPAlgorithm.to_jwk
+            self._jwks = {"keys": [
+                to_jwk(key.public_key, as_dict = True) | {"kid": key.kid, "alg": self.algorithm, "use": "sig"}
+                for key in self.keys.values()
+            ]}
+        return self._jwks
+
+def load_signing_key(entry: dict) -> SigningKey:
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = None
+    public_key = None
+    if entry.get("private_key_file"):
+        with open(resolve_path(entry["private_key_file"]), "rb") as key_file:
+            private_key = serialization.load_pem_private_key(key_file.read(), password = None)
+        public_key = private_key.public_key()
+    elif entry.get("public_key_file"):
+        with open(resolve_path(entry["public_key_file"]), "rb") as key_file:
+            public_key = serialization.load_pem_public_key(key_file.read())
+    else:
+        raise SigningKeyError(f"Key {entry.get('kid')} has neither private_key_file nor public_key_file")
+    return SigningKey(kid = entry["kid"], public_key = public_key, private_key = private_key)
+
+_key_ring: KeyRing = None
+_key_ring_lock = threading.Lock()
+
+def get_key_ring() -> KeyRing:
+    '''
+    The key ring of the settings, loaded on first use.
+    '''
+    global _key_ring
+    if _key_ring is None:
+        with _key_ring_lock:
+            if _key_ring is None:
+                _key_ring = KeyRing(__algorithm__, [load_signing_key(entry) for entry in __key_entries__], __active_kid__)
+    return _key_ring
@@ -1,24 +1,32 @@
-from jwt.exceptions import InvalidTokenError, InvalidSignatureError, ExpiredSignatureError
-from sqlalchemy.exc import MultipleResultsFound, NoResultFound
-from sqlalchemy import delete as sa_delete
+from jwt.exceptions import InvalidTokenError, InvalidSignatureError, ExpiredSignatureError, DecodeError, ImmatureSignatureError, InvalidAlgorithmError, InvalidAudienceError, InvalidIssuedAtError
+from sqlalchemy import delete as sa_delete, update as sa_update
 from models.users import User as UserModel
-from models.tokens import RefreshTokenRegister, RefreshTokenBlackList
-from dependencies.dbsession import SessionDep
+from models.tokens import RefreshTokenRegister
+from dependencies.dbsession import SessionDep, ApiSessionDep
 from sqlmodel import select
 from util import user as UserUtil
-import os
+from util.blacklist import blacklist_index
+from util.claims_cache import claims_cache
+from util import signing_keys as SigningKeys
+from config.settings import section
+import db
+import binascii
+import hashlib
+import base64
+import hmac
 import json
 import time
 import jwt
 
 ## JWT released parameters ##
-with open(os.path.join("config", "settings.json"), "r") as setting_file:
-    setting_dict = json.load(setting_file)
-    jwt_dict = setting_dict["jwt"]
+jwt_dict: dict = section("jwt")
 __secret__: str = jwt_dict["sign_key"]
+__algorithm__: str = SigningKeys.__algorithm__
 __access_lifetime_s__ = jwt_dict["access_lifetime_s"]
 __refresh_lifetime_s__ = jwt_dict["refresh_lifetime_s"]
 __leeway_s__ = jwt_dict["leeway_s"]
+__stateless_access__: bool = jwt_dict.get("stateless_access", False)
+__check_batch_max__: int = jwt_dict.get("check_batch_max", 500) ## Tokens per batch check request
 
 ## Exceptions ##
 class TokenInvalid(ValueError):
@@ -26,22 +34,162 @@ class TokenInvalid(ValueError):
     def __init__(self, msg="Bad refresh token"):
         super().__init__(msg)
 
-## Simple JWT option ##
+## HS256 fast path ##
+def _b64url_encode(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+def _b64url_decode(segment: bytes) -> bytes:
+    return base64.urlsafe_b64decode(segment + b"=" * (-len(segment) % 4))
+
+class HS256Codec:
+    '''
+    HS256 JWT signing and verification without the generic PyJWT machinery: the header segment is precomputed, and the HMAC key object is
+    built once and copied per token. Tokens are byte for byte those of `jwt.encode(payload, secret, algorithm="HS256")`, and `decode` accepts
+    what `jwt.decode(..., algorithms=["HS256"])` accepts, raising the same PyJWT exceptions (exp, nbf, iat checked with leeway, aud rejected).
+    '''
+    header_segment: bytes = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}, separators = (",", ":")).encode("utf-8"))
+
+    def __init__(self, secret: str | bytes):
+        self._hmac = hmac.new(secret.encode("utf-8") if isinstance(secret, str) else secret, digestmod = hashlib.sha256)
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload: dict) -> str:
+        if not isinstance(payload, dict):
+            raise TypeError("Expecting a dict object, as JWT only supports JSON objects as payloads.")
+        signing_input = self.header_segment + b"." + _b64url_encode(json.dumps(payload, separators = (",", ":")).encode("utf-8"))
+        return (signing_input + b"." + _b64url_encode(self._sign(signing_input))).decode("ascii")
+
+    def decode(self, token: str | bytes, leeway: float = 0) -> dict:
+        token_bytes = token.encode("utf-8") if isinstance(token, str) else token
+        if not isinstance(token_bytes, bytes):
+            raise DecodeError(f"Invalid token type. Token must be a {bytes}")
+        try:
+            signing_input, signature_segment = token_bytes.rsplit(b".", 1)
+            header_segment, payload_segment = signing_input.split(b".", 1)
+        except ValueError:
+            raise DecodeError("Not enough segments")
+
+        ## Our own header is known good, any other must still name HS256
+        if header_segment != self.header_segment:
+            header = _load_segment(header_segment, "header")
+            if not isinstance(header, dict):
+                raise DecodeError("Invalid header string: must be a json object")
+            if header.get("alg") != "HS256":
+                raise InvalidAlgorithmError("The specified alg value is not allowed")
+
+        try:
+            signature = _b64url_decode(signature_segment)
+        except (TypeError, binascii.Error):
+            raise DecodeError("Invalid crypto padding")
+        if not hmac.compare_digest(signature, self._sign(signing_input)):
+            raise InvalidSignatureError("Signature verification failed")
+
+        payload = _load_segment(payload_segment, "payload")
+        if not isinstance(payload, dict):
+            raise DecodeError("Invalid payload string: must be a json object")
+        _validate_claims(payload, leeway)
+        return payload
+
+def _load_segment(segment: bytes, name: str):
+    try:
+        return json.loads(_b64url_decode(segment))
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise DecodeError(f"Invalid {name} string: {e}")
+
+def _validate_claims(payload: dict, leeway: float):
+    time_now = time.time()
+    if "iat" in payload:
+        try:
+            iat = int(payload["iat"])
+        except (TypeError, ValueError):
+            raise InvalidIssuedAtError("Issued At claim (iat) must be an integer.")
+        if iat > time_now + leeway:
+            raise ImmatureSignatureError("The token is not yet valid (iat)")
+    if "nbf" in payload:
+        try:
+            nbf = int(payload["nbf"])
+        except (TypeError, ValueError):
+            raise DecodeError("Not Before claim (nbf) must be an integer.")
+        if nbf > time_now + leeway:
+            raise ImmatureSignatureError("The token is not yet valid (nbf)")
+    if "exp" in payload:
+        try:
+            exp = int(payload["exp"])
+        except (TypeError, ValueError):
+            raise DecodeError("Expiration Time claim (exp) must be an integer.")
+        if exp <= time_now - leeway:
+            raise ExpiredSignatureError("Signature has expired")
+    if payload.get("aud"):
+        raise InvalidAudienceError("Invalid audience") ## No audience is expected on our tokens
+
+_hs256_codec = HS256Codec(__secret__)
+
+## Simple JWT option :: HS256 with the shared sign key, or RS256 / EdDSA with the key ring of util.signing_keys ##
 def sign_jwt(payload: dict) -> str:
-    return jwt.encode(payload, __secret__, algorithm="HS256")
+    if __algorithm__ == "HS256":
+        return _hs256_codec.encode(payload)
+    key_ring = SigningKeys.get_key_ring()
+    return jwt.encode(payload, key_ring.active.private_key, algorithm=__algorithm__, headers={"kid": key_ring.active.kid})
 
 def decode_jwt_no_verification(jwt_str: str) -> dict:
     return jwt.decode(jwt_str, options={"verify_signature": False})
 
 def decode_jwt(jwt_str: str, with_leeway: bool = True, overide_leeway: int = None) -> dict:
+    leeway = 0
     if with_leeway:
         leeway = __leeway_s__ if overide_leeway is None else overide_leeway
-        return jwt.decode(jwt_str, __secret__, algorithms=["HS256"], leeway = leeway)
-    else:
-        return jwt.decode(jwt_str, __secret__, algorithms=["HS256"])
-        
+    if __algorithm__ == "HS256":
+        return _hs256_codec.decode(jwt_str, leeway = leeway)
+    return jwt.decode(jwt_str, _verification_key(jwt_str), algorithms=[__algorithm__], leeway = leeway)
+
+def _verification_key(jwt_str: str):
+    ## Public key of the kid on the header, unknown kids are rejected
+    public_key = SigningKeys.get_key_ring().public_key(jwt.get_unverified_header(jwt_str).get("kid"))
+    if public_key is None:
+        raise InvalidTokenError("Unknown signing key")
+    return public_key
+
 def create_token(user: UserModel, session: SessionDep, is_access: bool = True, lifetime_s : int = None):
-    ## Basic token creation
+    if is_access:
+        ## Basic token creation
+        payload = _build_payload(user, is_access = True, lifetime_s = lifetime_s)
+    else:
+        ## Refresh token registration
+        new_token_registry, payload = _new_registry_row(user, lifetime_s = lifetime_s)
+
+        ## Add to DB and get an ID
+        session.add(new_token_registry)
+        session.commit()
+        session.refresh(new_token_registry)
+
+        ## token ID
+        token_id = new_token_registry.token_id
+        payload = payload | {"token_id": token_id}
+
+    ## Token signing
+    jwt_token = sign_jwt(payload)
+    return jwt_token
+
+async def create_token_async(user: UserModel, session: ApiSessionDep, is_access: bool = True, lifetime_s : int = None):
+    '''
+    Async version of `create_token`.
+    '''
+    if is_access:
+        payload = _build_payload(user, is_access = True, lifetime_s = lifetime_s)
+    else:
+        new_token_registry, payload = _new_registry_row(user, lifetime_s = lifetime_s)
+        session.add(new_token_registry)
+        await db.session_commit(session)
+        await db.session_refresh(session, new_token_registry)
+        payload = payload | {"token_id": new_token_registry.token_id}
+
+    return sign_jwt(payload)
+
+def _build_payload(user: UserModel, is_access: bool, lifetime_s: int = None) -> dict:
     token_version = user.min_token_verison
     uid = user.id
     iat = int(time.time())
@@ -58,42 +206,198 @@ def create_token(user: UserModel, session: SessionDep, is_access: bool = True, l
         "scope": scope
     }
 
-    ## Refresh token registration
-    if is_access == False:
-        new_token_registry: RefreshTokenRegister = RefreshTokenRegister(
-            uid = uid,
-            iat = iat,
-            exp = exp,
-        )
+    ## Stateless access tokens carry the user state needed for checking
+    if is_access and __stateless_access__:
+        payload = payload | {"active": user.is_active, "admin": user.is_admin}
+    return payload
 
-        ## Add to DB and get an ID
-        session.add(new_token_registry)
-        session.commit()
-        session.refresh(new_token_registry)
+def check_token(token: str, session: SessionDep, auto_scope: bool = True, check_access: bool = False, check_refresh: bool = False, test_exp: bool = True, check_active: bool = True, check_admin: bool = False, with_leeway: bool = True, overide_leeway: int = None) -> bool:
+    ## Check token validity and expiration
+    token_payload = _decode_for_check(token)
+    if token_payload is None:
+        return False
 
-        ## token ID
-        token_id = new_token_registry.token_id
-        payload = payload | {"token_id": token_id}
+    ## Claims and user state checks
+    user_state: UserUtil.UserState = _stateless_user_state(token_payload)
+    if user_state is None:
+        user_state = UserUtil.get_user_state(token_payload["uid"], session = session)
+    result = _check_payload(token_payload, user_state, auto_scope = auto_scope, check_access = check_access, check_refresh = check_refresh, test_exp = test_exp, check_active = check_active, check_admin = check_admin, with_leeway = with_leeway, overide_leeway = overide_leeway)
+    if result is not _NEEDS_BLACKLIST_LOOKUP:
+        return result
 
-    ## Token signing
-    jwt_token = sign_jwt(payload)
-    return jwt_token
+    ## Refresh token blacklist lookup
+    return not blacklisted_token_lookup(token_payload["token_id"], session)
 
-def check_token(token: str, session: SessionDep, auto_scope: bool = True, check_access: bool = False, check_refresh: bool = False, test_exp: bool = True, check_active: bool = True, check_admin: bool = False, with_leeway: bool = True, overide_leeway: int = None) -> bool:
-    ## Check token validity and expiration
-    try:
-        token_payload = decode_jwt(token)
-    except Exception:
+async def check_token_async(token: str, session: ApiSessionDep, auto_scope: bool = True, check_access: bool = False, check_refresh: bool = False, test_exp: bool = True, check_active: bool = True, check_admin: bool = False, with_leeway: bool = True, overide_leeway: int = None) -> bool:
+    '''
+    Async version of `check_token`.
+    '''
+    token_payload = _decode_for_check(token)
+    if token_payload is None:
         return False
-    
+
+    user_state: UserUtil.UserState = _stateless_user_state(token_payload)
+    if user_state is None:
+        user_state = await UserUtil.get_user_state_async(token_payload["uid"], session = session)
+    result = _check_payload(token_payload, user_state, auto_scope = auto_scope, check_access = check_access, check_refresh = check_refresh, test_exp = test_exp, check_active = check_active, check_admin = check_admin, with_leeway = with_leeway, overide_leeway = overide_leeway)
+    if result is not _NEEDS_BLACKLIST_LOOKUP:
+        return result
+
+    return not await blacklisted_token_lookup_async(token_payload["token_id"], session)
+
+async def verify_access_token_async(token: str, session: ApiSessionDep, with_leeway: bool = True) -> tuple[dict, UserUtil.UserState] | None:
+    '''
+    Verify an access token with a single decode and a single user state lookup.
+    Return the decoded payload and the user state if the token is a valid access token of an active user, otherwise None.
+    '''
+    token_payload = _decode_for_check(token)
+    if token_payload is None:
+        return None
+
+    user_state: UserUtil.UserState = _stateless_user_state(token_payload)
+    if user_state is None:
+        user_state = await UserUtil.get_user_state_async(token_payload["uid"], session = session)
+    result = _check_payload(token_payload, user_state, auto_scope = False, check_access = True, check_refresh = False, test_exp = True, check_active = True, check_admin = False, with_leeway = with_leeway, overide_leeway = None)
+    if result is not True:
+        return None
+    return token_payload, user_state
+
+def check_tokens_batch(tokens: list[str], session: SessionDep, with_leeway: bool = True) -> list[dict | None]:
+    '''
+    Check several tokens, as `check_token` with auto scope does for each. Return the decoded payload of every valid token and None for the others, in order.
+    The user states missing from cache are selected with one IN query, and the refresh tokens not answered by the blacklist index with one more.
+    '''
+    payloads, user_states = _batch_decode(tokens)
+    uids = _batch_uids_to_select(payloads, user_states)
+    if uids:
+        user_states = _batch_fill_user_states(payloads, user_states, UserUtil.get_user_states(uids, session = session))
+    results, pending = _batch_verdicts(payloads, user_states, with_leeway = with_leeway)
+    if pending:
+        blacklisted, unknown = _batch_blacklist_from_index(pending)
+        if unknown:
+            usable = set(session.exec(_usable_tokens_statement(unknown)).all())
+            blacklisted.update(token_id for token_id in unknown if token_id not in usable)
+        _batch_reject(results, pending, blacklisted)
+    return results
+
+async def check_tokens_batch_async(tokens: list[str], session: ApiSessionDep, with_leeway: bool = True) -> list[dict | None]:
+    '''
+    Async version of `check_tokens_batch`.
+    '''
+    payloads, user_states = _batch_decode(tokens)
+    uids = _batch_uids_to_select(payloads, user_states)
+    if uids:
+        user_states = _batch_fill_user_states(payloads, user_states, await UserUtil.get_user_states_async(uids, session = session))
+    results, pending = _batch_verdicts(payloads, user_states, with_leeway = with_leeway)
+    if pending:
+        blacklisted, unknown = _batch_blacklist_from_index(pending)
+        if unknown:
+            usable_results = await db.session_exec(session, _usable_tokens_statement(unknown))
+            usable = set(usable_results.all())
+            blacklisted.update(token_id for token_id in unknown if token_id not in usable)
+        _batch_reject(results, pending, blacklisted)
+    return results
+
+## Batch checking steps shared by the sync and async paths ##
+def _batch_decode(tokens: list[str]) -> tuple[list[dict | None], list[UserUtil.UserState | None]]:
+    payloads = [_decode_for_check(token) for token in tokens]
+    user_states = [None if payload is None else _stateless_user_state(payload) for payload in payloads]
+    return payloads, user_states
+
+def _batch_uids_to_select(payloads: list[dict | None], user_states: list[UserUtil.UserState | None]) -> list[int]:
+    return list({payload["uid"] for payload, user_state in zip(payloads, user_states) if payload is not None and user_state is None})
+
+def _batch_fill_user_states(payloads: list[dict | None], user_states: list[UserUtil.UserState | None], selected: dict[int, UserUtil.UserState]) -> list[UserUtil.UserState | None]:
+    return [
+        user_state if user_state is not None or payload is None else selected.get(payload["uid"])
+        for payload, user_state in zip(payloads, user_states)
+    ]
+
+def _batch_verdicts(payloads: list[dict | None], user_states: list[UserUtil.UserState | None], with_leeway: bool) -> tuple[list[dict | None], dict[int, list[int]]]:
+    '''
+    Check every payload against its user state. Return the results so far, and the refresh tokens still waiting for the blacklist lookup as token ID -> indexes on the results.
+    '''
+    results: list[dict | None] = []
+    pending: dict[int, list[int]] = {}
+    for index, (payload, user_state) in enumerate(zip(payloads, user_states)):
+        verdict = False
+        if payload is not None:
+            verdict = _check_payload(payload, user_state, auto_scope = True, check_access = False, check_refresh = False, test_exp = True, check_active = True, check_admin = False, with_leeway = with_leeway, overide_leeway = None)
+        if verdict is _NEEDS_BLACKLIST_LOOKUP and "token_id" in payload:
+            pending.setdefault(int(payload["token_id"]), []).append(index)
+            results.append(payload) ## Valid unless found on the blacklist
+        else:
+            results.append(payload if verdict is True else None)
+    return results, pending
+
+def _batch_blacklist_from_index(pending: dict[int, list[int]]) -> tuple[set[int], list[int]]:
+    '''
+    Split the pending token IDs into those the blacklist index knows to be blacklisted, and those it cannot tell (to look up on DB).
+    '''
+    if not blacklist_index.loaded:
+        return set(), list(pending)
+    blacklisted: set[int] = set()
+    unknown: list[int] = []
+    for token_id in pending:
+        indexed = blacklist_index.lookup(token_id)
+        if indexed is None:
+            unknown.append(token_id)
+        elif indexed:
+            blacklisted.add(token_id)
+    return blacklisted, unknown
+
+def _batch_reject(results: list[dict | None], pending: dict[int, list[int]], blacklisted: set[int]):
+    for token_id in blacklisted:
+        for index in pending[token_id]:
+            results[index] = None
+
+## Token checking steps shared by the sync and async paths ##
+_NEEDS_BLACKLIST_LOOKUP = object()
+
+def _decode_for_check(token: str) -> dict | None:
+    '''
+    Decode and verify the token, through the verified claims cache. Return None if the token is invalid or carries no uid / version.
+    '''
+    token_payload = claims_cache.get_or_decode(token, decode_jwt)
+    if token_payload is None:
+        return None
+
+    if not (("uid" in token_payload) and ("version" in token_payload)):
+        return None
+    return token_payload
+
+def _stateless_user_state(token_payload: dict) -> UserUtil.UserState | None:
+    '''
+    Build the user state from the claims of a stateless access token, using the token epoch table instead of DB.
+    Return None if the token must be checked against DB: stateless mode off, not a stateless access token, unknown UID, or issued before the last user state change.
+    '''
+    if not __stateless_access__:
+        return None
+    if token_payload.get("scope") != "access" or not ("active" in token_payload and "admin" in token_payload):
+        return None
+
+    epoch = UserUtil.token_epochs.lookup(token_payload["uid"])
+    if epoch is None:
+        return None
+    min_token_verison, not_before = epoch
+    if token_payload.get("iat", 0) <= not_before:
+        return None
+
+    return UserUtil.UserState(
+        id = token_payload["uid"],
+        min_token_verison = min_token_verison,
+        is_active = token_payload["active"],
+        is_admin = token_payload["admin"],
+    )
+
+def _check_payload(token_payload: dict, user_model: UserModel | UserUtil.UserState, auto_scope: bool, check_access: bool, check_refresh: bool, test_exp: bool, check_active: bool, check_admin: bool, with_leeway: bool, overide_leeway: int):
+    '''
+    Check a decoded token against its user. Return a bool verdict, or `_NEEDS_BLACKLIST_LOOKUP` for a refresh token which is otherwise valid.
+    '''
     ## Check for token version -> Reject version nolonger accepted
-    token_keys = list(token_payload.keys())
-    if not (("uid" in token_keys) and ("version" in token_keys)):
+    if user_model is None:
         return False
-    
-    uid = token_payload["uid"]
     token_version = token_payload["version"]
-    user_model: UserModel = UserUtil.select_user_by_id(uid, session = session)
     if user_model.min_token_verison > token_version:
         return False ## Old token
 
@@ -149,18 +453,8 @@ def check_token(token: str, session: SessionDep, auto_scope: bool = True, check_
             return False
     
     ### Only refresh tokens are remaining beyond this line ###
-
-    ## Refresh token blacklist lookup
     if scope == "refresh":
-        token_id = token_payload["token_id"]
-        result = blacklisted_token_lookup(token_id, session)
-
-        if result:
-            ## Refresh token is on blacklist
-            return False
-        else:
-            ## Refresh token not on blacklist
-            return True
+        return _NEEDS_BLACKLIST_LOOKUP
 
     ## Catch all False
     return False
@@ -176,51 +470,145 @@ def issue_access_tokens(user: UserModel, session: SessionDep, lifetime_s: int =
     return access_token
 
 def process_refresh(refresh_token: str, session: SessionDep) -> tuple[str, str]:
+    '''
+    Rotate a refresh token in one transaction: the old token is consumed (consumed_at set on its register row) and the new one registered on a single commit.
+    The token is decoded once and the user state read once (from cache when possible), so a rotation takes two or three SQL statements.
+    '''
     error_invalid_token = TokenInvalid("bad refresh token")
 
-    ## Validate the refresh token
-    validity = check_token(refresh_token, session = session, check_refresh = True) ## Black list lookup included
-    if not validity:
+    ## Validate the refresh token, black list lookup is done by the consume below
+    token_payload = _decode_for_check(refresh_token)
+    if token_payload is None:
         raise error_invalid_token
-    
-    ## Get user from token (to confirm the user is still existing and active)
-    old_token: dict = decode_jwt(refresh_token)
-    uid = int(old_token["uid"])
-    token_id = int(old_token["token_id"])
-    exp = int(old_token["exp"])
-    target_user: UserModel = None
-    try:
-        target_user = session.exec(select(UserModel).where(UserModel.id == uid)).one()
-    except (NoResultFound, MultipleResultsFound):
+    user_state: UserUtil.UserState = UserUtil.get_user_state(int(token_payload["uid"]), session = session)
+    old_token_id, old_exp = _refresh_to_consume(token_payload, user_state)
+
+    ## Consume the old token :: Conditional update, a token already used (or being used concurrently) matches no row
+    consumed = session.exec(_consume_statement(old_token_id, user_state.id))
+    if consumed.rowcount != 1:
+        session.rollback()
         raise error_invalid_token
 
-    ## Add used refresh token to the black list
-    refresh_token_blacklisting(token_id, exp, session)
+    ## Register the new one in the same transaction
+    new_token_registry, refresh_payload = _new_registry_row(user_state)
+    session.add(new_token_registry)
+    session.flush()
+    refresh_payload = refresh_payload | {"token_id": new_token_registry.token_id}
+    session.commit()
+    blacklist_index.add(old_token_id, old_exp)
 
     ## Make the access and refresh tokens
-    return issue_access_refresh_tokens(target_user, session = session)
-
-## Refresh token blacklisting ##
-def refresh_token_blacklisting(token_id: int, exp: int, session: SessionDep):
-    ## Add used refresh token to the black list
-    new_black_listing: RefreshTokenBlackList = RefreshTokenBlackList(
-        token_id = token_id,
-        reg_time = int(time.time()),
-        exp = exp,
+    return sign_jwt(_build_payload(user_state, is_access = True)), sign_jwt(refresh_payload)
+
+async def issue_access_refresh_tokens_async(user: UserModel, session: ApiSessionDep, access_lifetime_s: int = None, refresh_lifetime_s: int = None) -> tuple[str, str]:
+    access_token = await create_token_async(user, session = session, is_access = True, lifetime_s = access_lifetime_s)
+    refresh_token = await create_token_async(user, session = session, is_access = False, lifetime_s = refresh_lifetime_s)
+    return access_token, refresh_token
+
+async def process_refresh_async(refresh_token: str, session: ApiSessionDep) -> tuple[str, str]:
+    '''
+    Async version of `process_refresh`.
+    '''
+    error_invalid_token = TokenInvalid("bad refresh token")
+
+    token_payload = _decode_for_check(refresh_token)
+    if token_payload is None:
+        raise error_invalid_token
+    user_state: UserUtil.UserState = await UserUtil.get_user_state_async(int(token_payload["uid"]), session = session)
+    old_token_id, old_exp = _refresh_to_consume(token_payload, user_state)
+
+    consumed = await db.session_exec(session, _consume_statement(old_token_id, user_state.id))
+    if consumed.rowcount != 1:
+        await db.session_rollback(session)
+        raise error_invalid_token
+
+    new_token_registry, refresh_payload = _new_registry_row(user_state)
+    session.add(new_token_registry)
+    await db.session_flush(session)
+    refresh_payload = refresh_payload | {"token_id": new_token_registry.token_id}
+    await db.session_commit(session)
+    blacklist_index.add(old_token_id, old_exp)
+
+    return sign_jwt(_build_payload(user_state, is_access = True)), sign_jwt(refresh_payload)
+
+## Refresh token rotation steps shared by the sync and async paths ##
+def _refresh_to_consume(token_payload: dict, user_state: UserUtil.UserState) -> tuple[int, int]:
+    '''
+    Check a decoded refresh token against its user state, without the blacklist lookup. Return its token ID and exp, or raise TokenInvalid.
+    A token known to the in-memory blacklist index is rejected here, before any write.
+    '''
+    result = _check_payload(token_payload, user_state, auto_scope = False, check_access = False, check_refresh = True, test_exp = True, check_active = True, check_admin = False, with_leeway = True, overide_leeway = None)
+    if result is not _NEEDS_BLACKLIST_LOOKUP or "token_id" not in token_payload:
+        raise TokenInvalid("bad refresh token")
+
+    token_id = int(token_payload["token_id"])
+    if blacklist_index.loaded and blacklist_index.lookup(token_id) is True:
+        raise TokenInvalid("bad refresh token")
+    return token_id, int(token_payload["exp"])
+
+def _new_registry_row(user: UserModel | UserUtil.UserState, lifetime_s: int = None) -> tuple[RefreshTokenRegister, dict]:
+    '''
+    The registry row of a new refresh token and its payload (without token ID until the row is flushed). Shared by token creation and rotation.
+    '''
+    refresh_payload = _build_payload(user, is_access = False, lifetime_s = lifetime_s)
+    new_token_registry = RefreshTokenRegister(
+        uid = refresh_payload["uid"],
+        iat = refresh_payload["iat"],
+        exp = refresh_payload["exp"],
     )
-    session.add(new_black_listing)
+    return new_token_registry, refresh_payload
+
+def _consume_statement(token_id: int, uid: int = None):
+    '''
+    Mark a registered refresh token as used, only if it is not already. One row is updated when the token is consumed by this statement, none otherwise.
+    '''
+    statement = sa_update(RefreshTokenRegister).where(RefreshTokenRegister.token_id == token_id).where(RefreshTokenRegister.consumed_at == None)
+    if uid is not None:
+        statement = statement.where(RefreshTokenRegister.uid == uid)
+    return statement.values(consumed_at = int(time.time()))
+
+def _usable_token_statement(token_id: int):
+    return select(RefreshTokenRegister.token_id).where(RefreshTokenRegister.token_id == token_id).where(RefreshTokenRegister.consumed_at == None)
+
+def _usable_tokens_statement(token_ids: list[int]):
+    return select(RefreshTokenRegister.token_id).where(RefreshTokenRegister.token_id.in_(token_ids)).where(RefreshTokenRegister.consumed_at == None)
+
+## Refresh token blacklisting :: A refresh token is blacklisted once consumed. On DB lookups, a token not registered (e.g. purged) counts as blacklisted too ##
+def refresh_token_blacklisting(token_id: int, exp: int, session: SessionDep) -> bool:
+    '''
+    Consume a refresh token without issuing a new one. Return False if it was already consumed or is not registered.
+    '''
+    consumed = session.exec(_consume_statement(token_id))
     session.commit()
-    session.refresh(new_black_listing)
+    blacklist_index.add(token_id, exp)
+    return consumed.rowcount == 1
 
 def blacklisted_token_lookup(token_id: int, session: SessionDep) -> bool:
-    result = session.exec(select(RefreshTokenBlackList).where(RefreshTokenBlackList.token_id == token_id)).first()
-    if result:
-        return True
-    else:
-        return False
+    ## In-memory index first, DB only if the index cannot tell
+    if blacklist_index.loaded:
+        indexed = blacklist_index.lookup(token_id)
+        if indexed is not None:
+            return indexed
+
+    return session.exec(_usable_token_statement(token_id)).first() is None
+
+async def refresh_token_blacklisting_async(token_id: int, exp: int, session: ApiSessionDep) -> bool:
+    consumed = await db.session_exec(session, _consume_statement(token_id))
+    await db.session_commit(session)
+    blacklist_index.add(token_id, exp)
+    return consumed.rowcount == 1
+
+async def blacklisted_token_lookup_async(token_id: int, session: ApiSessionDep) -> bool:
+    if blacklist_index.loaded:
+        indexed = blacklist_index.lookup(token_id)
+        if indexed is not None:
+            return indexed
+
+    results = await db.session_exec(session, _usable_token_statement(token_id))
+    return results.first() is None
 
 def removed_expired_blacklist(session: SessionDep):
     time_now = int(time.time())
-    statement = sa_delete(RefreshTokenBlackList).where(RefreshTokenBlackList.exp < time_now)
+    statement = sa_delete(RefreshTokenRegister).where(RefreshTokenRegister.exp < time_now).where(RefreshTokenRegister.consumed_at != None)
     session.exec(statement)
     session.commit()
\ No newline at end of file
@@ -1,7 +1,237 @@
 from models.users import User as UserModel
-from dependencies.dbsession import SessionDep
+from dependencies.dbsession import SessionDep, ApiSessionDep
 from util import hash as HashUtil
 from sqlmodel import select
+from collections import OrderedDict
+from typing import NamedTuple
+from config.settings import section
+import threading
+import time
+import os
+import db
+
+## User state cache parameters ##
+cache_dict: dict = section("user_cache")
+__cache_max_size__: int = cache_dict.get("max_size", 10000)
+__cache_ttl_s__: float = cache_dict.get("ttl_s", 60)
+__listing_cache_entries__: int = cache_dict.get("listing_cache_entries", 64) ## Serialized user listings kept until the next write
+__listing_max_age_s__: float = cache_dict.get("listing_max_age_s", 10) ## ETags and cached listings also expire after this, for writes made elsewhere
+__epoch_max_age_s__: float = section("jwt").get("epoch_max_age_s", 900) ## Token epoch table not reloaded for longer is not trusted
+
+## User state cache ##
+class UserState(NamedTuple):
+    '''
+    The part of a user needed for token checking. Attribute names follow the User model so it can be used in place of one.
+    '''
+    id: int
+    min_token_verison: int
+    is_active: bool
+    is_admin: bool
+
+    @classmethod
+    def from_db_model(cls, user: UserModel):
+        return cls(id = user.id, min_token_verison = user.min_token_verison, is_active = user.is_active, is_admin = user.is_admin)
+
+class UserStateCache:
+    '''
+    Bounded LRU cache of UserState keyed by UID, with a time-to-live on every entry.
+    Entries are dropped by the write functions of this module, so the TTL only bounds staleness from writes made by other processes.
+    '''
+    def __init__(self, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[int, tuple[float, UserState]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: int) -> UserState | None:
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                self.misses += 1
+                return None
+            expire_at, state = entry
+            if expire_at < time.monotonic():
+                del self._entries[uid]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uid)
+            self.hits += 1
+            return state
+
+    def put(self, state: UserState):
+        with self._lock:
+            self._entries[state.id] = (time.monotonic() + self.ttl_s, state)
+            self._entries.move_to_end(state.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def invalidate(self, uid: int):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+user_state_cache = UserStateCache(max_size = __cache_max_size__, ttl_s = __cache_ttl_s__)
+
+## Token version epoch table ##
+class TokenEpochTable:
+    '''
+    In-memory map of UID -> (min_token_verison, not_before), used to check stateless access tokens without SQL.
+    `not_before` is the unix time of the last active / admin change; tokens issued up to that second must be checked against DB.
+    UIDs not on the table are unknown, and their tokens are checked against DB as well.
+
+    The table is per process. Writes through this module in the same process update it at once, other writes (CLI, other workers) are
+    picked up by `load`, which the maintenance scheduler calls on every round: a UID whose active / admin state changed since the previous
+    load gets `not_before` set to the reload time. A table not loaded for `max_age_s` answers nothing, so every token falls back to DB.
+    '''
+    def __init__(self, max_age_s: float = __epoch_max_age_s__):
+        self.max_age_s = max_age_s
+        self.loaded: bool = False
+        self.loaded_at: float = None
+        self._entries: dict[int, tuple[int, int]] = {}
+        self._states: dict[int, tuple[bool, bool]] = {} ## UID -> (is_active, is_admin) as of the last load
+        self._lock = threading.Lock()
+
+    def load(self, session: SessionDep):
+        '''
+        Load, or reload, the table from DB.
+        '''
+        rows = session.exec(select(UserModel.id, UserModel.min_token_verison, UserModel.is_active, UserModel.is_admin)).all()
+        time_now = int(time.time())
+        with self._lock:
+            entries: dict[int, tuple[int, int]] = {}
+            states: dict[int, tuple[bool, bool]] = {}
+            for uid, version, is_active, is_admin in rows:
+                states[uid] = (is_active, is_admin)
+                if not self.loaded:
+                    entries[uid] = (version, 0)
+                    continue
+                ## Reload: distrust tokens issued before a change made elsewhere, and users created elsewhere
+                _, not_before = self._entries.get(uid, (version, time_now))
+                if self._states.get(uid, states[uid]) != states[uid]:
+                    not_before = time_now
+                entries[uid] = (version, not_before)
+            self._entries = entries
+            self._states = states
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def lookup(self, uid: int) -> tuple[int, int] | None:
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at > self.max_age_s:
+            return None
+        return self._entries.get(uid)
+
+    def set_version(self, uid: int, version: int):
+        with self._lock:
+            _, not_before = self._entries.get(uid, (version, 0))
+            self._entries[uid] = (version, not_before)
+
+    def mark_changed(self, uid: int, version: int):
+        with self._lock:
+            self._entries[uid] = (version, int(time.time()))
+
+    def remove(self, uid: int):
+        with self._lock:
+            self._entries.pop(uid, None)
+            self._states.pop(uid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+token_epochs = TokenEpochTable()
+
+## User table version :: ETags and cached responses of user reads ##
+class UserTableVersion:
+    '''
+    Counter of committed writes to the user table, bumped by the write functions of this module. ETags are built from it, with a random
+    per-process prefix so that a restart never repeats one. Like the caches above, it only sees writes made through this module in the same process,
+    so the version also moves on every `max_age_s`: writes made elsewhere are seen after at most that long.
+    '''
+    def __init__(self, max_age_s: float = __listing_max_age_s__):
+        self.prefix: str = os.urandom(4).hex()
+        self.counter: int = 0
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.counter += 1
+
+    def current(self) -> tuple[int, int]:
+        '''
+        Version as (time period, write counter), both only increasing.
+        '''
+        return int(time.time() // self.max_age_s), self.counter
+
+    def etag(self, version: tuple[int, int], *parts) -> str:
+        return '"' + "-".join([self.prefix, ".".join(str(part) for part in version), *(str(part) for part in parts)]) + '"'
+
+user_table_version = UserTableVersion()
+
+class SerializedResponseCache:
+    '''
+    Serialized response bodies by key, valid for the user table version they were read at. Entries of older versions are never returned,
+    and are all dropped at the first put of a newer version. At most `max_entries` are kept.
+    '''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._version: tuple[int, int] = (-1, -1)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version: tuple[int, int]):
+        with self._lock:
+            if version != self._version or key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, version: tuple[int, int], value):
+        with self._lock:
+            if version < self._version:
+                return ## Read before a write which is already cached over
+            if version > self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+listing_cache = SerializedResponseCache(max_entries = __listing_cache_entries__)
+
+def user_table_changed():
+    '''
+    Record a committed write to the user table. Called by the write functions of this module, and by writers outside of it (e.g. bulk import).
+    '''
+    user_table_version.bump()
+
+def _after_user_write(uid: int, token_version: int, state_changed: bool = False):
+    '''
+    Keep the user state cache, the token epoch table and the user table version in line with a committed write.
+    '''
+    user_table_changed()
+    user_state_cache.invalidate(uid)
+    if state_changed:
+        token_epochs.mark_changed(uid, token_version)
+    else:
+        token_epochs.set_version(uid, token_version)
 
 def select_user_by_id(uid: int, session: SessionDep, require_active: bool = None) -> UserModel:
     '''
@@ -21,6 +251,45 @@ def select_user_by_id(uid: int, session: SessionDep, require_active: bool = None
     
     return results
 
+def get_user_state(uid: int, session: SessionDep) -> UserState | None:
+    '''
+    Return the cached state of a user, selecting the user from DB on cache miss. Return None if no such user.
+    '''
+    state = user_state_cache.get(uid)
+    if state is None:
+        user = select_user_by_id(uid, session = session)
+        if user is None:
+            return None
+        state = UserState.from_db_model(user)
+        user_state_cache.put(state)
+    return state
+
+def get_user_states(uids: list[int], session: SessionDep) -> dict[int, UserState]:
+    '''
+    Cached states of several users, selecting the cache misses from DB with one IN query. UIDs with no such user are left out of the returned dict.
+    '''
+    states, missing = _cached_user_states(uids)
+    if missing:
+        for user in session.exec(select(UserModel).where(UserModel.id.in_(missing))).all():
+            states[user.id] = _cache_user_state(user)
+    return states
+
+def _cached_user_states(uids: list[int]) -> tuple[dict[int, UserState], list[int]]:
+    states: dict[int, UserState] = {}
+    missing: list[int] = []
+    for uid in set(uids):
+        state = user_state_cache.get(uid)
+        if state is None:
+            missing.append(uid)
+        else:
+            states[uid] = state
+    return states, missing
+
+def _cache_user_state(user: UserModel) -> UserState:
+    state = UserState.from_db_model(user)
+    user_state_cache.put(state)
+    return state
+
 def create_new_user(user_name: str, email : str, clear_text_pw: str, session: SessionDep, super_user:bool = False, activiate:bool = True) -> tuple[UserModel, Exception]:
     '''
     Given a user name and clear text password, add the new user onto the database.
@@ -43,6 +312,7 @@ def create_new_user(user_name: str, email : str, clear_text_pw: str, session: Se
         session.add(new_user)
         session.commit()
         session.refresh(new_user)
+        _after_user_write(new_user.id, new_user.min_token_verison)
         return new_user, None
     except Exception as e:
         session.rollback()
@@ -56,6 +326,7 @@ def check_password_correct(user: UserModel, clear_password:str, session: Session
     return HashUtil.verify(clear_password, hashed_password)
 
 def update_user_info(user: UserModel, session: SessionDep, user_name: str = None, email: str = None, is_admin: bool = None, is_active: bool = None) -> tuple[UserModel, Exception]:
+    state_changed: bool = (is_admin is not None and is_admin != user.is_admin) or (is_active is not None and is_active != user.is_active)
     user_name: str = user.user_name if user_name is None else user_name
     email: str = user.email if email is None else email
     is_admin: str = user.is_admin if is_admin is None else is_admin
@@ -69,6 +340,7 @@ def update_user_info(user: UserModel, session: SessionDep, user_name: str = None
         session.add(user)
         session.commit()
         session.refresh(user)
+        _after_user_write(user.id, user.min_token_verison, state_changed = state_changed)
         return user, None
     except Exception as e:
         session.rollback()
@@ -84,6 +356,23 @@ def change_user_password(uid: int, new_clear_password: str, session: SessionDep,
         if adv_token_version:
             ## Advance the minimum token version to nullifly all issued tokens
             target_user.min_token_verison += 1
+        new_token_version: int = target_user.min_token_verison
+        session.add(target_user)
+        session.commit()
+        _after_user_write(uid, new_token_version)
+        return None
+    except Exception as e:
+        return e
+
+def replace_password_hash(uid: int, new_hash: str, session: SessionDep) -> Exception:
+    '''
+    Store a new hash of the same password (e.g. a rehash at login). Tokens, user state and user listings are unaffected, so no cache is invalidated.
+    '''
+    try:
+        target_user: UserModel = select_user_by_id(uid, session = session)
+        if target_user is None:
+            raise KeyError("The user not found")
+        target_user.password_hash = new_hash
         session.add(target_user)
         session.commit()
         return None
@@ -101,4 +390,164 @@ def delete_user_by_id(uid: int, session: SessionDep) -> int:
     else:
         session.delete(target_user)
         session.commit()
-        return 200
\ No newline at end of file
+        user_table_changed()
+        user_state_cache.invalidate(uid)
+        token_epochs.remove(uid)
+        return 200
+
+## Async variants :: Used by the API routes, accept either an AsyncSession or a Session ##
+async def select_user_by_id_async(uid: int, session: ApiSessionDep, require_active: bool = None) -> UserModel:
+    '''
+    Async version of `select_user_by_id`.
+    '''
+    if isinstance(uid, int) == False:
+        raise TypeError(f"Provided UID must be an integer, but type {type(uid)} is given.")
+
+    statement = select(UserModel).where(UserModel.id == uid)
+    if require_active is not None:
+        statement = statement.where(UserModel.is_active == require_active)
+    results = await db.session_exec(session, statement)
+    return results.first()
+
+async def select_user_by_name_async(user_name: str, session: ApiSessionDep) -> UserModel:
+    '''
+    Select exactly one user by user name. Raise NoResultFound / MultipleResultsFound as `Result.one()` does.
+    '''
+    results = await db.session_exec(session, select(UserModel).where(UserModel.user_name == user_name))
+    return results.one()
+
+async def get_user_state_async(uid: int, session: ApiSessionDep) -> UserState | None:
+    '''
+    Async version of `get_user_state`.
+    '''
+    state = user_state_cache.get(uid)
+    if state is None:
+        user = await select_user_by_id_async(uid, session = session)
+        if user is None:
+            return None
+        state = UserState.from_db_model(user)
+        user_state_cache.put(state)
+    return state
+
+async def get_user_states_async(uids: list[int], session: ApiSessionDep) -> dict[int, UserState]:
+    '''
+    Async version of `get_user_states`.
+    '''
+    states, missing = _cached_user_states(uids)
+    if missing:
+        results = await db.session_exec(session, select(UserModel).where(UserModel.id.in_(missing)))
+        for user in results.all():
+            states[user.id] = _cache_user_state(user)
+    return states
+
+async def select_active_users_page_async(session: ApiSessionDep, after_id: int = 0, limit: int = 100) -> list[UserModel]:
+    '''
+    Keyset pagination of active users: return up to `limit` users with ID greater than `after_id`, ordered by ID.
+    '''
+    statement = select(UserModel).where(UserModel.is_active == True).where(UserModel.id > after_id).order_by(UserModel.id).limit(limit)
+    results = await db.session_exec(session, statement)
+    return list(results.all())
+
+async def iter_active_users_async(after_id: int = 0, batch_size: int = 500):
+    '''
+    Async generator over all active users after `after_id`, read in keyset batches on its own session so that memory stays flat regardless of table size.
+    '''
+    async with db.open_api_session() as session:
+        while True:
+            users = await select_active_users_page_async(session, after_id = after_id, limit = batch_size)
+            for user in users:
+                yield user
+            if len(users) < batch_size:
+                break
+            after_id = users[-1].id
+            session.expunge_all() ## Drop the batch from the identity map
+
+async def create_new_user_async(user_name: str, email : str, clear_text_pw: str, session: ApiSessionDep, super_user:bool = False, activiate:bool = True) -> tuple[UserModel, Exception]:
+    '''
+    Async version of `create_new_user`.
+    '''
+    try:
+        hashed = await HashUtil.hashing_async(clear_text_pw)
+    except HashUtil.HashQueueFull as e:
+        return None, e
+    new_user: UserModel = UserModel(
+        user_name = user_name,
+        email = email,
+        password_hash = hashed,
+        is_admin = super_user,
+        is_active = activiate
+    )
+
+    try:
+        session.add(new_user)
+        await db.session_commit(session)
+        await db.session_refresh(session, new_user)
+        _after_user_write(new_user.id, new_user.min_token_verison)
+        return new_user, None
+    except Exception as e:
+        await db.session_rollback(session)
+        return None, e
+
+async def update_user_info_async(user: UserModel, session: ApiSessionDep, user_name: str = None, email: str = None, is_admin: bool = None, is_active: bool = None) -> tuple[UserModel, Exception]:
+    state_changed: bool = (is_admin is not None and is_admin != user.is_admin) or (is_active is not None and is_active != user.is_active)
+    user.user_name = user.user_name if user_name is None else user_name
+    user.email = user.email if email is None else email
+    user.is_admin = user.is_admin if is_admin is None else is_admin
+    user.is_active = user.is_active if is_active is None else is_active
+
+    try:
+        session.add(user)
+        await db.session_commit(session)
+        await db.session_refresh(session, user)
+        _after_user_write(user.id, user.min_token_verison, state_changed = state_changed)
+        return user, None
+    except Exception as e:
+        await db.session_rollback(session)
+        return None, e
+
+async def change_user_password_async(uid: int, new_clear_password: str, session: ApiSessionDep, adv_token_version: bool = True) -> Exception:
+    try:
+        hashed_pw: str = await HashUtil.hashing_async(new_clear_password)
+        target_user: UserModel = await select_user_by_id_async(uid, session = session)
+        if target_user is None:
+            raise KeyError("The user not found")
+        target_user.password_hash = hashed_pw
+        if adv_token_version:
+            target_user.min_token_verison += 1
+        new_token_version: int = target_user.min_token_verison
+        session.add(target_user)
+        await db.session_commit(session)
+        _after_user_write(uid, new_token_version)
+        return None
+    except Exception as e:
+        return e
+
+async def replace_password_hash_async(uid: int, new_hash: str, session: ApiSessionDep) -> Exception:
+    '''
+    Async version of `replace_password_hash`.
+    '''
+    try:
+        target_user: UserModel = await select_user_by_id_async(uid, session = session)
+        if target_user is None:
+            raise KeyError("The user not found")
+        target_user.password_hash = new_hash
+        session.add(target_user)
+        await db.session_commit(session)
+        return None
+    except Exception as e:
+        return e
+
+async def delete_user_by_id_async(uid: int, session: ApiSessionDep) -> int:
+    '''
+    Async version of `delete_user_by_id`.
+    '''
+    target_user: UserModel = await select_user_by_id_async(uid, session = session)
+    if target_user is None:
+        return 404
+    else:
+        await db.session_delete(session, target_user)
+        await db.session_commit(session)
+        user_table_changed()
+        user_state_cache.invalidate(uid)
+        token_epochs.remove(uid)
+        return 200
@@ -0,0 +1,211 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from models.users import User as UserModel
+from dependencies.dbsession import SessionDep
+from util import hash as HashUtil
+from util import user as UserUtil
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from pydantic import BaseModel, EmailStr, Field, ValidationError, field_validator
+from dataclasses import dataclass, field
+from config.settings import section
+import threading
+import io
+import os
+
+## Import parameters ##
+import_dict: dict = section("user_import")
+__http_max_workers__: int = import_dict.get("http_max_workers", 2) ## Hashing workers of imports through the API, shared by all uploads
+
+## Columns expected on the imported table. Optional columns default as create_new_user does.
+required_columns: list[str] = ["user_name", "email", "password"]
+optional_columns: dict = {"is_admin": False, "is_active": True}
+max_password_bytes: int = 72 ## bcrypt refuses longer passwords
+
+class ImportedUser(BaseModel):
+    '''
+    One row of the imported table, validated with the limits of CreateUserRequest before any hashing.
+    '''
+    user_name: str = Field(min_length = 1, max_length = 50)
+    email: EmailStr = Field(max_length = 100)
+    password: str = Field(min_length = 1, max_length = 50)
+    is_admin: bool = False
+    is_active: bool = True
+
+    @field_validator("password")
+    @classmethod
+    def password_bytes(cls, password: str) -> str:
+        if len(password.encode("utf-8")) > max_password_bytes:
+            raise ValueError(f"password is longer than {max_password_bytes} bytes")
+        return password
+
+@dataclass
+class ImportConflict:
+    row: int ## 0-based row number on the imported table
+    user_name: str | None
+    reason: str
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    conflicts: list[ImportConflict] = field(default_factory = list)
+
+def read_user_table(source: str | bytes, file_format: str = None) -> list[dict]:
+    '''
+    Read users from a CSV or JSON file path, or from the raw bytes of such a file. `file_format` is "csv" or "json", guessed from the path when not given.
+    JSON can be a list of records. Return one dict per row with the required and optional columns only.
+    '''
+    import pandas as pd ## Heavy import, only needed here
+
+    if file_format is None:
+        if isinstance(source, str) and source.lower().endswith(".json"):
+            file_format = "json"
+        else:
+            file_format = "csv"
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    if file_format == "json":
+        table = pd.read_json(source, orient = "records", dtype = False)
+    elif file_format == "csv":
+        table = pd.read_csv(source, dtype = str, keep_default_na = False)
+    else:
+        raise ValueError(f"Unknown file format {file_format}, only csv and json are accepted.")
+
+    missing_columns = [column for column in required_columns if column not in table.columns]
+    if missing_columns:
+        raise KeyError(f"Missing column(s) {', '.join(missing_columns)} on the imported table.")
+
+    rows: list[dict] = []
+    for record in table.to_dict(orient = "records"):
+        row = {column: record[column] for column in required_columns}
+        for column, default in optional_columns.items():
+            value = record.get(column, default)
+            row[column] = _to_bool(value, default)
+        rows.append(row)
+    return rows
+
+def _to_bool(value, default: bool) -> bool:
+    if isinstance(value, str):
+        if value.strip() == "":
+            return default
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    if value is None or value != value: ## None or NaN
+        return default
+    return bool(value)
+
+def hash_passwords(clear_passwords: list[str], executor: Executor, max_workers: int) -> list:
+    '''
+    Hash passwords on a pool of `max_workers` workers. Order is kept.
+    '''
+    chunk_size = max(1, len(clear_passwords) // (max_workers * 4))
+    return list(executor.map(HashUtil.hashing, clear_passwords, chunksize = chunk_size))
+
+_http_executor: Executor = None
+_http_executor_lock = threading.Lock()
+
+def get_http_executor() -> Executor:
+    '''
+    Small hashing pool for imports through the API, so that an upload leaves the other cores to logins. Created on first use.
+    bcrypt releases the GIL, so threads hash in parallel.
+    '''
+    global _http_executor
+    with _http_executor_lock:
+        if _http_executor is None:
+            _http_executor = ThreadPoolExecutor(max_workers = __http_max_workers__, thread_name_prefix = "import-hash")
+    return _http_executor
+
+def shutdown_http_executor():
+    global _http_executor
+    with _http_executor_lock:
+        if _http_executor is not None:
+            _http_executor.shutdown(wait = True)
+            _http_executor = None
+
+def bulk_create_users(rows: list[dict], session: SessionDep, chunk_size: int = 1000, max_workers: int = None, executor: Executor = None) -> ImportReport:
+    '''
+    Create users from rows of `read_user_table`. Rows are validated, hashed in parallel, then inserted one transaction per chunk.
+    A row that cannot be inserted (bad data, user name repeated on the file or taken on DB) is reported on the returned ImportReport instead of aborting the import.
+    Hashing runs on `executor` if given, otherwise on a process pool of `max_workers` processes (all cores by default), as the CLI does.
+    '''
+    report = ImportReport()
+
+    ## Validate rows and drop repeated user names within the file
+    accepted: list[tuple[int, dict]] = []
+    seen_user_names: set[str] = set()
+    for row_number, row in enumerate(rows):
+        user_name = row.get("user_name") if isinstance(row.get("user_name"), str) else None
+        try:
+            imported = ImportedUser.model_validate(row)
+        except ValidationError as e:
+            error = e.errors()[0]
+            field_name = ".".join(str(part) for part in error["loc"]) or "row"
+            report.conflicts.append(ImportConflict(row = row_number, user_name = user_name, reason = f"Invalid {field_name}: {error['msg']}"))
+            continue
+        if imported.user_name in seen_user_names:
+            report.conflicts.append(ImportConflict(row = row_number, user_name = user_name, reason = "User name repeated on the file"))
+        else:
+            seen_user_names.add(imported.user_name)
+            accepted.append((row_number, imported.model_dump()))
+
+    ## Chunked insert
+    if executor is not None:
+        _insert_chunks(accepted, session, executor, max_workers or 1, chunk_size, report)
+    else:
+        max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers = max_workers) as own_executor:
+            _insert_chunks(accepted, session, own_executor, max_workers, chunk_size, report)
+
+    if report.created:
+        UserUtil.user_table_changed()
+    report.conflicts.sort(key = lambda conflict: conflict.row)
+    return report
+
+def _insert_chunks(accepted: list[tuple[int, dict]], session: SessionDep, executor: Executor, max_workers: int, chunk_size: int, report: ImportReport):
+    for start in range(0, len(accepted), chunk_size):
+        _insert_chunk(accepted[start:start + chunk_size], session, executor, max_workers, report)
+
+def _insert_chunk(chunk: list[tuple[int, dict]], session: SessionDep, executor: Executor, max_workers: int, report: ImportReport):
+    ## Skip user names already on DB before spending time on hashing
+    chunk_names = [row["user_name"] for _, row in chunk]
+    existing_names = set(session.exec(select(UserModel.user_name).where(UserModel.user_name.in_(chunk_names))).all())
+    new_rows: list[tuple[int, dict]] = []
+    for row_number, row in chunk:
+        if row["user_name"] in existing_names:
+            report.conflicts.append(ImportConflict(row = row_number, user_name = row["user_name"], reason = "User exists"))
+        else:
+            new_rows.append((row_number, row))
+    if not new_rows:
+        return
+
+    hashes = hash_passwords([row["password"] for _, row in new_rows], executor, max_workers)
+    user_models = [
+        UserModel(
+            user_name = row["user_name"],
+            email = row["email"],
+            password_hash = hashed,
+            is_admin = row["is_admin"],
+            is_active = row["is_active"],
+        )
+        for (_, row), hashed in zip(new_rows, hashes)
+    ]
+
+    ## Whole chunk in one transaction, falling back to row by row if anything conflicts
+    try:
+        session.add_all(user_models)
+        session.commit()
+        report.created += len(user_models)
+    except IntegrityError:
+        session.rollback()
+        for (row_number, row), user_model in zip(new_rows, user_models):
+            try:
+                session.add(user_model)
+                session.commit()
+                report.created += 1
+            except IntegrityError as e:
+                session.rollback()
+                report.conflicts.append(ImportConflict(row = row_number, user_name = row["user_name"], reason = f"Integrity error: {e.orig}"))
+
+    ## Keep memory flat over chunks: drop this chunk's users only, the caller's objects stay attached
+    for user_model in user_models:
+        if user_model in session:
+            session.expunge(user_model)